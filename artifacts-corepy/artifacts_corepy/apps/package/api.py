@@ -346,11 +346,8 @@ class UnitDesignPackages(WeCubeResource):
             url_info = self.download_url_parse(download_url)
             r_nexus_client = nexus.NeuxsClient(CONF.wecube.nexus.server, CONF.wecube.nexus.username,
                                                CONF.wecube.nexus.password)
-            nexus_files = r_nexus_client.list(url_info['repository'], url_info['group'])
-            nexus_md5 = None
-            for f in nexus_files:
-                if f['name'] == url_info['filename']:
-                    nexus_md5 = f['md5']
+            nexus_file = r_nexus_client.find_asset(url_info['repository'], url_info['group'], url_info['filename'])
+            nexus_md5 = nexus_file['md5'] if nexus_file else None
             # ignore unit_design.artifact_path update
             # update_unit_design = {}
             # update_unit_design['guid'] = unit_design['data']['guid']
@@ -6,6 +6,7 @@ import copy
 import datetime
 import hashlib
 import fnmatch
+import functools
 import os
 import logging
 import collections
@@ -25,15 +26,24 @@ from talos.db import validator
 from talos.core.i18n import _
 from talos.utils import scoped_globals
 
+from artifacts_corepy.common import archive
 from artifacts_corepy.common import exceptions
+from artifacts_corepy.common import hashing
 from artifacts_corepy.common import nexus
+from artifacts_corepy.common import package_cache
+from artifacts_corepy.common import package_diff
+from artifacts_corepy.common import package_manifest
 from artifacts_corepy.common import s3
+from artifacts_corepy.common import resilience
+from artifacts_corepy.common import ttl_cache
 from artifacts_corepy.common import wecmdbv2 as wecmdb
 from artifacts_corepy.common import utils as artifact_utils
 from artifacts_corepy.common import constant
 
 LOG = logging.getLogger(__name__)
 CONF = config.CONF
+# 进程内相同物料包的并发下载合并为一次
+PACKAGE_CACHE_FLIGHTS = artifact_utils.SingleFlight()
 
 # Common
 field_pkg_baseline_package_name = 'baseline_package'
@@ -127,6 +137,14 @@ if field_diff_conf_tpl_map_str.strip():
         LOG.error('Failed to parse ARTIFACTS_DIFF_CONF_TEMPLATE_MAP: %s', field_diff_conf_tpl_map_str)
         LOG.exception(e)  
 
+# 各查询需要的物料包字段(resultColumns)，避免查询出文件清单等大字段；
+# 列表接口返回的行被界面用于继承基线包配置，仅在调用方指定resultColumns时裁剪
+# 包文件读取：定位包内容
+PACKAGE_CONTENT_COLUMNS = ('guid', 'deploy_package_url', 'md5_value')
+PACKAGE_GUID_COLUMNS = ('guid', )
+PACKAGE_KEY_NAME_COLUMNS = ('guid', 'key_name')
+
+
 def is_upload_local_enabled():
     return utils.bool_from_string(CONF.wecube.upload_enabled)
 
@@ -140,14 +158,9 @@ def remove_prefix(text, prefix):
     return text
 
 def calculate_md5(fileobj):
-    hasher = hashlib.md5()
-    chunk_size = 64 * 1024
+    # 在摘要线程池中计算，不阻塞当前worker的其他请求
     fileobj.seek(0)
-    chunk = fileobj.read(chunk_size)
-    while chunk:
-        hasher.update(chunk)
-        chunk = fileobj.read(chunk_size)
-    return hasher.hexdigest()
+    return hashing.run(hashing.md5_fileobj, fileobj)
 
 
 def calculate_file_md5(filepath):
@@ -227,16 +240,13 @@ class SystemDesign(WeCubeResource):
                 "operator": "ne",
                 "value": ""
             }],
-            "paging":
-            False,
             "sorting": {
                 "asc": False,
                 "field": "confirm_time"
             }
         }
-        resp_json = cmdb_client.retrieve(CONF.wecube.wecmdb.citypes.system_design, query)
         last_version = collections.OrderedDict()
-        for content in resp_json['data']['contents']:
+        for content in cmdb_client.iterate(CONF.wecube.wecmdb.citypes.system_design, query):
             r_guid = content['guid']
             if r_guid not in last_version:
                 last_version[r_guid] = content
@@ -291,18 +301,19 @@ class CiTypes(WeCubeResource):
         if isinstance(status, list):
             status = ','.join(status)
         query = {"with-attributes": with_attributes, "status": status, "attr-type-status": status}
-        resp_json = cmdb_client.citypes(query)
-        return resp_json['data']
+        # CI类型定义极少变化，使用元数据缓存
+        return ttl_cache.CACHE.get_or_load('citypes', query, lambda: cmdb_client.citypes(query)['data'])
 
     def get_references(self, ci_type_id):
         cmdb_client = self.get_cmdb_client()
-        resp_json = cmdb_client.citype_refs(ci_type_id)
-        return [item for item in resp_json['data'] if item['inputType'] in ["ref", "multiRef"]]
+        refs = ttl_cache.CACHE.get_or_load('citype_refs', ci_type_id,
+                                           lambda: cmdb_client.citype_refs(ci_type_id)['data'])
+        return [item for item in refs if item['inputType'] in ["ref", "multiRef"]]
 
     def get_attributes(self, accept_types, ci_type_id):
         cmdb_client = self.get_cmdb_client()
-        resp_json = cmdb_client.citype_attrs(ci_type_id)
-        attrs = resp_json['data']
+        attrs = ttl_cache.CACHE.get_or_load('citype_attrs', ci_type_id,
+                                            lambda: cmdb_client.citype_attrs(ci_type_id)['data'])
         attrs.sort(key=lambda x: x['uiFormOrder'])
         return attrs
 
@@ -326,15 +337,25 @@ class CiTypes(WeCubeResource):
 class EnumCodes(WeCubeResource):
     def get(self, cat_id):
         cmdb_client = self.get_cmdb_client()
-        resp_json = cmdb_client.enumcodes(cat_id)
-        return resp_json['data']
+        return ttl_cache.CACHE.get_or_load('enumcodes', cat_id, lambda: cmdb_client.enumcodes(cat_id)['data'])
 
 
 class CITypeOperations(WeCubeResource):
     def get(self, ci_type_id):
         cmdb_client = self.get_cmdb_client()
-        resp_json = cmdb_client.ci_operations(ci_type_id)
-        return resp_json['data']
+        return ttl_cache.CACHE.get_or_load('ci_operations', ci_type_id,
+                                           lambda: cmdb_client.ci_operations(ci_type_id)['data'])
+
+
+class MetadataCache(object):
+    def purge(self, data):
+        return ttl_cache.CACHE.purge((data or {}).get('namespace', None))
+
+
+class UpstreamStatus(object):
+    def get(self):
+        # 熔断状态记录在各worker进程内
+        return {'pid': os.getpid(), 'breakers': resilience.get_stats()}
 
 
 class PackageHistory(WeCubeResource):
@@ -345,24 +366,17 @@ class PackageHistory(WeCubeResource):
 
 
 class UnitDesignPackages(WeCubeResource):
-    def set_package_query_fields(self, query):
-        # query.setdefault('resultColumns', [
-        #     "baseline_package", "code", "deploy_package_url", "db_upgrade_file_path", "db_rollback_file_path",
-        #     "description", "package_type", "stop_file_path", "start_file_path", "state", "fixed_date", "unit_design",
-        #     "is_decompression", "db_deploy_file_path", "created_by", "db_rollback_directory", "key_name",
-        #     "db_upgrade_directory", "upload_time", "upload_user", "deploy_file_path", "diff_conf_file",
-        #     "db_diff_conf_file", "name", "updated_by", "guid", "created_date", "updated_date", "md5_value", "state_code"
-        # ])
-        pass
+    def set_package_query_fields(self, query, columns):
+        wecmdb.set_result_columns(query, columns)
 
     def list_by_post(self, query, unit_design_id):
         cmdb_client = self.get_cmdb_client()
         query.setdefault('dialect', {"queryMode": "new"})
         query.setdefault('filters', [])
         query.setdefault('paging', False)
-        self.set_package_query_fields(query)
         query['filters'].append({"name": "unit_design", "operator": "eq", "value": unit_design_id})
         resp_json = cmdb_client.retrieve(CONF.wecube.wecmdb.citypes.deploy_package, query)
+        columns = set(query.get('resultColumns', None) or [])
         for i in resp_json['data']['contents']:
             i[field_pkg_package_type_name] = i.get(field_pkg_package_type_name, constant.PackageType.default) or constant.PackageType.default
             i[field_pkg_is_decompression_name] = i.get(field_pkg_is_decompression_name, field_pkg_is_decompression_default_value) or field_pkg_is_decompression_default_value
@@ -372,33 +386,54 @@ class UnitDesignPackages(WeCubeResource):
                   field_pkg_start_file_path_name, field_pkg_stop_file_path_name,
                   field_pkg_log_file_directory_name,field_pkg_log_file_trade_name, 
                   field_pkg_log_file_keyword_name, field_pkg_log_file_metric_name, field_pkg_log_file_trace_name,)
+            # 未查询的文件清单字段不返回
             for field in fields:
-                i[field] = self.build_file_object(i.get(field, None))
+                if not columns or field in columns or field in i:
+                    i[field] = self.build_file_object(i.get(field, None))
             # db部署支持
             fields = (field_pkg_db_deploy_file_directory_name, field_pkg_db_deploy_file_path_name,
                   field_pkg_db_diff_conf_directory_name, field_pkg_db_diff_conf_file_name,
                   field_pkg_db_upgrade_directory_name, field_pkg_db_rollback_file_path_name, 
                   field_pkg_db_rollback_directory_name, field_pkg_db_upgrade_file_path_name,)
             for field in fields:
-                i[field] = self.build_file_object(i.get(field, None))
+                if not columns or field in columns or field in i:
+                    i[field] = self.build_file_object(i.get(field, None))
         return resp_json['data']
 
     def get_package_statistics(self, post_data, unit_design_id):
+        post_data = post_data or {}
+        # 统计结果与用户权限相关，按token区分缓存(仅保存token摘要)
+        key = {
+            'unit_design': unit_design_id,
+            'query': post_data,
+            'token': hashlib.sha1((self.token or '').encode()).hexdigest()
+        }
+        return ttl_cache.CACHE.get_or_load('package_statistics', key,
+                                           lambda: self._get_package_statistics(copy.deepcopy(post_data),
+                                                                                unit_design_id))
+
+    def _get_package_statistics(self, post_data, unit_design_id):
         cmdb_client = self.get_cmdb_client()
         result = {}
-        post_data = post_data or {}
         query = post_data
         query.setdefault('dialect', {"queryMode": "new"})
         query.setdefault('filters', [])
         query.setdefault('paging', True)
         query.setdefault('pageable', {'pageSize':1, 'startIndex': 1})
-        self.set_package_query_fields(query)
+        self.set_package_query_fields(query, PACKAGE_GUID_COLUMNS)
         query['filters'].append({"name": "unit_design", "operator": "eq", "value": unit_design_id})
-        for t in  [constant.PackageType.app, constant.PackageType.db, constant.PackageType.mixed, constant.PackageType.image, constant.PackageType.rule]:
+
+        def _count(t):
             query_tmp = copy.deepcopy(query)
             query_tmp['filters'].append({"name": field_pkg_package_type_name, "operator": "eq", "value": t})
             resp_json = cmdb_client.retrieve(CONF.wecube.wecmdb.citypes.deploy_package, query_tmp)
-            result[t] = resp_json['data']['pageInfo']['totalRows']
+            return resp_json['data']['pageInfo']['totalRows']
+
+        package_types = [constant.PackageType.app, constant.PackageType.db, constant.PackageType.mixed,
+                         constant.PackageType.image, constant.PackageType.rule]
+        # 各类型的统计查询并发执行
+        for t, total in zip(package_types, artifact_utils.map_concurrently(_count, package_types)):
+            result[t] = total
         return result
 
     def build_file_object(self, filenames, spliter=None):
@@ -527,6 +562,16 @@ class UnitDesignPackages(WeCubeResource):
                         artifact_repository = CONF.nexus.repository
                     with open(filename, 'rb') as fileobj:
                         upload_result = nexus_client.upload(artifact_repository, artifact_path, filename, 'application/octet-stream', fileobj)
+                    # 包记录尚未创建，按实际计算的校验值预热缓存，guid索引在使用时建立；
+                    # 包配置中的校验值来自上传内容，不可信，不一致时以计算值为准
+                    file_md5 = calculate_file_md5(filename)
+                    if deploy_package is not None:
+                        claimed_md5 = package_cache.normalize_checksum(deploy_package.get('md5_value'))
+                        if claimed_md5 and claimed_md5 != file_md5:
+                            LOG.warning('compose package: %s md5 mismatch, claimed: %s, actual: %s',
+                                        os.path.basename(filename), claimed_md5, file_md5)
+                        deploy_package['md5_value'] = file_md5
+                        self.warm_package_cache(filename, file_md5)
                     new_download_url = upload_result['downloadUrl'].replace(nexus_server,
                                                                             CONF.wecube.server.rstrip('/') + '/artifacts')
             if deploy_package is None :
@@ -563,7 +608,7 @@ class UnitDesignPackages(WeCubeResource):
             # 创建新的差异化变量项
             if new_diff_configs:
                 cmdb_client = self.get_cmdb_client()
-                cmdb_client.create(CONF.wecube.wecmdb.citypes.diff_config, [{
+                cmdb_client.bulk('create', CONF.wecube.wecmdb.citypes.diff_config, [{
                     'code': key,
                     'variable_name': key,
                     'description': key,
@@ -582,7 +627,7 @@ class UnitDesignPackages(WeCubeResource):
                         bind_db_diff_configs.add(finder[diff_conf['key']]['guid'])
             if update_diff_configs:
                 cmdb_client = self.get_cmdb_client()
-                cmdb_client.update(CONF.wecube.wecmdb.citypes.diff_config, [{
+                cmdb_client.bulk('update', CONF.wecube.wecmdb.citypes.diff_config, [{
                     'guid': key,
                     'variable_value': value['diffExpr']
                 } for key,value in update_diff_configs.items()])
@@ -700,6 +745,7 @@ class UnitDesignPackages(WeCubeResource):
             }],
             "paging": False
         }
+        wecmdb.set_result_columns(query, PACKAGE_GUID_COLUMNS)
         resp_json = cmdb_client.retrieve(CONF.wecube.wecmdb.citypes.deploy_package, query)
         if not resp_json.get('data', {}).get('contents', []):
             return None
@@ -726,7 +772,8 @@ class UnitDesignPackages(WeCubeResource):
 
     def _get_diff_configs_by_keyname(self, key_names):
         cmdb_client = self.get_cmdb_client()
-        if key_names:
+
+        def _retrieve(names):
             diff_config_query = {
                 "dialect": {
                     "queryMode": "new"
@@ -734,16 +781,21 @@ class UnitDesignPackages(WeCubeResource):
                 "filters": [{
                     "name": "key_name",
                     "operator": "in",
-                    "value": key_names
+                    "value": names
                 }],
                 "paging": False
             }
             resp_json = cmdb_client.retrieve(CONF.wecube.wecmdb.citypes.diff_config, diff_config_query)
-            # if not resp_json.get('data', {}).get('contents', []):
-            #     raise exceptions.NotFoundError(message=_("Can not find ci data for key_names [%(names)s]") %
-            #                                {'names': key_names})
             return resp_json['data']['contents']
-        return []
+
+        # 变量较多时按批并发查询，避免单个in查询过大
+        chunk_size = int(utils.get_config(CONF, 'cmdb_client.bulk_chunk_size', 200) or 200)
+        max_workers = int(utils.get_config(CONF, 'cmdb_client.bulk_workers', 4) or 4)
+        chunks = [key_names[idx:idx + chunk_size] for idx in range(0, len(key_names or []), chunk_size)]
+        results = []
+        for contents in artifact_utils.map_concurrently(_retrieve, chunks, max_workers=max_workers):
+            results.extend(contents)
+        return results
     
     def _pack_compose_package(self, pack_filepath, deploy_package_id:str):
         deploy_package = self._get_deploy_package_by_id(deploy_package_id)
@@ -841,6 +893,7 @@ class UnitDesignPackages(WeCubeResource):
             package_rows[0]['guid'] = exist_package['guid']
             package_result = self.pure_update(package_rows)
         new_package_guid = package_result['data'][0]['guid']
+        self.warm_package_cache_from_fileobj(filename, fileobj, package_rows[0]['md5_value'], new_package_guid)
         new_deploy_attrs = self._analyze_package_attrs(new_package_guid, baseline_package, {
             field_pkg_package_type_name: package_type
         })
@@ -890,11 +943,8 @@ class UnitDesignPackages(WeCubeResource):
             
             r_nexus_client = nexus.NeuxsClient(CONF.wecube.nexus.server, CONF.wecube.nexus.username,
                                                CONF.wecube.nexus.password)
-            nexus_files = r_nexus_client.list(url_info['repository'], url_info['group'])
-            nexus_md5 = None
-            for f in nexus_files:
-                if f['name'] == url_info['filename']:
-                    nexus_md5 = f['md5']
+            nexus_file = r_nexus_client.find_asset(url_info['repository'], url_info['group'], url_info['filename'])
+            nexus_md5 = nexus_file['md5'] if nexus_file else None
             # ignore unit_design.artifact_path update
             # update_unit_design = {}
             # update_unit_design['guid'] = unit_design['data']['guid']
@@ -973,6 +1023,8 @@ class UnitDesignPackages(WeCubeResource):
                         package_rows[0]['guid'] = exist_package['guid']
                         package_result = self.pure_update(package_rows)
                     new_package_guid = package_result['data'][0]['guid']
+                    self.warm_package_cache_from_fileobj(filename, fileobj, package_rows[0]['md5_value'],
+                                                         new_package_guid)
                     new_deploy_attrs = self._analyze_package_attrs(new_package_guid, baseline_package, {
                         field_pkg_package_type_name: package_type
                     })
@@ -1065,6 +1117,10 @@ class UnitDesignPackages(WeCubeResource):
         try:
             clean_data_outer = crud.ColumnValidator.get_clean_data(param_rules, data, 'check')
             operator = clean_data_outer.get('operator', None) or 'N/A'
+            # 一次批量查询所有输入的单元设计，循环内按guid查询直接命中请求内缓存
+            self.get_cmdb_client().prefetch(
+                CONF.wecube.wecmdb.citypes.unit_design,
+                [item.get('unit_design', None) for item in clean_data_outer['inputs'] if isinstance(item, dict)])
             for idx, item in enumerate(clean_data_outer['inputs']):
                 single_result = {
                     'callbackParameter': item.get('callbackParameter', None),
@@ -1276,7 +1332,8 @@ class UnitDesignPackages(WeCubeResource):
         # 根据diff_conf_file计算变量进行更新绑定
         if field_pkg_diff_conf_file_name in data and auto_bind:
             bind_variables, new_create_variables = self._analyze_diff_var(deploy_package['guid'], deploy_package['deploy_package_url'], 
-                                   deploy_package[field_pkg_diff_conf_file_name], data[field_pkg_diff_conf_file_name])
+                                   deploy_package[field_pkg_diff_conf_file_name], data[field_pkg_diff_conf_file_name],
+                                   package_checksum=deploy_package.get('md5_value'))
             if bind_variables is not None:
                 clean_data[field_pkg_diff_conf_var_name] = bind_variables
         # db部署支持
@@ -1290,7 +1347,8 @@ class UnitDesignPackages(WeCubeResource):
         # 根据diff_conf_file计算变量进行更新绑定
         if field_pkg_db_diff_conf_file_name in data and db_auto_bind:
             bind_variables, new_create_variables = self._analyze_diff_var(deploy_package['guid'], deploy_package['deploy_package_url'], 
-                                   deploy_package[field_pkg_db_diff_conf_file_name], data[field_pkg_db_diff_conf_file_name])
+                                   deploy_package[field_pkg_db_diff_conf_file_name], data[field_pkg_db_diff_conf_file_name],
+                                   package_checksum=deploy_package.get('md5_value'))
             if bind_variables is not None:
                 clean_data[field_pkg_db_diff_conf_var_name] = bind_variables
         if db_upgrade_detect:
@@ -1311,7 +1369,7 @@ class UnitDesignPackages(WeCubeResource):
         return resp_json['data']
 
 
-    def _analyze_diff_var(self, package_id, package_url, origin_conf_list, new_conf_list):
+    def _analyze_diff_var(self, package_id, package_url, origin_conf_list, new_conf_list, package_checksum=None):
         '''
         conf_list是列表，每个元素是string 或 dict[{configKeyInfos，filename}]
         
@@ -1330,9 +1388,9 @@ class UnitDesignPackages(WeCubeResource):
         # diff_conf_file值并未发生改变，无需下载文件更新变量
         # LOG.debug("new_diff_conf_file_list: %s, old_diff_conf_file_list: %s", new_diff_conf_file_list,old_diff_conf_file_list)
         if new_diff_conf_file_list != old_diff_conf_file_list:
-            package_cached_dir = self.ensure_package_cached(package_id,
-                                                            package_url)
-            self.update_file_variable(package_cached_dir, new_conf_list)
+            # 仅需读取差异化配置文件，无需完整解压
+            package_files = self.ensure_package_indexed(package_id, package_url, package_checksum)
+            self.update_file_variable(package_files, new_conf_list)
             # LOG.debug("new_conf_list: %s", new_conf_list)
             # 差异化配置项的差异
             package_diff_configs = []
@@ -1380,7 +1438,7 @@ class UnitDesignPackages(WeCubeResource):
                             # 替换模板值 $& var_name &$
                             replace_pattern = r'\$&\s*([a-zA-Z0-9_-]+?)\s*\$&'
                             diff_conf['value'] = re.sub(replace_pattern, var_name, diff_conf_tpl)
-                resp_json = cmdb_client.create(CONF.wecube.wecmdb.citypes.diff_config, [{
+                resp_json = cmdb_client.bulk('create', CONF.wecube.wecmdb.citypes.diff_config, [{
                     'code': c,
                     'variable_name': c,
                     'description': c,
@@ -1394,8 +1452,20 @@ class UnitDesignPackages(WeCubeResource):
         return None, None
 
     def find_files_by_status(self, baseline_id, package_id, source_dirs, status):
+        files = self.filetree(None, package_id, baseline_id, False, source_dirs, with_dir=False, recursive=True,
+                              with_md5=False)
+        return self._filter_files_by_status(files, status)
+
+    def _find_files_by_snapshot(self, snapshot, source_dirs, status):
+        '''
+        同find_files_by_status，基于已获取的对比快照，无需重复查询CMDB及对比
+        '''
+        files = self._get_file_list(snapshot.baseline_files, snapshot.package_files, source_dirs, with_dir=False,
+                                    recursive=True, with_md5=False, diff_results=snapshot.results)
+        return self._filter_files_by_status(files, status)
+
+    def _filter_files_by_status(self, files, status):
         results = []
-        files = self.filetree(None, package_id, baseline_id, False, source_dirs, with_dir=False, recursive=True)
         for f in files:
             if f['exists'] and not f['isDir'] and f['comparisonResult'] in status:
                 # convert data field
@@ -1454,8 +1524,10 @@ class UnitDesignPackages(WeCubeResource):
         # 确认baselin和package文件已下载并解压缓存在本地(加锁)
         if baseline_package:
             baseline_cached_dir = self.ensure_package_cached(baseline_package['guid'],
-                                                             baseline_package['deploy_package_url'])
-        package_cached_dir = self.ensure_package_cached(deploy_package['guid'], deploy_package['deploy_package_url'])
+                                                             baseline_package['deploy_package_url'],
+                                                             baseline_package.get('md5_value'))
+        package_cached_dir = self.ensure_package_cached(deploy_package['guid'], deploy_package['deploy_package_url'],
+                                                        deploy_package.get('md5_value'))
         # common 字段
         result[field_pkg_is_decompression_name] = utils.bool_from_string(deploy_package[field_pkg_is_decompression_name], default=True)
         result[field_pkg_package_type_name] = deploy_package[field_pkg_package_type_name]
@@ -1490,13 +1562,13 @@ class UnitDesignPackages(WeCubeResource):
         package_app_diff_configs = []
         if result[field_pkg_package_type_name] in (constant.PackageType.app, constant.PackageType.mixed):
             # 更新差异化配置文件的变量列表
-            self.update_file_variable(package_cached_dir, result[field_pkg_diff_conf_file_name])
+            self.update_file_variable(archive.DirectoryArchive(package_cached_dir), result[field_pkg_diff_conf_file_name])
             for conf_file in result[field_pkg_diff_conf_file_name]:
                 package_app_diff_configs.extend(conf_file['configKeyInfos'])
         package_db_diff_configs = []
         if result[field_pkg_package_type_name] in (constant.PackageType.db, constant.PackageType.mixed):
             # 更新差异化配置文件的变量列表
-            self.update_file_variable(package_cached_dir, result[field_pkg_db_diff_conf_file_name])
+            self.update_file_variable(archive.DirectoryArchive(package_cached_dir), result[field_pkg_db_diff_conf_file_name])
             for conf_file in result[field_pkg_db_diff_conf_file_name]:
                 package_db_diff_configs.extend(conf_file['configKeyInfos'])
         query_diff_configs = []
@@ -1534,10 +1606,12 @@ class UnitDesignPackages(WeCubeResource):
         baseline_package = self._get_deploy_package_by_id(baseline_package_id)
         baseline_cached_dir = None
         package_cached_dir = None
-        # 确认baseline和package文件已下载并解压缓存在本地(加锁)
-        baseline_cached_dir = self.ensure_package_cached(baseline_package['guid'],
-                                                         baseline_package['deploy_package_url'])
-        package_cached_dir = self.ensure_package_cached(deploy_package['guid'], deploy_package['deploy_package_url'])
+        # 全量对比需要遍历整个目录树，使用解压缓存
+        baseline_cached_dir = self.ensure_package_files(baseline_package['guid'],
+                                                        baseline_package['deploy_package_url'],
+                                                        baseline_package.get('md5_value'))
+        package_cached_dir = self.ensure_package_files(deploy_package['guid'], deploy_package['deploy_package_url'],
+                                                       deploy_package.get('md5_value'))
         package_type = baseline_package.get(field_pkg_package_type_name,
                                             constant.PackageType.default) or constant.PackageType.default
         is_decompression = baseline_package.get(field_pkg_is_decompression_name,
@@ -1548,7 +1622,7 @@ class UnitDesignPackages(WeCubeResource):
             field_pkg_package_type_name: package_type,
             field_pkg_is_decompression_name: is_decompression,
             field_pkg_key_service_code_name: key_service_code
-        })
+        }, deploy_package=deploy_package, baseline_package=baseline_package)
 
         result = {}
         result[field_pkg_package_type_name] = package_type
@@ -1593,7 +1667,7 @@ class UnitDesignPackages(WeCubeResource):
             }],
             "paging": False
         }
-        self.set_package_query_fields(query)
+        self.set_package_query_fields(query, PACKAGE_CONTENT_COLUMNS)
         resp_json = cmdb_client.retrieve(CONF.wecube.wecmdb.citypes.deploy_package, query)
         if not resp_json.get('data', {}).get('contents', []):
             raise exceptions.NotFoundError(message=_("Can not find ci data for guid [%(rid)s]") %
@@ -1612,32 +1686,30 @@ class UnitDesignPackages(WeCubeResource):
                 }],
                 "paging": False
             }
-            self.set_package_query_fields(query)
+            self.set_package_query_fields(query, PACKAGE_CONTENT_COLUMNS)
             resp_json = cmdb_client.retrieve(CONF.wecube.wecmdb.citypes.deploy_package, query)
             if not resp_json.get('data', {}).get('contents', []):
                 raise exceptions.NotFoundError(message=_("Can not find ci data for guid [%(rid)s]") %
                                                {'rid': baseline_package_id})
             baseline_package = resp_json['data']['contents'][0]
-        # 确认baselin和package文件已下载并解压缓存在本地(加锁)
-        baseline_cached_dir = None
-        package_cached_dir = None
-        package_cached_dir = self.ensure_package_cached(deploy_package['guid'], deploy_package['deploy_package_url'])
+        # 确认baselin和package文件可读取(已解压缓存或仅下载并建立成员索引)
+        b_package_files = None
+        package_files = self.ensure_package_indexed(deploy_package['guid'], deploy_package['deploy_package_url'],
+                                                    deploy_package.get('md5_value'))
         if baseline_package:
-            baseline_cached_dir = self.ensure_package_cached(baseline_package['guid'],
-                                                             baseline_package['deploy_package_url'])
+            b_package_files = self.ensure_package_indexed(baseline_package['guid'],
+                                                          baseline_package['deploy_package_url'],
+                                                          baseline_package.get('md5_value'))
         results = []
         max_length = data.get('content_length', None) or -1
         for f in data['files']:
-            package_filepath = os.path.join(package_cached_dir, f['path'])
-            exists = os.path.exists(package_filepath)
-            is_dir = os.path.isdir(package_filepath)
-            b_package_filepath = None
+            exists = package_files.exists(f['path'])
+            is_dir = package_files.isdir(f['path'])
             b_exists = None
             b_is_dir = None
             if baseline_package:
-                b_package_filepath = os.path.join(baseline_cached_dir, f['path'])
-                b_exists = os.path.exists(b_package_filepath)
-                b_is_dir = os.path.isdir(b_package_filepath)
+                b_exists = b_package_files.exists(f['path'])
+                b_is_dir = b_package_files.isdir(f['path'])
             if exists is False and (b_exists is False or (not baseline_package and not b_exists)):
                 raise exceptions.PluginError(message=_('%(file)s not exists in both package & baseline package') %
                                              {'file': f['path']})
@@ -1645,60 +1717,48 @@ class UnitDesignPackages(WeCubeResource):
                 raise exceptions.PluginError(message=_('%(file)s is dir, not regular file') % {'file': f['path']})
             result = {'path': f['path'], 'content': '', 'baseline_content': ''}
             if not is_dir and exists:
-                with open(package_filepath, errors='replace') as f:
-                    result['content'] = f.read(max_length)
+                result['content'] = package_files.read_text(f['path'], max_length)
             if not b_is_dir and b_exists:
-                with open(b_package_filepath, errors='replace') as f:
-                    result['baseline_content'] = f.read(max_length)
+                result['baseline_content'] = b_package_files.read_text(f['path'], max_length)
             results.append(result)
         return results
 
     def update_tree_status(self, baseline_path, package_path, nodes):
-        self.update_file_status(baseline_path, package_path, nodes, file_key='name')
+        # 节点path为相对物料包根目录的路径，递归时无需拼接子目录
+        self.update_file_status(baseline_path, package_path, nodes, file_key='path')
+        for n in nodes:
+            if n['children'] and n['isDir']:
+                if baseline_path and n['comparisonResult'] == 'same':
+                    # 目录树哈希一致，子孙节点无需再与基线对比
+                    self._update_tree_same(package_path, n['children'])
+                else:
+                    self.update_tree_status(baseline_path, package_path, n['children'])
+
+    def _update_tree_same(self, package_path, nodes):
+        self.update_file_status(None, package_path, nodes, file_key='path')
         for n in nodes:
-            subpath = n['name']
+            if n['exists']:
+                n['comparisonResult'] = 'same'
             if n['children'] and n['isDir']:
-                self.update_tree_status(None if not baseline_path else os.path.join(baseline_path, subpath),
-                                        os.path.join(package_path, subpath), n['children'])
+                self._update_tree_same(package_path, n['children'])
 
     def _scan_dir(self, basepath, subpath, with_dir=True, recursive=False):
         results = []
-        path = os.path.join(basepath, subpath)
-        if os.path.exists(path) and os.path.isdir(path):
-            if recursive:
-                for _root, _dirs, _files in os.walk(path):
-                    if with_dir:
-                        for d in _dirs:
-                            results.append({
-                                'children': [],
-                                'comparisonResult': None,
-                                'exists': True,
-                                'isDir': True,
-                                'md5': None,
-                                'name': d,
-                                'path': os.path.join(_root, d)[len(basepath) + 1:],
-                            })
-                    for f in _files:
-                        results.append({
-                            'children': [],
-                            'comparisonResult': None,
-                            'exists': True,
-                            'isDir': False,
-                            'md5': None,
-                            'name': f,
-                            'path': os.path.join(_root, f)[len(basepath) + 1:],
-                        })
-            else:
-                for e in os.scandir(path):
-                    results.append({
-                        'children': [],
-                        'comparisonResult': None,
-                        'exists': True,
-                        'isDir': e.is_dir(),
-                        'md5': None,
-                        'name': e.name,
-                        'path': e.path[len(basepath) + 1:],
-                    })
+        package_files = self.get_package_files(basepath)
+        if package_files.isdir(subpath):
+            entries = package_files.walk(subpath) if recursive else package_files.listdir(subpath)
+            for e in entries:
+                if recursive and not with_dir and e.is_dir:
+                    continue
+                results.append({
+                    'children': [],
+                    'comparisonResult': None,
+                    'exists': True,
+                    'isDir': e.is_dir,
+                    'md5': None,
+                    'name': os.path.basename(e.path),
+                    'path': e.path,
+                })
         results.sort(key=lambda x: x['name'], reverse=False)
         return results
 
@@ -1709,7 +1769,8 @@ class UnitDesignPackages(WeCubeResource):
                  expand_all,
                  files,
                  with_dir=True,
-                 recursive=False):
+                 recursive=False,
+                 with_md5=True):
 
         def _add_children_node(filename, subpath, file_list, is_dir=False):
             node = None
@@ -1775,20 +1836,6 @@ class UnitDesignPackages(WeCubeResource):
                             _add_children_node(filename, subpath, path_nodes)
             return root_nodes
 
-        def _get_file_list(baseline_path, package_path, file_list, with_dir, recursive):
-            results = []
-            for f in file_list:
-                new_f = f.lstrip('/')
-                parts = new_f.split('/')
-                subpath = os.path.join(*[p for p in parts if p not in ('', '.', '..')])
-                new_file_list = self._scan_dir(package_path, subpath, with_dir=with_dir, recursive=recursive)
-                self.update_file_status(None if not baseline_path else baseline_path,
-                                        package_path,
-                                        new_file_list,
-                                        file_key='path')
-                results.extend(new_file_list)
-            return results
-
         cmdb_client = self.get_cmdb_client()
         query = {
             "dialect": {
@@ -1801,7 +1848,7 @@ class UnitDesignPackages(WeCubeResource):
             }],
             "paging": False
         }
-        self.set_package_query_fields(query)
+        self.set_package_query_fields(query, PACKAGE_CONTENT_COLUMNS)
         resp_json = cmdb_client.retrieve(CONF.wecube.wecmdb.citypes.deploy_package, query)
         if not resp_json.get('data', {}).get('contents', []):
             raise exceptions.NotFoundError(message=_("Can not find ci data for guid [%(rid)s]") %
@@ -1820,60 +1867,102 @@ class UnitDesignPackages(WeCubeResource):
                 }],
                 "paging": False
             }
-            self.set_package_query_fields(query)
+            self.set_package_query_fields(query, PACKAGE_CONTENT_COLUMNS)
             resp_json = cmdb_client.retrieve(CONF.wecube.wecmdb.citypes.deploy_package, query)
             if not resp_json.get('data', {}).get('contents', []):
                 raise exceptions.NotFoundError(message=_("Can not find ci data for guid [%(rid)s]") %
                                                {'rid': baseline_package_id})
             baseline_package = resp_json['data']['contents'][0]
+        # 目录浏览需要全部文件的md5及对比结果，使用解压缓存(md5来自文件清单)
         baseline_cached_dir = None
         package_cached_dir = None
         if baseline_package:
-            baseline_cached_dir = self.ensure_package_cached(baseline_package['guid'],
-                                                             baseline_package['deploy_package_url'])
-        package_cached_dir = self.ensure_package_cached(deploy_package['guid'], deploy_package['deploy_package_url'])
+            baseline_cached_dir = self.ensure_package_files(baseline_package['guid'],
+                                                            baseline_package['deploy_package_url'],
+                                                            baseline_package.get('md5_value'))
+        package_cached_dir = self.ensure_package_files(deploy_package['guid'], deploy_package['deploy_package_url'],
+                                                       deploy_package.get('md5_value'))
         results = []
         if expand_all:
             results = _generate_tree_from_list(package_cached_dir, files)
             self.update_tree_status(baseline_cached_dir, package_cached_dir, results)
         else:
-            results = _get_file_list(baseline_cached_dir,
-                                     package_cached_dir,
-                                     files,
-                                     with_dir=with_dir,
-                                     recursive=recursive)
+            results = self._get_file_list(baseline_cached_dir,
+                                          package_cached_dir,
+                                          files,
+                                          with_dir=with_dir,
+                                          recursive=recursive,
+                                          with_md5=with_md5)
+        return results
+
+    def _get_file_list(self, baseline_path, package_path, file_list, with_dir, recursive, with_md5=True,
+                       diff_results=None):
+        results = []
+        for f in file_list:
+            new_f = f.lstrip('/')
+            parts = new_f.split('/')
+            subpath = os.path.join(*[p for p in parts if p not in ('', '.', '..')])
+            new_file_list = self._scan_dir(package_path, subpath, with_dir=with_dir, recursive=recursive)
+            self.update_file_status(None if not baseline_path else baseline_path,
+                                    package_path,
+                                    new_file_list,
+                                    file_key='path',
+                                    with_md5=with_md5,
+                                    diff_results=diff_results)
+            results.extend(new_file_list)
         return results
 
-    def update_file_status(self, baseline_cached_dir, package_cached_dir, files, file_key='filename'):
+    def get_package_files(self, cached_dir_or_archive):
+        if isinstance(cached_dir_or_archive, str):
+            return archive.DirectoryArchive(cached_dir_or_archive)
+        return cached_dir_or_archive
+
+    def update_file_status(self, baseline_cached_dir, package_cached_dir, files, file_key='filename', with_md5=True,
+                           diff_results=None):
         '''
         更新文件内容：存在性，md5，文件/目录
+        
+        baseline_cached_dir/package_cached_dir为已解压缓存目录或archive对象，
+        对比状态取自持久化的全量对比结果(可由调用方传入)；with_md5=False时结果中不返回md5
         '''
+        b_package_files = self.get_package_files(baseline_cached_dir) if baseline_cached_dir else None
+        package_files = self.get_package_files(package_cached_dir)
+        if not baseline_cached_dir:
+            diff_results = {}
+        elif diff_results is None:
+            diff_results = package_diff.get_diff_results(package_files, b_package_files)
+        pairs = []
+        pending = []
         for i in files:
-            b_filepath = os.path.join(baseline_cached_dir, i[file_key]) if baseline_cached_dir else None
-            filepath = os.path.join(package_cached_dir, i[file_key])
-            b_exists = os.path.exists(b_filepath) if baseline_cached_dir else None
-            exists = os.path.exists(filepath)
-            b_md5 = None
+            member = package_files.get(i[file_key])
+            b_member = b_package_files.get(i[file_key]) if baseline_cached_dir else None
+            pairs.append((i, member, b_member))
+            if member is not None and not member.is_dir and with_md5:
+                pending.append(member.path)
+        # 需要读取内容的文件在摘要线程池中并发计算md5
+        package_files.prefetch_md5(pending)
+        for i, member, b_member in pairs:
+            b_exists = (b_member is not None) if baseline_cached_dir else None
+            exists = member is not None
             md5 = None
             if b_exists:
-                i['isDir'] = os.path.isdir(b_filepath)
-                if not i['isDir']:
-                    b_md5 = calculate_file_md5(b_filepath)
+                i['isDir'] = b_member.is_dir
             if exists:
-                i['isDir'] = os.path.isdir(filepath)
-                if not i['isDir']:
-                    md5 = calculate_file_md5(filepath)
+                i['isDir'] = member.is_dir
+                if not i['isDir'] and with_md5:
+                    md5 = package_files.md5(member.path)
             i['exists'] = exists
             i['md5'] = md5
             # check only baseline_cached_dir is valid
             if baseline_cached_dir:
                 # file type
                 if not i['isDir']:
+                    same = exists and b_exists and diff_results.get(member.path, (None, None))[1] == 'same'
                     # same
-                    if exists and b_exists and b_md5 == md5:
+                    if exists and b_exists and same:
                         i['comparisonResult'] = 'same'
                     # changed
-                    elif exists and b_exists and b_md5 != md5:
+                    elif exists and b_exists and not same:
                         i['comparisonResult'] = 'changed'
                     # new
                     elif exists and not b_exists:
@@ -1886,8 +1975,11 @@ class UnitDesignPackages(WeCubeResource):
                 else:
                     # dir type
                     # same
-                    if exists and b_exists:
+                    if exists and b_exists and diff_results.get(member.path, (None, None))[1] == 'same':
                         i['comparisonResult'] = 'same'
+                    # changed
+                    elif exists and b_exists:
+                        i['comparisonResult'] = 'changed'
                     # new
                     elif exists and not b_exists:
                         i['comparisonResult'] = 'new'
@@ -1901,11 +1993,11 @@ class UnitDesignPackages(WeCubeResource):
                 i['comparisonResult'] = 'deleted'
         return files
 
-    def update_file_variable(self, package_cached_dir, files):
+    def update_file_variable(self, package_files, files):
         '''
         解析文件差异化变量
         
-        files为[{filename: xxx}]格式
+        package_files为archive对象(已解压目录或未解压物料包)，files为[{filename: xxx}]格式
         '''
         spliters = []
         if CONF.encrypt_variable_prefix.strip():
@@ -1918,11 +2010,9 @@ class UnitDesignPackages(WeCubeResource):
             spliters.extend([s.strip() for s in CONF.global_variable_prefix.split(',')])
         spliters = [s for s in spliters if s]
         for i in files:
-            filepath = os.path.join(package_cached_dir, i['filename'])
-            if os.path.exists(filepath):
-                with open(filepath, errors='replace') as f:
-                    content = f.read()
-                    i['configKeyInfos'] = artifact_utils.variable_parse(content, spliters)
+            if package_files.exists(i['filename']) and not package_files.isdir(i['filename']):
+                content = package_files.read_text(i['filename'])
+                i['configKeyInfos'] = artifact_utils.variable_parse(content, spliters)
             else:
                 i['configKeyInfos'] = []
 
@@ -1956,37 +2046,181 @@ class UnitDesignPackages(WeCubeResource):
         return results
 
     def get_package_cached_path(self, guid):
-        cache_dir = CONF.pakcage_cache_dir
-        return os.path.join(cache_dir, guid)
+        return package_cache.get_package_path(guid)
+
+    def ensure_package_cached(self, guid, url, checksum=None):
+        # 按物料包内容校验值缓存，相同制品仅下载解压一次；无有效校验值时按guid缓存
+        checksum = package_cache.normalize_checksum(checksum)
+        if checksum:
+            file_cache_dir = package_cache.get_content_path(checksum)
+        else:
+            file_cache_dir = self.get_package_cached_path(guid)
+        # 先锁定再检查完成标记，避免检查通过后被淘汰
+        package_cache.pin_for_request(file_cache_dir)
+        if package_cache.is_complete(file_cache_dir):
+            LOG.info('using cache: %s for package: %s', file_cache_dir, guid)
+        else:
+            # 仅首次下载时加锁，缓存命中无需加锁；同一进程内的并发请求等待首个请求的下载结果
+            PACKAGE_CACHE_FLIGHTS.do(file_cache_dir,
+                                     functools.partial(self._fill_package_cache, guid, url, file_cache_dir),
+                                     timeout=300)
+        if checksum:
+            package_cache.link_package(guid, file_cache_dir)
+        package_cache.record_access(file_cache_dir)
+        return file_cache_dir
 
-    def ensure_package_cached(self, guid, url):
-        file_cache_dir = self.get_package_cached_path(guid)
+    def _fill_package_cache(self, guid, url, file_cache_dir, filepath=None):
+        # 跨进程通过文件锁保证只有一个下载方
         with artifact_utils.lock(hashlib.sha1(file_cache_dir.encode()).hexdigest(), timeout=300) as locked:
             if locked:
-                if os.path.exists(file_cache_dir):
+                if package_cache.is_complete(file_cache_dir):
                     LOG.info('using cache: %s for package: %s', file_cache_dir, guid)
+                elif filepath:
+                    self._install_package_file(guid, filepath, file_cache_dir)
                 else:
-                    with tempfile.TemporaryDirectory() as download_path:
-                        LOG.info('download from: %s for pakcage: %s', url, guid)
-                        filepath = self.download_from_url(download_path, url)
-                        LOG.info('download complete')
-                        LOG.info('unpack package: %s to %s', guid, file_cache_dir)
-                        try:
-                            artifact_utils.unpack_file(filepath, file_cache_dir)
-                        except Exception as e:
-                            shutil.rmtree(file_cache_dir, ignore_errors=True)
-                            LOG.error('unpack failed')
-                            if str(e).find('bad subsequent header') >= 0:
-                                raise exceptions.PluginError(message=_(
-                                    'unpack file error: %(detail)s, is file contains paxheader(mac archive) and modify with 7zip? (cause paxheader corruption)'
-                                    % {'detail': str(e)}))
-                            raise exceptions.PluginError(message=_('unpack file error: %(detail)s' %
-                                                                   {'detail': str(e)}))
-                        LOG.info('unpack complete')
+                    archive_file = None
+                    archive_path = package_cache.get_archive_path(file_cache_dir)
+                    if package_cache.is_complete(archive_path):
+                        package_cache.pin_for_request(archive_path)
+                        archive_file = archive.get_archive_file(archive_path)
+                    if archive_file:
+                        # 已按需读取时下载过物料包，直接解压本地文件
+                        self._install_package_file(guid, archive_file, file_cache_dir)
+                    else:
+                        self._install_package_cache(guid, url, file_cache_dir)
+            else:
+                raise OSError(_('failed to acquire lock, package cache may not be available'))
+        return file_cache_dir
+
+    def ensure_package_files(self, guid, url, checksum=None):
+        '''
+        确保物料包已解压缓存，返回archive对象；遍历/对比整个目录树时使用(md5来自文件清单)
+        '''
+        return archive.DirectoryArchive(self.ensure_package_cached(guid, url, checksum))
+
+    def ensure_package_indexed(self, guid, url, checksum=None):
+        '''
+        确保物料包文件可按需读取，返回archive对象；仅读取少量指定文件时使用
+        
+        已解压缓存直接使用；可随机读取的格式(zip/tar/带检查点的tar.gz)仅下载物料包并建立成员索引，
+        其他格式每读取一个成员都需从头解压，直接完整解压
+        '''
+        checksum = package_cache.normalize_checksum(checksum)
+        if checksum:
+            file_cache_dir = package_cache.get_content_path(checksum)
+        else:
+            file_cache_dir = self.get_package_cached_path(guid)
+        package_cache.pin_for_request(file_cache_dir)
+        if package_cache.is_complete(file_cache_dir) or not archive.is_seekable_format(url.rsplit('/', 1)[-1]):
+            return self.ensure_package_files(guid, url, checksum)
+        archive_path = package_cache.get_archive_path(file_cache_dir)
+        package_cache.pin_for_request(archive_path)
+        if package_cache.is_complete(archive_path):
+            LOG.info('using archive cache: %s for package: %s', archive_path, guid)
+        else:
+            PACKAGE_CACHE_FLIGHTS.do(archive_path,
+                                     functools.partial(self._fill_package_archive, guid, url, archive_path),
+                                     timeout=300)
+        package_cache.record_access(archive_path)
+        return archive.open_archive(archive_path)
+
+    def _fill_package_archive(self, guid, url, archive_path):
+        with artifact_utils.lock(hashlib.sha1(archive_path.encode()).hexdigest(), timeout=300) as locked:
+            if locked:
+                if package_cache.is_complete(archive_path):
+                    LOG.info('using archive cache: %s for package: %s', archive_path, guid)
+                    return archive_path
+                staging_path = package_cache.create_staging_path()
+                try:
+                    data_path = os.path.join(staging_path, archive.ARCHIVE_DATA_DIR)
+                    os.makedirs(data_path)
+                    LOG.info('download from: %s for pakcage: %s', url, guid)
+                    self.download_from_url(data_path, url)
+                    LOG.info('download complete')
+                    try:
+                        # 建立成员索引(tar类)，同时校验物料包格式；staging路径改名后失效，不缓存archive对象
+                        archive.open_archive(staging_path, cache=False)
+                    except Exception as e:
+                        LOG.error('index package failed')
+                        raise exceptions.PluginError(message=_('unpack file error: %(detail)s' %
+                                                               {'detail': str(e)}))
+                    package_cache.install(staging_path, archive_path)
+                finally:
+                    shutil.rmtree(staging_path, ignore_errors=True)
+                package_cache.record_size(archive_path)
+                package_cache.mark_complete(archive_path)
             else:
                 raise OSError(_('failed to acquire lock, package cache may not be available'))
+        return archive_path
+
+    def _install_package_cache(self, guid, url, file_cache_dir):
+        with tempfile.TemporaryDirectory() as download_path:
+            LOG.info('download from: %s for pakcage: %s', url, guid)
+            filepath = self.download_from_url(download_path, url)
+            LOG.info('download complete')
+            self._install_package_file(guid, filepath, file_cache_dir)
+
+    def _install_package_file(self, guid, filepath, file_cache_dir):
+        # 解压到staging目录后原子改名，异常中断不会留下不完整的缓存目录
+        staging_path = package_cache.create_staging_path()
+        try:
+            LOG.info('unpack package: %s to %s', guid, staging_path)
+            try:
+                artifact_utils.unpack_file(filepath, staging_path)
+            except Exception as e:
+                LOG.error('unpack failed')
+                if str(e).find('bad subsequent header') >= 0:
+                    raise exceptions.PluginError(message=_(
+                        'unpack file error: %(detail)s, is file contains paxheader(mac archive) and modify with 7zip? (cause paxheader corruption)'
+                        % {'detail': str(e)}))
+                raise exceptions.PluginError(message=_('unpack file error: %(detail)s' %
+                                                       {'detail': str(e)}))
+            LOG.info('unpack complete')
+            package_cache.install(staging_path, file_cache_dir)
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+        # 解压时一次性生成文件清单，后续对比/浏览不再遍历目录及计算md5
+        manifest = package_manifest.create_manifest(file_cache_dir)
+        package_cache.record_size(file_cache_dir, manifest.total_size)
+        package_cache.mark_complete(file_cache_dir)
+
+    def warm_package_cache(self, filepath, checksum=None, guid=None):
+        '''
+        使用上传时已在本地的物料包文件直接生成解压缓存，分析时无需再从nexus下载
+        
+        缓存预热失败不影响上传，分析时仍会按需下载
+        '''
+        checksum = package_cache.normalize_checksum(checksum)
+        if checksum:
+            file_cache_dir = package_cache.get_content_path(checksum)
+        elif guid:
+            file_cache_dir = self.get_package_cached_path(guid)
+        else:
+            return None
+        package_cache.pin_for_request(file_cache_dir)
+        if not package_cache.is_complete(file_cache_dir):
+            try:
+                PACKAGE_CACHE_FLIGHTS.do(file_cache_dir,
+                                         functools.partial(self._fill_package_cache, guid, None, file_cache_dir,
+                                                           filepath),
+                                         timeout=300)
+            except Exception as e:
+                LOG.warning('warm package cache: %s failed: %s', file_cache_dir, str(e))
+                return None
+        if checksum and guid:
+            package_cache.link_package(guid, file_cache_dir)
+        package_cache.record_access(file_cache_dir)
         return file_cache_dir
 
+    def warm_package_cache_from_fileobj(self, filename, fileobj, checksum=None, guid=None):
+        with tempfile.TemporaryDirectory() as tmp_path:
+            # 解压格式由文件扩展名决定，需保留原始文件名
+            filepath = os.path.join(tmp_path, os.path.basename(filename))
+            fileobj.seek(0)
+            with open(filepath, 'wb') as f:
+                shutil.copyfileobj(fileobj, f, 1024 * 1024)
+            return self.warm_package_cache(filepath, checksum, guid)
+
     def download_from_url(self, dir_path, url, random_name=False):
         filename = url.rsplit('/', 1)[-1]
         if random_name:
@@ -2018,16 +2252,25 @@ class UnitDesignPackages(WeCubeResource):
             client.download_file(filepath, CONF.wecube.s3.access_key, CONF.wecube.s3.secret_key)
         return filepath
 
-    def _analyze_package_attrs(self, package_id:str, baseline_package_id:str, input_attrs:map, do_bind_vars=True) -> map:
+    def _analyze_package_attrs(self, package_id:str, baseline_package_id:str, input_attrs:map, do_bind_vars=True,
+                               deploy_package=None, baseline_package=None) -> map:
         # input_attrs都是以CMDB字段值方式传递，比如列表实际上是A|B|C格式
+        # deploy_package/baseline_package可传入调用方已查询的CI数据，避免重复查询
         ret_data = {}
-        deploy_package = self._get_deploy_package_by_id(package_id)
-        # 建议优化为：上传时解压，否则此处会增加耗时
-        self.ensure_package_cached(package_id, deploy_package['deploy_package_url'])
-        baseline_package = {}
+        deploy_package = deploy_package or self._get_deploy_package_by_id(package_id)
+        # 分析基于整个目录树的对比快照，使用解压缓存；上传时已使用本地文件预热缓存，此处通常直接命中
+        package_cached_dir = self.ensure_package_files(package_id, deploy_package['deploy_package_url'],
+                                                       deploy_package.get('md5_value'))
+        baseline_cached_dir = None
         if baseline_package_id:
-            baseline_package = self._get_deploy_package_by_id(baseline_package_id)
-            self.ensure_package_cached(baseline_package_id, baseline_package['deploy_package_url'])
+            baseline_package = baseline_package or self._get_deploy_package_by_id(baseline_package_id)
+            baseline_cached_dir = self.ensure_package_files(baseline_package_id,
+                                                            baseline_package['deploy_package_url'],
+                                                            baseline_package.get('md5_value'))
+        else:
+            baseline_package = {}
+        # 所有目录/文件字段均基于同一份对比快照分析
+        snapshot = package_diff.create_snapshot(package_cached_dir, baseline_cached_dir)
         # common
         ret_data[field_pkg_is_decompression_name] = input_attrs.get(field_pkg_is_decompression_name, None) or baseline_package.get(field_pkg_is_decompression_name, field_pkg_is_decompression_default_value) or field_pkg_is_decompression_default_value
         ret_data[field_pkg_package_type_name] = input_attrs.get(field_pkg_package_type_name, None) or baseline_package.get(field_pkg_package_type_name, field_pkg_package_type_default_value) or field_pkg_package_type_default_value
@@ -2039,7 +2282,7 @@ class UnitDesignPackages(WeCubeResource):
             ret_data[fset.name] = input_attrs[fset.name]
             if not baseline_package:
                 # 差异化文件清单自动分析(扩展名限制)
-                file_objs = self._scan_dir(self.get_package_cached_path(package_id), ret_data[fset.name], False, True)
+                file_objs = self._scan_dir(package_cached_dir, ret_data[fset.name], False, True)
                 filtered_file_objs = []
                 available_extensions = split_to_list(CONF.diff_conf_extension)
                 for f in file_objs:
@@ -2050,23 +2293,23 @@ class UnitDesignPackages(WeCubeResource):
                 if do_bind_vars:
                     conf_files = self.build_file_object(ret_data[field_pkg_diff_conf_file_name])
                     bind_variables, new_create_variables = self._analyze_diff_var(package_id, deploy_package['deploy_package_url'], 
-                                        [], conf_files)
+                                        [], conf_files, package_checksum=deploy_package.get('md5_value'))
                     if bind_variables is not None:
                         ret_data[field_pkg_diff_conf_var_name] = bind_variables
             else:
                 # 差异化文件清单继承删除+继承追加(扩展名限制，去重，保持原顺序)
                 baseline_file_value = baseline_package[field_pkg_diff_conf_file_name]
                 baseline_file_obj = self.build_file_object(baseline_file_value)
-                self.update_file_status(self.get_package_cached_path(baseline_package_id), self.get_package_cached_path(package_id), 
-                                        baseline_file_obj, file_key='filename')
+                self.update_file_status(baseline_cached_dir, package_cached_dir, 
+                                        baseline_file_obj, file_key='filename',
+                                        diff_results=snapshot.results)
                 # remove deleted status
                 filtered_file_objs = [f for f in baseline_file_obj if f['comparisonResult'] != 'deleted']
                 changed_file_objs = [f for f in baseline_file_obj if f['comparisonResult'] == 'changed']
                 changed_file_objs_map = set([f['filename'] for f in changed_file_objs])
                 # find new,changed status
-                file_objs = self.find_files_by_status(
-                    baseline_package_id, package_id,
-                    split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
+                file_objs = self._find_files_by_snapshot(
+                    snapshot, split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
                     ['new', 'changed'])
                 # append new files
                 available_extensions = split_to_list(CONF.diff_conf_extension)
@@ -2080,7 +2323,7 @@ class UnitDesignPackages(WeCubeResource):
                 if do_bind_vars:
                     conf_files = self.build_file_object(ret_data[field_pkg_diff_conf_file_name])
                     bind_variables, new_create_variables = self._analyze_diff_var(package_id, deploy_package['deploy_package_url'], 
-                                        [], conf_files)
+                                        [], conf_files, package_checksum=deploy_package.get('md5_value'))
                     if new_create_variables is not None:
                         bind_variables = [c['guid'] for c in baseline_package[field_pkg_diff_conf_var_name]]
                         bind_variables.extend(new_create_variables)
@@ -2089,7 +2332,7 @@ class UnitDesignPackages(WeCubeResource):
             if not baseline_package:
                 ret_data[fset.name] = fset.default_value
                 # 差异化文件清单自动分析
-                file_objs = self._scan_dir(self.get_package_cached_path(package_id), ret_data[fset.name], False, True)
+                file_objs = self._scan_dir(package_cached_dir, ret_data[fset.name], False, True)
                 filtered_file_objs = []
                 available_extensions = split_to_list(CONF.diff_conf_extension)
                 for f in file_objs:
@@ -2100,7 +2343,7 @@ class UnitDesignPackages(WeCubeResource):
                 if do_bind_vars:
                     conf_files = self.build_file_object(ret_data[field_pkg_diff_conf_file_name])
                     bind_variables, new_create_variables = self._analyze_diff_var(package_id, deploy_package['deploy_package_url'], 
-                                        [], conf_files)
+                                        [], conf_files, package_checksum=deploy_package.get('md5_value'))
                     if bind_variables is not None:
                         ret_data[field_pkg_diff_conf_var_name] = bind_variables
             else:
@@ -2114,16 +2357,16 @@ class UnitDesignPackages(WeCubeResource):
                 # 差异化文件清单继承删除+继承追加(扩展名限制，去重，保持原顺序)
                 baseline_file_value = baseline_package[field_pkg_diff_conf_file_name]
                 baseline_file_obj = self.build_file_object(baseline_file_value)
-                self.update_file_status(self.get_package_cached_path(baseline_package_id), self.get_package_cached_path(package_id), 
-                                        baseline_file_obj, file_key='filename')
+                self.update_file_status(baseline_cached_dir, package_cached_dir, 
+                                        baseline_file_obj, file_key='filename',
+                                        diff_results=snapshot.results)
                 # remove deleted status
                 filtered_file_objs = [f for f in baseline_file_obj if f['comparisonResult'] != 'deleted']
                 changed_file_objs = [f for f in baseline_file_obj if f['comparisonResult'] == 'changed']
                 changed_file_objs_map = set([f['filename'] for f in changed_file_objs])
                 # find new,changed status
-                file_objs = self.find_files_by_status(
-                    baseline_package_id, package_id,
-                    split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
+                file_objs = self._find_files_by_snapshot(
+                    snapshot, split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
                     ['new', 'changed'])
                 # append new files
                 available_extensions = split_to_list(CONF.diff_conf_extension)
@@ -2137,7 +2380,7 @@ class UnitDesignPackages(WeCubeResource):
                 if do_bind_vars:
                     conf_files = self.build_file_object(ret_data[field_pkg_diff_conf_file_name])
                     bind_variables, new_create_variables = self._analyze_diff_var(package_id, deploy_package['deploy_package_url'], 
-                                        [], conf_files)
+                                        [], conf_files, package_checksum=deploy_package.get('md5_value'))
                     if new_create_variables is not None:
                         bind_variables = [c['guid'] for c in baseline_package[field_pkg_diff_conf_var_name]]
                         bind_variables.extend(new_create_variables)
@@ -2161,7 +2404,7 @@ class UnitDesignPackages(WeCubeResource):
                 # 填充默认目录值，脚本文件清单填充默认
                 ret_data[fset.name] = fset.default_value
                 # 先尝试寻找默认路径下以脚本默认值结尾的文件，找不到就使用默认值
-                file_objs = self._scan_dir(self.get_package_cached_path(package_id), ret_data[fset.name], False, False)
+                file_objs = self._scan_dir(package_cached_dir, ret_data[fset.name], False, False)
                 filtered_file_objs = []
                 for f in file_objs:
                     if fnmatch.fnmatch(f['name'], field_pkg_deploy_file_path_default_value_rule):
@@ -2244,7 +2487,7 @@ class UnitDesignPackages(WeCubeResource):
             ret_data[fset.name] = input_attrs[fset.name]
             if not baseline_package:
                 # 文件清单自动分析(扩展名限制)
-                file_objs = self._scan_dir(self.get_package_cached_path(package_id), ret_data[fset.name], False, True)
+                file_objs = self._scan_dir(package_cached_dir, ret_data[fset.name], False, True)
                 filtered_file_objs = []
                 available_extensions = split_to_list(CONF.db_script_extension)
                 for f in file_objs:
@@ -2256,14 +2499,14 @@ class UnitDesignPackages(WeCubeResource):
                 # 文件清单继承追加
                 baseline_file_value = baseline_package[field_pkg_db_deploy_file_path_name]
                 baseline_file_obj = self.build_file_object(baseline_file_value)
-                self.update_file_status(self.get_package_cached_path(baseline_package_id), self.get_package_cached_path(package_id), 
-                                        baseline_file_obj, file_key='filename')
+                self.update_file_status(baseline_cached_dir, package_cached_dir, 
+                                        baseline_file_obj, file_key='filename',
+                                        diff_results=snapshot.results)
                 changed_file_objs = [f for f in baseline_file_obj if f['comparisonResult'] == 'changed']
                 changed_file_objs_map = set([f['filename'] for f in changed_file_objs])
                 # find new,changed status
-                file_objs = self.find_files_by_status(
-                    baseline_package_id, package_id,
-                    split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
+                file_objs = self._find_files_by_snapshot(
+                    snapshot, split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
                     ['new', 'changed'])
                 # append new files
                 available_extensions = split_to_list(CONF.db_script_extension)
@@ -2279,7 +2522,7 @@ class UnitDesignPackages(WeCubeResource):
                 # 填充默认目录值
                 ret_data[fset.name] = fset.default_value
                 # 文件清单自动分析(扩展名限制)
-                file_objs = self._scan_dir(self.get_package_cached_path(package_id), ret_data[fset.name], False, True)
+                file_objs = self._scan_dir(package_cached_dir, ret_data[fset.name], False, True)
                 filtered_file_objs = []
                 available_extensions = split_to_list(CONF.db_script_extension)
                 for f in file_objs:
@@ -2297,14 +2540,14 @@ class UnitDesignPackages(WeCubeResource):
                 # 文件清单继承追加
                 baseline_file_value = baseline_package[field_pkg_db_deploy_file_path_name]
                 baseline_file_obj = self.build_file_object(baseline_file_value)
-                self.update_file_status(self.get_package_cached_path(baseline_package_id), self.get_package_cached_path(package_id), 
-                                        baseline_file_obj, file_key='filename')
+                self.update_file_status(baseline_cached_dir, package_cached_dir, 
+                                        baseline_file_obj, file_key='filename',
+                                        diff_results=snapshot.results)
                 changed_file_objs = [f for f in baseline_file_obj if f['comparisonResult'] == 'changed']
                 changed_file_objs_map = set([f['filename'] for f in changed_file_objs])
                 # find new,changed status
-                file_objs = self.find_files_by_status(
-                    baseline_package_id, package_id,
-                    split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
+                file_objs = self._find_files_by_snapshot(
+                    snapshot, split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
                     ['new', 'changed'])
                 # append new files
                 available_extensions = split_to_list(CONF.db_script_extension)
@@ -2321,7 +2564,7 @@ class UnitDesignPackages(WeCubeResource):
             ret_data[fset.name] = input_attrs[fset.name]
             if not baseline_package:
                 # 文件清单自动分析(扩展名限制)
-                file_objs = self._scan_dir(self.get_package_cached_path(package_id), ret_data[fset.name], False, True)
+                file_objs = self._scan_dir(package_cached_dir, ret_data[fset.name], False, True)
                 filtered_file_objs = []
                 available_extensions = split_to_list(CONF.db_script_extension)
                 for f in file_objs:
@@ -2333,9 +2576,8 @@ class UnitDesignPackages(WeCubeResource):
                 # ret_data[field_pkg_db_upgrade_file_path_name] = field_pkg_db_upgrade_file_path_default_value
             else:
                 # 文件清单仅追加
-                file_objs = self.find_files_by_status(
-                    baseline_package_id, package_id,
-                    split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
+                file_objs = self._find_files_by_snapshot(
+                    snapshot, split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
                     ['new', 'changed'])
                 filtered_file_objs = []
                 # append new files
@@ -2350,7 +2592,7 @@ class UnitDesignPackages(WeCubeResource):
                 # 填充默认目录值
                 ret_data[fset.name] = fset.default_value
                 # 文件清单自动分析(扩展名限制)
-                file_objs = self._scan_dir(self.get_package_cached_path(package_id), ret_data[fset.name], False, True)
+                file_objs = self._scan_dir(package_cached_dir, ret_data[fset.name], False, True)
                 filtered_file_objs = []
                 available_extensions = split_to_list(CONF.db_script_extension)
                 for f in file_objs:
@@ -2369,9 +2611,8 @@ class UnitDesignPackages(WeCubeResource):
                 else:
                     # 已继承baseline值
                     # 文件清单仅追加
-                    file_objs = self.find_files_by_status(
-                        baseline_package_id, package_id,
-                        split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
+                    file_objs = self._find_files_by_snapshot(
+                        snapshot, split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
                         ['new', 'changed'])
                     filtered_file_objs = []
                     # append new files
@@ -2387,7 +2628,7 @@ class UnitDesignPackages(WeCubeResource):
             ret_data[fset.name] = input_attrs[fset.name]
             if not baseline_package:
                 # 文件清单自动分析(扩展名限制)
-                file_objs = self._scan_dir(self.get_package_cached_path(package_id), ret_data[fset.name], False, True)
+                file_objs = self._scan_dir(package_cached_dir, ret_data[fset.name], False, True)
                 filtered_file_objs = []
                 available_extensions = split_to_list(CONF.db_script_extension)
                 for f in file_objs:
@@ -2399,9 +2640,8 @@ class UnitDesignPackages(WeCubeResource):
                 # ret_data[field_pkg_db_rollback_file_path_name] = field_pkg_db_rollback_file_path_default_value
             else:
                 # 文件清单仅追加
-                file_objs = self.find_files_by_status(
-                    baseline_package_id, package_id,
-                    split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
+                file_objs = self._find_files_by_snapshot(
+                    snapshot, split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
                     ['new', 'changed'])
                 filtered_file_objs = []
                 # append new files
@@ -2416,7 +2656,7 @@ class UnitDesignPackages(WeCubeResource):
                 # 填充默认目录值
                 ret_data[fset.name] = fset.default_value
                 # 文件清单自动分析(扩展名限制)
-                file_objs = self._scan_dir(self.get_package_cached_path(package_id), ret_data[fset.name], False, True)
+                file_objs = self._scan_dir(package_cached_dir, ret_data[fset.name], False, True)
                 filtered_file_objs = []
                 available_extensions = split_to_list(CONF.db_script_extension)
                 for f in file_objs:
@@ -2435,9 +2675,8 @@ class UnitDesignPackages(WeCubeResource):
                 else:
                     # 已继承baseline值
                     # 文件清单仅追加
-                    file_objs = self.find_files_by_status(
-                        baseline_package_id, package_id,
-                        split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
+                    file_objs = self._find_files_by_snapshot(
+                        snapshot, split_to_list(ret_data[fset.name]) if ret_data[fset.name] else [],
                         ['new', 'changed'])
                     filtered_file_objs = []
                     # append new files
@@ -2482,9 +2721,15 @@ class UnitDesignNexusPackages(WeCubeResource):
         unit_design = resp_json['data']['contents'][0]
         nexus_client = nexus.NeuxsClient(CONF.wecube.nexus.server, CONF.wecube.nexus.username,
                                          CONF.wecube.nexus.password)
-        results = nexus_client.list(CONF.wecube.nexus.repository,
-                                    self.get_unit_design_artifact_path(unit_design),
-                                    extensions=artifact_utils.REGISTED_UNPACK_FORMATS, filename=filename)
+        if filename:
+            # 按文件名搜索由Nexus完成，不使用列表缓存
+            results = nexus_client.list(CONF.wecube.nexus.repository,
+                                        self.get_unit_design_artifact_path(unit_design),
+                                        extensions=artifact_utils.REGISTED_UNPACK_FORMATS, filename=filename)
+        else:
+            results = nexus_client.list_cached(CONF.wecube.nexus.repository,
+                                               self.get_unit_design_artifact_path(unit_design),
+                                               extensions=artifact_utils.REGISTED_UNPACK_FORMATS)
         if not utils.bool_from_string(CONF.nexus_sort_as_string, default=False):
             return self.version_sort(results)
         return sorted(results, key=lambda x: x['name'], reverse=True)
@@ -2496,6 +2741,12 @@ class UnitDesignNexusPackages(WeCubeResource):
         return sorted(datas, key=lambda x: _extract_key(x['name']), reverse=True)
     
     def get(self, unit_design_id):
+        # CI可见性与用户权限相关，按token区分缓存(仅保存token摘要)
+        key = {'unit_design': unit_design_id, 'token': hashlib.sha1((self.token or '').encode()).hexdigest()}
+        return ttl_cache.CACHE.get_or_load('unit_design_artifact_path', key,
+                                           lambda: self._get_artifact_path(unit_design_id))
+
+    def _get_artifact_path(self, unit_design_id):
         cmdb_client = self.get_cmdb_client()
         query = {
             "dialect": {
@@ -2521,14 +2772,16 @@ class DiffConfig(WeCubeResource):
         format_datas = []
         for d in data:
             format_datas.append({'guid': d['id'], 'variable_value': d['variable_value']})
-        resp_json = cmdb_client.update(CONF.wecube.wecmdb.citypes.diff_config, format_datas)
+        resp_json = cmdb_client.bulk('update', CONF.wecube.wecmdb.citypes.diff_config, format_datas)
         return resp_json['data']
 
     def list(self, params):
+        return list(self.iterate(params))
+
+    def iterate(self, params):
         cmdb_client = self.get_cmdb_client()
-        query = {"dialect": {"queryMode": "new"}, "filters": [], "paging": False}
-        resp_json = cmdb_client.retrieve(CONF.wecube.wecmdb.citypes.diff_config, query)
-        return [i for i in resp_json['data']['contents']]
+        query = {"dialect": {"queryMode": "new"}, "filters": []}
+        return cmdb_client.iterate(CONF.wecube.wecmdb.citypes.diff_config, query)
 
 
 class OnlyInRemoteNexusPackages(WeCubeResource):
@@ -2578,14 +2831,12 @@ class OnlyInRemoteNexusPackages(WeCubeResource):
                 "name": "unit_design",
                 "operator": "eq",
                 "value": unit_design_id
-            }],
-            "paging": False
+            }]
         }
 
+        wecmdb.set_result_columns(query, PACKAGE_KEY_NAME_COLUMNS)
         cmdb_package_name = set()
-        resp_json = cmdb_client.retrieve(CONF.wecube.wecmdb.citypes.deploy_package, query)
-        cmdb_package_list = resp_json.get('data', {}).get('contents', [])
-        for item in cmdb_package_list:
+        for item in cmdb_client.iterate(CONF.wecube.wecmdb.citypes.deploy_package, query):
             cmdb_package_name.add(item["key_name"])
 
         # get remote nexus package name
@@ -2593,10 +2844,8 @@ class OnlyInRemoteNexusPackages(WeCubeResource):
         nexus_client = nexus.NeuxsClient(CONF.wecube.nexus.server,
                                          CONF.wecube.nexus.username,
                                          CONF.wecube.nexus.password)
-        remote_nexus_package_list = nexus_client.list(CONF.wecube.nexus.repository,
-                                                      self.get_unit_design_artifact_path(unit_design))
-
-        for item in remote_nexus_package_list:
+        for item in nexus_client.list_cached(CONF.wecube.nexus.repository,
+                                             self.get_unit_design_artifact_path(unit_design)):
             remote_nexus_package_name.add(item["name"])
 
         result_package_name = remote_nexus_package_name - cmdb_package_name
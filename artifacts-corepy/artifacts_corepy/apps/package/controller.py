@@ -12,7 +12,7 @@ from talos.core import config
 from talos.core.i18n import _
 from talos.common import controller as base_controller
 
-from artifacts_corepy.common.controller import Collection, Item, POSTCollection
+from artifacts_corepy.common.controller import Collection, Item, POSTCollection, StreamCollection
 from artifacts_corepy.common import exceptions
 from artifacts_corepy.apps.package import apiv2 as package_api
 from artifacts_corepy.common import constant
@@ -49,6 +49,26 @@ class ControllerVariableRootCiTypeId(object):
         }
 
 
+class ControllerMetadataCachePurge(object):
+    name = 'artifacts.metadata-cache.purge'
+
+    def on_post(self, req, resp, **kwargs):
+        data = getattr(req, 'json', None) or {}
+        resp.json = {
+            'code': 200,
+            'status': 'OK',
+            'data': package_api.MetadataCache().purge(data),
+            'message': 'success'
+        }
+
+
+class ControllerUpstreamStatus(object):
+    name = 'artifacts.upstreams.status'
+
+    def on_get(self, req, resp, **kwargs):
+        resp.json = {'code': 200, 'status': 'OK', 'data': package_api.UpstreamStatus().get(), 'message': 'success'}
+
+
 class CollectionProcessDef(Collection):
     allow_methods = ('GET', )
     name = 'artifacts.process.defs'
@@ -314,7 +334,7 @@ class CiDelete(Item):
         return self.make_resource(req).batch_delete(data, **kwargs)
 
 
-class CollectionDiffConfigs(Collection):
+class CollectionDiffConfigs(StreamCollection):
     allow_methods = ('GET', )
     name = 'artifacts.diffconfigs'
     resource = package_api.DiffConfig
@@ -83,6 +83,10 @@ def add_routes(api):
     api.add_route('/artifacts/ci-types/{ci_type_id}/attributes', controller.ItemCiAttributes())
     api.add_route('/artifacts/ci-types/{ci_type_id}/ci-data/batch-delete', controller.CiDelete())
     api.add_route('/artifacts/ci/state/operate', controller.CiStateAction())
+    # cmdb metadata cache
+    api.add_route('/artifacts/metadata-cache/purge', controller.ControllerMetadataCachePurge())
+    # upstream circuit breaker status
+    api.add_route('/artifacts/upstreams/status', controller.ControllerUpstreamStatus())
     # platform api forward
     api.add_sink(
         EntityAdapter(),
@@ -0,0 +1,738 @@
+# coding=utf-8
+"""
+artifacts_corepy.common.archive
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+本模块提供物料包(压缩包)按需读取能力
+
+无需完整解压即可列出物料包成员并读取单个文件：
+zip类(zip/jar/war/apk)直接使用中央目录，tar类扫描一次文件头并持久化成员偏移索引
+
+gzip压缩的tar包(tar.gz/tgz)无法直接seek，首次扫描时同时生成解压检查点索引(每隔固定解压长度记录压缩流位置
+及32KB解压窗口，需要indexed_gzip)，之后读取任意成员只需从最近的检查点开始解压，原始压缩包不做任何改写；
+其他压缩格式(或未安装indexed_gzip)默认每次从头解压，可配置package_cache.tar_seekable_copy将解压流分块独立压缩
+另存一份以支持随机读取(占用额外空间，计入缓存条目大小)
+
+"""
+import collections
+import contextlib
+import io
+import json
+import logging
+import os
+import os.path
+import posixpath
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+
+from talos.core import config
+from talos.core import utils
+
+from artifacts_corepy.common import hashing
+from artifacts_corepy.common import package_cache
+from artifacts_corepy.common import package_manifest
+from artifacts_corepy.common import utils as artifact_utils
+
+try:
+    HAS_INDEXED_GZIP = True
+    import indexed_gzip
+except ImportError:
+    HAS_INDEXED_GZIP = False
+
+LOG = logging.getLogger(__name__)
+CONF = config.CONF
+
+ARCHIVE_DATA_DIR = 'data'
+ARCHIVE_INDEX_FILE = 'index.json'
+SEEKABLE_DATA_FILE = 'seekable.bin'
+SEEKABLE_INDEX_FILE = 'seekable.json'
+SEEKABLE_CHUNK_SIZE = 1024 * 1024
+GZIP_INDEX_FILE = 'gzindex.bin'
+GZIP_INDEX_SPACING = 4 * 1024 * 1024
+GZIP_WINDOW_SIZE = 32 * 1024
+ARCHIVE_CACHE_SIZE = 32
+ZIP_FORMATS = ('.zip', '.jar', '.war', '.apk')
+MAX_LINK_DEPTH = 8
+
+ArchiveMember = collections.namedtuple('ArchiveMember', 'path, is_dir, size, mtime, crc, md5')
+
+_archives = collections.OrderedDict()
+
+
+def get_archive_type(filename):
+    '''
+    根据扩展名判断压缩包类型：zip/tar，不支持的格式返回None
+    '''
+    filename = filename.lower()
+    for ext in artifact_utils.REGISTED_UNPACK_FORMATS:
+        if filename.endswith(ext):
+            return 'zip' if ext in ZIP_FORMATS else 'tar'
+    return None
+
+
+def is_seekable_format(filename):
+    '''
+    成员可随机读取的格式：zip类，未压缩的tar，可建立解压检查点的tar.gz(需要indexed_gzip)；
+    其他压缩格式读取任一成员都需从头解压
+    '''
+    archive_type = get_archive_type(filename)
+    if archive_type != 'tar':
+        return archive_type == 'zip'
+    filename = filename.lower()
+    if filename.endswith('.tar'):
+        return True
+    return HAS_INDEXED_GZIP and filename.endswith(('.tar.gz', '.tgz'))
+
+
+def _add_parent_dirs(members):
+    # 压缩包中可能不包含目录条目，补全父目录
+    for path in list(members.keys()):
+        parent = posixpath.dirname(path)
+        while parent and parent not in members:
+            members[parent] = ArchiveMember(parent, True, 0, 0, None, None)
+            parent = posixpath.dirname(parent)
+    return members
+
+
+class _BoundedReader(io.RawIOBase):
+    '''
+    只读取底层流中从当前位置开始的size字节
+    '''
+
+    def __init__(self, fileobj, size):
+        self._fileobj = fileobj
+        self._remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._remaining <= 0:
+            return 0
+        data = self._fileobj.read(min(len(b), self._remaining))
+        b[:len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+
+class _SharedReader(io.RawIOBase):
+    '''
+    读取共享流中[offset, offset + size)区间，每次读取在锁内定位，多个读取者互不影响位置
+    '''
+
+    def __init__(self, stream, lock, offset, size):
+        self._stream = stream
+        self._lock = lock
+        self._pos = offset
+        self._end = offset + size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._pos >= self._end:
+            return 0
+        with self._lock:
+            self._stream.seek(self._pos)
+            data = self._stream.read(min(len(b), self._end - self._pos))
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    while data and len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+def build_seekable(stream, data_path, index_path, chunk_size=SEEKABLE_CHUNK_SIZE):
+    '''
+    将解压流按chunk_size分块独立压缩写入data_path，块偏移表写入index_path
+    '''
+    offsets = []
+    total = 0
+    with open(data_path, 'wb') as f:
+        chunk = _read_exactly(stream, chunk_size)
+        while chunk:
+            offsets.append(f.tell())
+            f.write(zlib.compress(chunk, 1))
+            total += len(chunk)
+            chunk = _read_exactly(stream, chunk_size)
+        offsets.append(f.tell())
+    tmp_path = '%s.tmp' % index_path
+    with open(tmp_path, 'w') as f:
+        json.dump({'chunk_size': chunk_size, 'size': total, 'offsets': offsets}, f)
+    os.replace(tmp_path, index_path)
+
+
+class SeekableReader(io.RawIOBase):
+    '''
+    读取build_seekable生成的分块数据，支持随机seek，仅解压访问到的数据块
+    '''
+
+    def __init__(self, data_path, index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        self._chunk_size = index['chunk_size']
+        self._size = index['size']
+        self._offsets = index['offsets']
+        self._fileobj = open(data_path, 'rb')
+        self._pos = 0
+        self._chunk_no = None
+        self._chunk = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def _load_chunk(self, chunk_no):
+        if chunk_no != self._chunk_no:
+            self._fileobj.seek(self._offsets[chunk_no])
+            self._chunk = zlib.decompress(self._fileobj.read(self._offsets[chunk_no + 1] - self._offsets[chunk_no]))
+            self._chunk_no = chunk_no
+        return self._chunk
+
+    def readinto(self, b):
+        if self._pos >= self._size:
+            return 0
+        chunk_no, chunk_pos = divmod(self._pos, self._chunk_size)
+        data = self._load_chunk(chunk_no)[chunk_pos:chunk_pos + len(b)]
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def close(self):
+        self._fileobj.close()
+        super(SeekableReader, self).close()
+
+
+class BaseArchive(object):
+    # 类型：dir/zip/tar，对比时用于判断可信的元数据
+    kind = None
+    # 目录树哈希的叶子类型，仅类型相同的哈希可比较
+    tree_kind = None
+    # 所属缓存条目，用于持久化对比结果
+    entry_path = None
+
+    @property
+    def content_key(self):
+        if self.entry_path is None:
+            return None
+        return package_cache.get_entry_key(self.entry_path)
+
+    def members(self):
+        '''
+        返回所有成员(按路径排序)
+        '''
+        raise NotImplementedError()
+
+    def get(self, path):
+        raise NotImplementedError()
+
+    def _get_children(self):
+        children = getattr(self, '_children', None)
+        if children is None:
+            children = collections.defaultdict(list)
+            for member in self.members():
+                children[posixpath.dirname(member.path)].append(member)
+            self._children = children
+        return children
+
+    def listdir(self, path):
+        return list(self._get_children().get(package_manifest.normalize_path(path), []))
+
+    def walk(self, path):
+        '''
+        返回目录下所有子孙成员(不包含目录本身，按路径排序)
+        '''
+        children = self._get_children()
+        results = []
+        stack = [package_manifest.normalize_path(path)]
+        while stack:
+            for member in children.get(stack.pop(), []):
+                results.append(member)
+                if member.is_dir:
+                    stack.append(member.path)
+        results.sort(key=lambda x: x.path)
+        return results
+
+    def _leaf_hash(self, member):
+        raise NotImplementedError()
+
+    def tree_hash(self, path):
+        '''
+        目录树哈希，返回(tree_kind, hash)，仅tree_kind相同的哈希可比较；
+        叶子哈希来自成员元数据或索引中的md5，不逐个读取文件内容
+        '''
+        hashes = getattr(self, '_tree_hashes', None)
+        if hashes is None:
+            hashes = {}
+            children = self._get_children()
+            dirs = [m.path for m in self.members() if m.is_dir] + ['']
+            for m in self.members():
+                if not m.is_dir:
+                    hashes[m.path] = self._leaf_hash(m)
+            dirs.sort(key=lambda p: (p == '', -p.count('/')))
+            for dir_path in dirs:
+                hashes[dir_path] = package_manifest.merkle_hash([(posixpath.basename(c.path), c.is_dir,
+                                                                  hashes.get(c.path, None))
+                                                                 for c in children.get(dir_path, [])])
+            self._tree_hashes = hashes
+        return self.tree_kind, hashes.get(package_manifest.normalize_path(path), None)
+
+    def _get_md5_cache(self):
+        hashes = getattr(self, '_md5s', None)
+        if hashes is None:
+            hashes = {}
+            self._md5s = hashes
+        return hashes
+
+    def _compute_md5(self, path):
+        with self.open(path) as f:
+            return hashing.md5_fileobj(f)
+
+    def prefetch_md5(self, paths):
+        '''
+        在线程池中并发计算多个成员文件的md5
+        '''
+        hashes = self._get_md5_cache()
+        pending = set()
+        for path in paths:
+            member = self.get(path)
+            if member is not None and not member.is_dir and not member.md5 and member.path not in hashes:
+                pending.add(member.path)
+        pending = sorted(pending)
+        hashes.update(zip(pending, hashing.run_many(self._compute_md5, pending)))
+
+    def md5(self, path):
+        '''
+        计算成员文件md5(进程内缓存结果)，已知md5时直接返回
+        '''
+        member = self.get(path)
+        if member is None or member.is_dir:
+            return None
+        if member.md5:
+            return member.md5
+        hashes = self._get_md5_cache()
+        if member.path not in hashes:
+            hashes[member.path] = hashing.run(self._compute_md5, member.path)
+        return hashes[member.path]
+
+    def exists(self, path):
+        return self.get(path) is not None
+
+    def isdir(self, path):
+        member = self.get(path)
+        return member is not None and member.is_dir
+
+    def open(self, path):
+        '''
+        以二进制只读方式打开成员文件(上下文管理器)
+        '''
+        raise NotImplementedError()
+
+    def read_text(self, path, size=-1):
+        '''
+        与open(path, errors='replace').read(size)行为一致
+        '''
+        with self.open(path) as f:
+            with io.TextIOWrapper(f, errors='replace') as text_f:
+                return text_f.read(size)
+
+
+class DirectoryArchive(BaseArchive):
+    '''
+    已解压的物料包缓存目录，成员信息来自文件清单
+    '''
+    kind = 'dir'
+    tree_kind = 'md5'
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+        self.entry_path = dirpath
+        self.manifest = package_manifest.get_manifest(dirpath)
+
+    @staticmethod
+    def _to_member(entry):
+        return ArchiveMember(entry.path, entry.is_dir, entry.size, entry.mtime, None, entry.md5)
+
+    def members(self):
+        return [self._to_member(e) for e in self.manifest.walk('')]
+
+    def get(self, path):
+        entry = self.manifest.get(path)
+        if entry is None:
+            return None
+        return self._to_member(entry)
+
+    def listdir(self, path):
+        return [self._to_member(e) for e in self.manifest.listdir(path)]
+
+    def walk(self, path):
+        return [self._to_member(e) for e in self.manifest.walk(path)]
+
+    def tree_hash(self, path):
+        # 清单中已持久化基于md5的目录Merkle哈希
+        entry = self.manifest.get(path)
+        return self.tree_kind, None if entry is None else entry.md5
+
+    @contextlib.contextmanager
+    def open(self, path):
+        with open(os.path.join(self.dirpath, package_manifest.normalize_path(path)), 'rb') as f:
+            yield f
+
+
+class ZipArchive(BaseArchive):
+    kind = 'zip'
+    tree_kind = 'zip'
+
+    def _leaf_hash(self, member):
+        return '%08x:%s' % (member.crc, member.size)
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._members = {}
+        self._infos = {}
+        with zipfile.ZipFile(filepath) as zf:
+            for info in zf.infolist():
+                path = package_manifest.normalize_path(info.filename)
+                if not path:
+                    continue
+                self._members[path] = ArchiveMember(path, info.is_dir(), info.file_size,
+                                                    time.mktime(info.date_time + (0, 0, -1)), info.CRC, None)
+                self._infos[path] = info
+        _add_parent_dirs(self._members)
+
+    def members(self):
+        return [self._members[p] for p in sorted(self._members)]
+
+    def get(self, path):
+        return self._members.get(package_manifest.normalize_path(path), None)
+
+    @contextlib.contextmanager
+    def open(self, path):
+        path = package_manifest.normalize_path(path)
+        member = self._members.get(path, None)
+        if member is None:
+            raise FileNotFoundError(path)
+        if member.is_dir:
+            raise IsADirectoryError(path)
+        with zipfile.ZipFile(self.filepath) as zf:
+            with zf.open(self._infos[path]) as f:
+                yield f
+
+
+class TarArchive(BaseArchive):
+    '''
+    tar类压缩包，首次使用时扫描文件头生成成员偏移索引(偏移为解压后tar流中的位置)
+    '''
+    kind = 'tar'
+    # 叶子为文件md5，与已解压缓存清单的目录哈希一致
+    tree_kind = 'md5'
+    T_FILE = 'file'
+    T_DIR = 'dir'
+    T_SYMLINK = 'sym'
+    T_LINK = 'link'
+
+    def _leaf_hash(self, member):
+        return member.md5 or self._get_md5_cache().get(member.path, None)
+
+    def tree_hash(self, path):
+        if getattr(self, '_tree_hashes', None) is None:
+            # 旧版本索引没有md5，一次顺序解压补全全部文件md5
+            self.prefetch_md5([m.path for m in self.members() if not m.is_dir])
+        return super(TarArchive, self).tree_hash(path)
+
+    def __init__(self, filepath, index_dir=None):
+        self.filepath = filepath
+        self.index_dir = index_dir
+        self.index_path = os.path.join(index_dir, ARCHIVE_INDEX_FILE) if index_dir else None
+        # path -> [type, size, mtime, offset, linkname, md5]，旧版本索引没有md5
+        self._index = None
+        # 可随机读取时各成员共享同一个流(indexed_gzip只加载一次检查点)，首次读取时创建
+        self._stream = None
+        self._stream_lock = threading.Lock()
+        if self.index_path and os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self._index = json.load(f)['members']
+        if self._index is None:
+            self._index = self.build_index()
+        # 压缩包中未包含目录条目的隐含目录
+        self._dirs = set()
+        for path in self._index:
+            parent = posixpath.dirname(path)
+            while parent and parent not in self._dirs:
+                self._dirs.add(parent)
+                parent = posixpath.dirname(parent)
+        self._members = {}
+        for path in self._index:
+            member = self._resolve(path)
+            if member is not None:
+                self._members[path] = member
+        _add_parent_dirs(self._members)
+
+    def _get_seekable_paths(self):
+        if not self.index_dir:
+            return None, None
+        return os.path.join(self.index_dir, SEEKABLE_DATA_FILE), os.path.join(self.index_dir, SEEKABLE_INDEX_FILE)
+
+    def _get_gzip_index_path(self):
+        if not self.index_dir:
+            return None
+        return os.path.join(self.index_dir, GZIP_INDEX_FILE)
+
+    def _use_gzip_index(self, compressor):
+        return HAS_INDEXED_GZIP and self.index_dir and compressor is not None and compressor.__name__ == 'gzip'
+
+    def build_index(self):
+        LOG.info('build member index for: %s', self.filepath)
+        index = {}
+        compressor = self._get_compressor()
+        gzip_file = None
+        if self._use_gzip_index(compressor):
+            # 扫描文件头的同时生成解压检查点，扫描结束后导出，压缩包仅解压一次
+            stream = gzip_file = indexed_gzip.IndexedGzipFile(self.filepath,
+                                                              spacing=GZIP_INDEX_SPACING,
+                                                              window_size=GZIP_WINDOW_SIZE)
+        else:
+            data_path, seekable_index_path = self._get_seekable_paths()
+            if data_path and compressor is not None and utils.get_config(CONF, 'package_cache.tar_seekable_copy',
+                                                                         False):
+                # 无法建立检查点的压缩流：解压后分块独立压缩另存，之后的文件头扫描及成员读取均基于分块数据
+                with self._open_stream() as raw_stream:
+                    build_seekable(raw_stream, data_path, seekable_index_path)
+            stream = self._open_stream()
+        with stream, tarfile.open(fileobj=stream, mode='r:') as tf:
+            for info in tf:
+                path = package_manifest.normalize_path(info.name)
+                if not path:
+                    continue
+                if info.isdir():
+                    member_type = self.T_DIR
+                elif info.issym():
+                    member_type = self.T_SYMLINK
+                elif info.islnk():
+                    member_type = self.T_LINK
+                elif info.isreg():
+                    member_type = self.T_FILE
+                else:
+                    continue
+                md5 = None
+                if member_type == self.T_FILE:
+                    # 扫描文件头时顺序计算文件md5，对比时无需再逐个定位读取成员
+                    md5 = hashing.md5_fileobj(tf.extractfile(info))
+                index[path] = [member_type, info.size, info.mtime, info.offset_data, info.linkname, md5]
+            if gzip_file is not None:
+                gzip_file.build_full_index()
+                gzip_index_path = self._get_gzip_index_path()
+                tmp_path = '%s.tmp' % gzip_index_path
+                gzip_file.export_index(tmp_path)
+                os.replace(tmp_path, gzip_index_path)
+        if self.index_path:
+            tmp_path = '%s.tmp' % self.index_path
+            with open(tmp_path, 'w') as f:
+                json.dump({'members': index}, f)
+            os.replace(tmp_path, self.index_path)
+        LOG.info('build member index complete, %s members', len(index))
+        return index
+
+    def _resolve_item(self, path, depth=0):
+        '''
+        跟随符号链接/硬链接，返回(最终路径, 索引项)，链接无效时返回(None, None)
+        '''
+        item = self._index.get(path, None)
+        if item is None and path in self._dirs:
+            item = [self.T_DIR, 0, 0, 0, '']
+        if item is None or depth > MAX_LINK_DEPTH:
+            return None, None
+        if item[0] == self.T_SYMLINK:
+            if item[4].startswith('/'):
+                return None, None
+            return self._resolve_item(package_manifest.normalize_path(posixpath.join(posixpath.dirname(path),
+                                                                                     item[4])), depth + 1)
+        if item[0] == self.T_LINK:
+            return self._resolve_item(package_manifest.normalize_path(item[4]), depth + 1)
+        return path, item
+
+    def _resolve(self, path):
+        target, item = self._resolve_item(path)
+        if item is None:
+            return None
+        is_dir = item[0] == self.T_DIR
+        md5 = None if is_dir or len(item) < 6 else item[5]
+        return ArchiveMember(path, is_dir, 0 if is_dir else item[1], item[2], None, md5)
+
+    def members(self):
+        return [self._members[p] for p in sorted(self._members)]
+
+    def get(self, path):
+        return self._members.get(package_manifest.normalize_path(path), None)
+
+    def _stream_md5(self, targets):
+        '''
+        顺序读取一遍压缩包，计算targets({路径: 数据偏移})中成员的md5，返回{路径: md5}
+        '''
+        results = {}
+        with self._open_stream() as stream, tarfile.open(fileobj=stream, mode='r|') as tf:
+            for info in tf:
+                path = package_manifest.normalize_path(info.name)
+                # 同名成员以索引中记录的(最后一个)为准
+                if info.isreg() and targets.get(path, None) == info.offset_data:
+                    results[path] = hashing.md5_fileobj(tf.extractfile(info))
+                    if len(results) == len(targets):
+                        break
+        return results
+
+    def prefetch_md5(self, paths):
+        '''
+        旧版本索引中没有md5，在一次顺序解压中计算所需成员的md5，避免逐个成员定位解压
+        '''
+        hashes = self._get_md5_cache()
+        pending = collections.defaultdict(list)
+        targets = {}
+        for path in paths:
+            member = self.get(path)
+            if member is None or member.is_dir or member.md5 or member.path in hashes:
+                continue
+            target, item = self._resolve_item(member.path)
+            pending[target].append(member.path)
+            targets[target] = item[3]
+        if not targets:
+            return
+        for target, md5 in hashing.run(self._stream_md5, targets).items():
+            for path in pending[target]:
+                hashes[path] = md5
+
+    def _get_compressor(self):
+        '''
+        根据文件头判断压缩格式，返回对应模块，未压缩返回None
+        '''
+        with open(self.filepath, 'rb') as f:
+            magic = f.read(6)
+        if magic.startswith(b'\x1f\x8b'):
+            import gzip
+            return gzip
+        if magic.startswith(b'BZh'):
+            import bz2
+            return bz2
+        if magic.startswith(b'\xfd7zXZ'):
+            import lzma
+            return lzma
+        return None
+
+    def _open_stream(self):
+        gzip_index_path = self._get_gzip_index_path()
+        if HAS_INDEXED_GZIP and gzip_index_path and os.path.exists(gzip_index_path):
+            return indexed_gzip.IndexedGzipFile(self.filepath, index_file=gzip_index_path, auto_build=False)
+        data_path, seekable_index_path = self._get_seekable_paths()
+        if seekable_index_path and os.path.exists(seekable_index_path):
+            return SeekableReader(data_path, seekable_index_path)
+        compressor = self._get_compressor()
+        if compressor is not None:
+            return compressor.open(self.filepath, 'rb')
+        return open(self.filepath, 'rb')
+
+    def _is_random_access(self):
+        gzip_index_path = self._get_gzip_index_path()
+        if HAS_INDEXED_GZIP and gzip_index_path and os.path.exists(gzip_index_path):
+            return True
+        data_path, seekable_index_path = self._get_seekable_paths()
+        if seekable_index_path and os.path.exists(seekable_index_path):
+            return True
+        return self._get_compressor() is None
+
+    def _get_shared_stream(self):
+        '''
+        返回可随机读取的共享流，流随archive对象一起释放；只能顺序解压的格式返回None
+        '''
+        with self._stream_lock:
+            if self._stream is None and self._is_random_access():
+                self._stream = self._open_stream()
+            return self._stream
+
+    @contextlib.contextmanager
+    def open(self, path):
+        path = package_manifest.normalize_path(path)
+        member = self._members.get(path, None)
+        if member is None:
+            raise FileNotFoundError(path)
+        if member.is_dir:
+            raise IsADirectoryError(path)
+        target, item = self._resolve_item(path)
+        shared_stream = self._get_shared_stream()
+        if shared_stream is not None:
+            with io.BufferedReader(_SharedReader(shared_stream, self._stream_lock, item[3], item[1])) as f:
+                yield f
+            return
+        stream = self._open_stream()
+        try:
+            # 只能顺序解压的压缩流seek需从头解压至目标位置
+            stream.seek(item[3])
+            with io.BufferedReader(_BoundedReader(stream, item[1])) as f:
+                yield f
+        finally:
+            stream.close()
+
+
+def get_archive_file(entry_path):
+    '''
+    获取缓存条目中的物料包文件路径
+    '''
+    data_path = os.path.join(entry_path, ARCHIVE_DATA_DIR)
+    if os.path.isdir(data_path):
+        for name in os.listdir(data_path):
+            return os.path.join(data_path, name)
+    return None
+
+
+def open_archive(entry_path, cache=True):
+    '''
+    打开缓存条目中的物料包，tar类索引持久化在条目目录中，不支持的格式返回None
+
+    :param cache: 是否在进程内缓存archive对象(按物料包文件路径)，临时路径应传入False
+    '''
+    filepath = get_archive_file(entry_path)
+    if filepath is None:
+        return None
+    archive_type = get_archive_type(os.path.basename(filepath))
+    if archive_type is None:
+        return None
+    file_stat = os.stat(filepath)
+    cache_key = (file_stat.st_ino, file_stat.st_mtime)
+    cached = _archives.get(filepath, None) if cache else None
+    if cached is not None and cached[0] == cache_key:
+        _archives.move_to_end(filepath)
+        return cached[1]
+    if archive_type == 'zip':
+        archive = ZipArchive(filepath)
+    else:
+        archive = TarArchive(filepath, entry_path)
+    archive.entry_path = entry_path
+    if not cache:
+        return archive
+    _archives[filepath] = (cache_key, archive)
+    _archives.move_to_end(filepath)
+    while len(_archives) > ARCHIVE_CACHE_SIZE:
+        _archives.popitem(last=False)
+    return archive
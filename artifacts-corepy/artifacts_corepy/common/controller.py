@@ -2,14 +2,24 @@
 
 from __future__ import absolute_import
 
+import itertools
+import json
+import logging
+
 import falcon
 from talos.common.controller import CollectionController
 from talos.common.controller import ItemController
+from talos.core import config
 from talos.core import exceptions
 from talos.core import utils
 from talos.core.i18n import _
 
 from artifacts_corepy.common import exceptions as my_exceptions
+from artifacts_corepy.common import wecmdbv2
+
+LOG = logging.getLogger(__name__)
+CONF = config.CONF
+STREAM_CHUNK_SIZE = 64 * 1024
 
 
 class Collection(CollectionController):
@@ -21,6 +31,65 @@ class Collection(CollectionController):
         return self.make_resource(req).list(req.params, **kwargs)
 
 
+class StreamCollection(Collection):
+    '''
+    逐条序列化资源iterate返回的数据并流式输出，响应内容不在内存中整体构建
+
+    状态字段在data之后输出：输出过程中出错时以status=ERROR及错误信息结束响应，保持JSON完整
+    '''
+    # 开始输出前预取的数据条数，默认为cmdb_client.page_size
+    prefetch_size = None
+
+    def on_get(self, req, resp, **kwargs):
+        self._validate_method(req)
+        items = iter(self.make_resource(req).iterate(req.params, **kwargs))
+        prefetch_size = self.prefetch_size or int(
+            utils.get_config(CONF, 'cmdb_client.page_size', wecmdbv2.DEFAULT_PAGE_SIZE) or wecmdbv2.DEFAULT_PAGE_SIZE)
+        # 先取完首页数据(多取一条以确保首页响应状态已校验)，查询错误仍以正常的错误响应返回
+        prefetched = list(itertools.islice(items, prefetch_size + 1))
+        resp.content_type = falcon.MEDIA_JSON
+        resp.stream = self._generate(prefetched, items)
+
+    @staticmethod
+    def _dumps(data):
+        return json.dumps(data, cls=utils.ComplexEncoder).encode()
+
+    @classmethod
+    def _error_fields(cls, e):
+        # 与wsgi_server.error_serializer的错误响应格式一致
+        if isinstance(e, exceptions.Error):
+            representation = e.to_dict()
+            code = representation.pop('error_code', representation['code'])
+            message = representation.get('description', '')
+        else:
+            code = 500
+            message = _('Unknown Error')
+        return {'code': code, 'status': 'ERROR', 'message': message}
+
+    @classmethod
+    def _generate(cls, prefetched, items):
+        chunk = [b'{"data": [']
+        size = 0
+        fields = {'code': 200, 'status': 'OK', 'message': 'success'}
+        try:
+            for idx, item in enumerate(itertools.chain(prefetched, items)):
+                data = cls._dumps(item)
+                if idx:
+                    data = b',' + data
+                chunk.append(data)
+                size += len(data)
+                if size >= STREAM_CHUNK_SIZE:
+                    yield b''.join(chunk)
+                    chunk, size = [], 0
+        except Exception as e:
+            # 响应已开始输出，已输出的数据不完整，以错误状态结束
+            LOG.exception(e)
+            fields = cls._error_fields(e)
+        # 状态字段接在data之后：去掉对象的起始'{'
+        chunk.append(b'], ' + cls._dumps(fields)[1:])
+        yield b''.join(chunk)
+
+
 class Item(ItemController):
     def on_get(self, req, resp, **kwargs):
         self._validate_method(req)
@@ -77,6 +77,16 @@ class PluginCallError(PluginError):
     error_code = 40003
 
 
+class UpstreamUnavailableError(PluginCallError):
+    """上游服务熔断，快速失败"""
+    code = 200
+    error_code = 40005
+
+    @property
+    def title(self):
+        return _('Service Unavailable')
+
+
 class NotFoundError(PluginError):
     """查找系统间数据异常"""
     code = 200
@@ -0,0 +1,77 @@
+# coding=utf-8
+"""
+artifacts_corepy.common.hashing
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+本模块提供文件摘要计算服务
+
+摘要计算在有界的真实线程池中执行(hashlib处理大块数据时释放GIL，可利用多核)，
+gevent worker中调用方greenlet等待结果时不阻塞其他请求
+
+"""
+import concurrent.futures
+import hashlib
+import os
+import threading
+
+from talos.core import config
+from talos.core import utils
+
+from artifacts_corepy.common import utils as artifact_utils
+
+CONF = config.CONF
+CHUNK_SIZE = 1024 * 1024
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def md5_fileobj(fileobj, chunk_size=CHUNK_SIZE):
+    hasher = hashlib.md5()
+    chunk = fileobj.read(chunk_size)
+    while chunk:
+        hasher.update(chunk)
+        chunk = fileobj.read(chunk_size)
+    return hasher.hexdigest()
+
+
+def md5_file(filepath, chunk_size=CHUNK_SIZE):
+    with open(filepath, 'rb') as fileobj:
+        return md5_fileobj(fileobj, chunk_size)
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            max_workers = int(utils.get_config(CONF, 'package_cache.hash_max_workers', 0) or 0)
+            max_workers = max_workers or min(os.cpu_count() or 4, 16)
+            if artifact_utils.is_gevent_patched():
+                # gevent线程池使用真实线程，threading/concurrent.futures已被patch为greenlet
+                from gevent.threadpool import ThreadPool
+                _pool = ThreadPool(max_workers)
+            else:
+                _pool = concurrent.futures.ThreadPoolExecutor(max_workers)
+        return _pool
+
+
+def run(func, *args):
+    '''
+    在线程池中执行并等待结果
+    '''
+    pool = get_pool()
+    if isinstance(pool, concurrent.futures.Executor):
+        return pool.submit(func, *args).result()
+    return pool.apply(func, args)
+
+
+def run_many(func, items):
+    '''
+    在线程池中并发执行，按输入顺序返回结果列表
+    '''
+    items = list(items)
+    if not items:
+        return []
+    if len(items) == 1:
+        return [run(func, items[0])]
+    return list(get_pool().map(func, items))
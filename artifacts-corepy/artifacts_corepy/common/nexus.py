@@ -5,6 +5,9 @@ artifacts_corepy.common.nexusclient
 
 本模块提供项目Neuxs Client
 
+group的资产列表缓存在ttl_cache(nexus_listing)中，过期后短时间内先返回旧列表并在后台刷新；
+通过本客户端上传/删除资产时立即清除对应group的缓存；列表缓存仅用于浏览，获取单个资产校验值时始终精确查询
+
 """
 import logging
 from contextlib import contextmanager
@@ -12,7 +15,10 @@ from contextlib import contextmanager
 import requests
 import requests.auth
 from requests_toolbelt import MultipartEncoder
-from talos.utils import http
+
+from artifacts_corepy.common import resilience
+from artifacts_corepy.common import ttl_cache
+from artifacts_corepy.common import utils
 
 LOG = logging.getLogger(__name__)
 
@@ -24,40 +30,96 @@ class NeuxsClient(object):
         self.username = username
         self.password = password
 
-    def list(self, repository, path, extensions=None, continue_token=None, search_url='/service/rest/v1/search/assets', filename=None):
-        results = []
-        url = self.server + search_url
-        # group必须以/开头且结尾不包含/
-        group = path.lstrip('/')
-        group = '/' + group.rstrip('/')
-        query = {'repository': repository, 'group': group}
-        if filename:
-            query['q'] = filename
+    def _search_assets(self, url, query, continue_token=None):
         if continue_token:
-            query['continuationToken'] = continue_token
+            query = dict(query, continuationToken=continue_token)
         LOG.info('GET %s', url)
         LOG.debug('Request: %s', str(query))
-        resp_json = http.RestfulJson.get(url,
+        resp_json = utils.RestfulJson.get(url,
                                          params=query,
-                                         auth=requests.auth.HTTPBasicAuth(self.username, self.password))
+                                         auth=requests.auth.HTTPBasicAuth(self.username, self.password),
+                                         upstream='nexus')
         LOG.debug('Response: %s', str(resp_json))
-        filtered_items = []
-        if extensions is not None:
+        return resp_json
+
+    @staticmethod
+    def _format_asset(item):
+        return {
+            'name': item['path'].split('/')[-1],
+            'downloadUrl': item['downloadUrl'],
+            'md5': item.get('checksum', {}).get('md5', None) or item.get('checksum', {}).get('sha1', None) or 'N/A',
+            'lastModified': item['lastModified'][:19] + 'Z' if item.get('lastModified', None) else None
+        }
+
+    def iter_assets(self, repository, path, extensions=None, continue_token=None,
+                    search_url='/service/rest/v1/search/assets', filename=None):
+        '''
+        按页遍历资产，调用方处理当前页时后台预取下一页；调用方可随时结束遍历
+        '''
+        url = self.server + search_url
+        query = {'repository': repository, 'group': self._normalize_group(path)}
+        if filename:
+            query['q'] = filename
+        resp_json = self._search_assets(url, query, continue_token)
+        while True:
+            next_page = None
+            if resp_json.get('continuationToken', None):
+                next_page = utils.BackgroundTask(self._search_assets, url, query, resp_json['continuationToken'])
             for i in resp_json['items']:
-                for e in extensions:
-                    if i['path'].endswith(e):
-                        filtered_items.append(i)
+                if extensions is not None and not any(i['path'].endswith(e) for e in extensions):
+                    continue
+                yield self._format_asset(i)
+            if next_page is None:
+                break
+            resp_json = next_page.result()
+
+    def list(self, repository, path, extensions=None, continue_token=None, search_url='/service/rest/v1/search/assets', filename=None):
+        return list(
+            self.iter_assets(repository,
+                             path,
+                             extensions=extensions,
+                             continue_token=continue_token,
+                             search_url=search_url,
+                             filename=filename))
+
+    @staticmethod
+    def _normalize_group(path):
+        # group必须以/开头且结尾不包含/
+        group = path.lstrip('/')
+        return '/' + group.rstrip('/')
+
+    def _get_listing_key(self, repository, path):
+        return {'server': self.server, 'repository': repository, 'group': self._normalize_group(path)}
+
+    def invalidate_listing(self, repository, path=None):
+        '''
+        清除group资产列表缓存，未指定group时清除全部
+        '''
+        if path is None:
+            ttl_cache.CACHE.purge('nexus_listing')
         else:
-            filtered_items = resp_json['items']
-        results.extend([{
-            'name': i['path'].split('/')[-1],
-            'downloadUrl': i['downloadUrl'],
-            'md5': i.get('checksum', {}).get('md5', None) or i.get('checksum', {}).get('sha1', None) or 'N/A',
-            'lastModified': i['lastModified'][:19]+'Z' if i.get('lastModified', None) else None
-        } for i in filtered_items])
-        if resp_json['continuationToken']:
-            results.extend(self.list(repository, path, extensions, continue_token=resp_json['continuationToken'], filename=filename))
-        return results
+            ttl_cache.CACHE.invalidate('nexus_listing', self._get_listing_key(repository, path))
+
+    def list_cached(self, repository, path, extensions=None):
+        '''
+        同list，使用group资产列表缓存
+        '''
+        results = ttl_cache.CACHE.get_or_load('nexus_listing', self._get_listing_key(repository, path),
+                                              lambda: list(self.iter_assets(repository, path)))
+        if extensions is None:
+            return results
+        return [i for i in results if any(i['name'].endswith(e) for e in extensions)]
+
+    def find_asset(self, repository, path, name):
+        '''
+        按资产名精确查询group下的文件，不存在时返回None
+
+        校验值会作为物料包md5_value(缓存内容寻址)保存，资产可能被覆盖上传，不使用列表缓存
+        '''
+        item = self.get_asset(repository, path, name)
+        if not item:
+            return None
+        return self._format_asset(item)
 
     def upload(self, repository, path, filename, filetype, fileobj, upload_url='/service/rest/v1/components'):
         url = self.server + upload_url
@@ -70,12 +132,16 @@ class NeuxsClient(object):
         LOG.debug('Request: query - %s, form - %s ', str(query), str(form))
         form['raw.asset1'] = (filename, fileobj, filetype)
         stream_form = MultipartEncoder(fields=form)
-        resp_json = http.RestfulJson.post(url,
+        resp_json = utils.RestfulJson.post(url,
                                           params=query,
                                           data=stream_form,
                                           headers={'Content-Type': stream_form.content_type},
-                                          auth=requests.auth.HTTPBasicAuth(self.username, self.password))
+                                          auth=requests.auth.HTTPBasicAuth(self.username, self.password),
+                                          timeout=resilience.get_transfer_timeout('nexus',
+                                                                                  utils.get_http_timeout()),
+                                          upstream='nexus')
         LOG.debug('Response: %s', str(resp_json))
+        self.invalidate_listing(repository, path)
         return {
             'name': filename,
             'downloadUrl': '%(server)s/repository/%(repository)s%(group)s%(filename)s' % {
@@ -87,28 +153,31 @@ class NeuxsClient(object):
         }
 
     def get_asset(self, repository, group, name, search_url='/service/rest/v1/search/assets'):
-        url = self.server + search_url
-        # group必须以/开头且结尾不包含/
-        group = group.lstrip('/')
-        group = '/' + group.rstrip('/')
+        '''
+        按资产名精确查询，name可以是完整路径(不以/开头)或文件名，不存在时返回{}
+        '''
+        group = self._normalize_group(group)
+        if '/' not in name and group != '/':
+            # raw仓库的资产名为完整路径
+            name = group.lstrip('/') + '/' + name
         query = {'repository': repository, 'group': group, 'name': name}
-        LOG.info('GET %s', url)
-        LOG.debug('Request: %s', str(query))
-        resp_json = http.RestfulJson.get(url,
-                                         params=query,
-                                         auth=requests.auth.HTTPBasicAuth(self.username, self.password))
-        LOG.debug('Response: %s', str(resp_json))
+        resp_json = self._search_assets(self.server + search_url, query)
         result = resp_json.get("items", [])
         if not result:
             return {}
         return result[0]
 
-    def delete_assets(self, repository, delete_url):
+    def delete_assets(self, repository, delete_url, group=None):
+        '''
+        删除资产，指定group时仅清除该group的列表缓存，否则清除全部
+        '''
         url = self.server + delete_url
         LOG.info('DELETE %s', url)
-        resp_json = http.RestfulJson.delete(url,
-                                            auth=requests.auth.HTTPBasicAuth(self.username, self.password))
+        resp_json = utils.RestfulJson.delete(url,
+                                            auth=requests.auth.HTTPBasicAuth(self.username, self.password),
+                                            upstream='nexus')
         LOG.debug('Response: %s', str(resp_json))
+        self.invalidate_listing(repository, group)
 
     @contextmanager
     def download_stream(self, url=None, repository=None, path=None):
@@ -119,10 +188,19 @@ class NeuxsClient(object):
             new_url = self.server + '/repository/' + repository + '/' + path.lstrip('/')
         LOG.info('GET %s', new_url)
         LOG.debug('Request: ')
-        resp = requests.get(new_url, auth=requests.auth.HTTPBasicAuth(self.username, self.password), stream=True)
-        resp.raise_for_status()
-        yield resp
-        LOG.debug('Response: as file stream')
+        resp = utils.http_request('GET',
+                                  new_url,
+                                  auth=requests.auth.HTTPBasicAuth(self.username, self.password),
+                                  stream=True,
+                                  timeout=resilience.get_transfer_timeout('nexus', utils.get_http_timeout()),
+                                  upstream='nexus')
+        try:
+            resp.raise_for_status()
+            yield resp
+            LOG.debug('Response: as file stream')
+        finally:
+            # 归还连接到连接池
+            resp.close()
 
     def download_file(self, filepath, url=None, repository=None, path=None):
         with self.download_stream(url=url, repository=repository, path=path) as resp:
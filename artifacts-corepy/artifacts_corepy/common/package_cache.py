@@ -0,0 +1,422 @@
+# coding=utf-8
+"""
+artifacts_corepy.common.package_cache
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+本模块提供物料包本地缓存管理能力
+
+缓存按物料包内容校验值(md5_value)寻址，目录结构如下：
+
+    <pakcage_cache_dir>/content/<checksum>/    解压后的物料包内容
+    <pakcage_cache_dir>/meta/<checksum>/    缓存条目元数据(完成标记，访问记录，占用空间，请求锁定)
+    <pakcage_cache_dir>/archives/<checksum>/    未解压的物料包及成员索引(仅按需读取单个文件时)
+    <pakcage_cache_dir>/meta/<checksum>.archive/    未解压物料包的元数据
+    <pakcage_cache_dir>/staging/<uuid>/    正在解压的临时目录
+    <pakcage_cache_dir>/diffs/<checksum>/<baseline checksum>.json    物料包与基线包的对比结果
+    <pakcage_cache_dir>/cmdb/    CMDB元数据缓存(见ttl_cache)
+    <pakcage_cache_dir>/<guid> -> content/<checksum>    物料包guid索引(符号链接)
+
+相同制品在多个物料包中注册时，仅下载并解压一次；缓存按容量/条目数预算以LRU方式淘汰，
+请求处理中使用的条目不会被淘汰
+
+物料包先解压到staging目录，再原子改名为缓存条目并写入完成标记；读取方仅检查完成标记，无需加锁
+
+"""
+import logging
+import os
+import os.path
+import re
+import shutil
+import time
+import uuid
+
+from talos.core import config
+from talos.core import utils
+from talos.utils import scoped_globals
+
+LOG = logging.getLogger(__name__)
+CONF = config.CONF
+
+CONTENT_DIR = 'content'
+META_DIR = 'meta'
+STAGING_DIR = 'staging'
+ARCHIVE_DIR = 'archives'
+ARCHIVE_META_SUFFIX = '.archive'
+DIFF_DIR = 'diffs'
+CMDB_CACHE_DIR = 'cmdb'
+RESERVED_NAMES = (CONTENT_DIR, META_DIR, STAGING_DIR, ARCHIVE_DIR, DIFF_DIR, CMDB_CACHE_DIR)
+COMPLETE_FILE = 'complete'
+ACCESS_FILE = 'access'
+SIZE_FILE = 'size'
+PINS_DIR = 'pins'
+R_CHECKSUM = re.compile(r'^[0-9a-fA-F]{32,128}$')
+
+
+def get_cache_dir():
+    return CONF.pakcage_cache_dir
+
+
+def normalize_checksum(checksum):
+    '''
+    校验值合法(md5/sha1等十六进制摘要)则返回小写形式，否则返回None(如N/A)
+    '''
+    if checksum and isinstance(checksum, str):
+        checksum = checksum.strip()
+        if R_CHECKSUM.match(checksum):
+            return checksum.lower()
+    return None
+
+
+def get_content_path(checksum):
+    return os.path.join(get_cache_dir(), CONTENT_DIR, checksum)
+
+
+def get_package_path(guid):
+    return os.path.join(get_cache_dir(), guid)
+
+
+def link_package(guid, content_path):
+    '''
+    建立物料包guid到内容目录的索引，已指向相同内容时不做修改
+    '''
+    link_path = get_package_path(guid)
+    target = os.path.relpath(content_path, os.path.dirname(link_path))
+    if os.path.islink(link_path):
+        if os.readlink(link_path) == target:
+            return link_path
+    elif os.path.isdir(link_path):
+        # 旧版本按guid解压的缓存目录
+        LOG.info('replace legacy cache dir: %s with link to %s', link_path, content_path)
+        shutil.rmtree(link_path, ignore_errors=True)
+    tmp_link_path = '%s.%s.tmp' % (link_path, uuid.uuid4().hex)
+    os.symlink(target, tmp_link_path)
+    os.replace(tmp_link_path, link_path)
+    return link_path
+
+
+def get_archive_path(entry_path):
+    '''
+    缓存条目对应的未解压物料包条目路径
+    '''
+    return os.path.join(get_cache_dir(), ARCHIVE_DIR, os.path.basename(entry_path))
+
+
+def get_meta_path(entry_path):
+    name = os.path.basename(entry_path)
+    if os.path.basename(os.path.dirname(entry_path)) == ARCHIVE_DIR:
+        name += ARCHIVE_META_SUFFIX
+    return os.path.join(get_cache_dir(), META_DIR, name)
+
+
+def get_entry_key(entry_path):
+    '''
+    缓存条目的内容标识：按校验值缓存时为校验值，旧版本按guid解压的缓存为guid
+    '''
+    return os.path.basename(os.path.realpath(entry_path))
+
+
+def has_entry_key(key):
+    base_dir = get_cache_dir()
+    return any([os.path.isdir(os.path.join(base_dir, sub_dir, key)) for sub_dir in (CONTENT_DIR, ARCHIVE_DIR, '')])
+
+
+def get_diff_path(key, baseline_key):
+    return os.path.join(get_cache_dir(), DIFF_DIR, key, baseline_key + '.json')
+
+
+def _ensure_meta_path(entry_path):
+    meta_path = get_meta_path(entry_path)
+    os.makedirs(meta_path, exist_ok=True)
+    return meta_path
+
+
+def is_complete(entry_path):
+    return os.path.exists(os.path.join(get_meta_path(entry_path), COMPLETE_FILE)) and os.path.isdir(entry_path)
+
+
+def mark_complete(entry_path):
+    with open(os.path.join(_ensure_meta_path(entry_path), COMPLETE_FILE), 'w'):
+        pass
+
+
+def unmark_complete(entry_path):
+    '''
+    移除完成标记，返回移除前是否存在标记
+    '''
+    try:
+        os.remove(os.path.join(get_meta_path(entry_path), COMPLETE_FILE))
+        return True
+    except OSError:
+        return False
+
+
+def create_staging_path():
+    staging_path = os.path.join(get_cache_dir(), STAGING_DIR, uuid.uuid4().hex)
+    os.makedirs(staging_path)
+    return staging_path
+
+
+def install(staging_path, entry_path):
+    '''
+    将解压完成的staging目录原子改名为缓存条目，已存在的不完整条目会被替换；
+    调用方生成清单等元数据后再调用mark_complete
+    '''
+    unmark_complete(entry_path)
+    if os.path.islink(entry_path):
+        os.remove(entry_path)
+    elif os.path.exists(entry_path):
+        LOG.info('replace incomplete cache dir: %s', entry_path)
+        remove_entry(entry_path, keep_meta=True)
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+    os.rename(staging_path, entry_path)
+    return entry_path
+
+
+def record_access(entry_path):
+    '''
+    记录条目访问时间，淘汰时以此为准(不依赖文件系统atime，兼容noatime挂载)
+    '''
+    access_file = os.path.join(_ensure_meta_path(entry_path), ACCESS_FILE)
+    try:
+        os.utime(access_file)
+    except FileNotFoundError:
+        with open(access_file, 'a'):
+            pass
+
+
+def get_last_access(entry_path):
+    try:
+        return os.stat(os.path.join(get_meta_path(entry_path), ACCESS_FILE)).st_mtime
+    except OSError:
+        return os.stat(entry_path).st_mtime
+
+
+def calculate_dir_size(path):
+    total = 0
+    for _root, _dirs, _files in os.walk(path):
+        for f in _files:
+            try:
+                total += os.lstat(os.path.join(_root, f)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def record_size(entry_path, size=None):
+    if size is None:
+        size = calculate_dir_size(entry_path)
+    with open(os.path.join(_ensure_meta_path(entry_path), SIZE_FILE), 'w') as f:
+        f.write(str(size))
+    return size
+
+
+def get_size(entry_path):
+    try:
+        with open(os.path.join(get_meta_path(entry_path), SIZE_FILE)) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return record_size(entry_path)
+
+
+def pin(entry_path):
+    '''
+    锁定条目，防止使用期间被淘汰，返回锁定标记文件路径
+    '''
+    pins_path = os.path.join(_ensure_meta_path(entry_path), PINS_DIR)
+    os.makedirs(pins_path, exist_ok=True)
+    pin_path = os.path.join(pins_path, '%s.%s' % (os.getpid(), uuid.uuid4().hex))
+    with open(pin_path, 'w'):
+        pass
+    return pin_path
+
+
+def unpin(pin_path):
+    try:
+        os.remove(pin_path)
+    except OSError:
+        pass
+
+
+def is_pinned(entry_path, pin_timeout):
+    '''
+    是否存在有效锁定，超时的锁定(进程异常退出遗留)会被清理
+    '''
+    pins_path = os.path.join(get_meta_path(entry_path), PINS_DIR)
+    if not os.path.isdir(pins_path):
+        return False
+    pinned = False
+    for name in list(os.listdir(pins_path)):
+        pin_path = os.path.join(pins_path, name)
+        try:
+            if time.time() - os.stat(pin_path).st_mtime > pin_timeout:
+                LOG.info('remove stale pin: %s', pin_path)
+                unpin(pin_path)
+            else:
+                pinned = True
+        except OSError:
+            pass
+    return pinned
+
+
+def pin_for_request(entry_path):
+    '''
+    在当前请求范围内锁定条目，请求结束时由中间件释放
+    '''
+    request = utils.get_attr(scoped_globals.GLOBALS, 'request')
+    if request is None:
+        return
+    pins = getattr(request, 'package_cache_pins', None)
+    if pins is None:
+        pins = {}
+        request.package_cache_pins = pins
+    if entry_path not in pins:
+        pins[entry_path] = pin(entry_path)
+
+
+def release_request_pins(request):
+    pins = getattr(request, 'package_cache_pins', None) or {}
+    for pin_path in pins.values():
+        unpin(pin_path)
+    pins.clear()
+
+
+def iter_entries():
+    '''
+    遍历缓存条目路径(内容目录，未解压物料包目录及旧版本按guid解压的目录)，不包含guid索引链接
+    '''
+    base_dir = get_cache_dir()
+    if not os.path.isdir(base_dir):
+        return
+    for name in list(os.listdir(base_dir)):
+        fullpath = os.path.join(base_dir, name)
+        if name in RESERVED_NAMES or name.startswith('.') or os.path.islink(fullpath):
+            continue
+        if os.path.isdir(fullpath):
+            yield fullpath
+    for sub_dir in (CONTENT_DIR, ARCHIVE_DIR):
+        sub_dir = os.path.join(base_dir, sub_dir)
+        if os.path.isdir(sub_dir):
+            for name in list(os.listdir(sub_dir)):
+                fullpath = os.path.join(sub_dir, name)
+                if not name.startswith('.') and os.path.isdir(fullpath):
+                    yield fullpath
+
+
+def remove_entry(entry_path, keep_meta=False):
+    # 先移除完成标记并改名使条目立即不可见，再删除文件
+    unmark_complete(entry_path)
+    trash_path = os.path.join(os.path.dirname(entry_path),
+                              '.%s.%s.deleting' % (os.path.basename(entry_path), uuid.uuid4().hex))
+    try:
+        os.rename(entry_path, trash_path)
+    except OSError as e:
+        LOG.info('remove dir: %s error: %s', entry_path, str(e))
+        return
+    shutil.rmtree(trash_path, ignore_errors=True)
+    if not keep_meta:
+        shutil.rmtree(get_meta_path(entry_path), ignore_errors=True)
+
+
+def evict(max_bytes=0, max_entries=0, max_idle=0, pin_timeout=1800):
+    '''
+    按最近访问时间淘汰缓存条目，直到满足容量/条目数预算；
+    max_idle>0时同时淘汰闲置超时的条目；被锁定的条目不会被淘汰
+    '''
+    entries = []
+    for entry_path in iter_entries():
+        try:
+            entries.append([get_last_access(entry_path), entry_path, get_size(entry_path)])
+        except OSError as e:
+            LOG.info('stat dir: %s error: %s', entry_path, str(e))
+    entries.sort(key=lambda x: x[0])
+    total_bytes = sum([e[2] for e in entries])
+    total_entries = len(entries)
+    now = time.time()
+    for last_access, entry_path, size in entries:
+        over_budget = (max_bytes > 0 and total_bytes > max_bytes) or (max_entries > 0 and total_entries > max_entries)
+        idle = max_idle > 0 and now - last_access > max_idle
+        if not over_budget and not idle:
+            if max_idle > 0:
+                continue
+            break
+        if is_pinned(entry_path, pin_timeout):
+            continue
+        # 先移除完成标记再复查锁定，避免与刚通过完成标记检查的读取方竞争
+        completed = unmark_complete(entry_path)
+        if is_pinned(entry_path, pin_timeout):
+            if completed:
+                mark_complete(entry_path)
+            continue
+        LOG.info('remove dir: %s, size: %s, last access: %s', entry_path, size, last_access)
+        remove_entry(entry_path)
+        total_bytes -= size
+        total_entries -= 1
+    remove_dangling_links()
+    remove_orphan_meta(pin_timeout)
+    remove_orphan_diffs()
+    remove_stale_staging(pin_timeout)
+    LOG.info('package cache usage: %s bytes, %s entries', total_bytes, total_entries)
+    return total_bytes, total_entries
+
+
+def remove_orphan_meta(pin_timeout):
+    meta_dir = os.path.join(get_cache_dir(), META_DIR)
+    if not os.path.isdir(meta_dir):
+        return
+    existing = set([os.path.basename(get_meta_path(p)) for p in iter_entries()])
+    for name in list(os.listdir(meta_dir)):
+        fullpath = os.path.join(meta_dir, name)
+        if name not in existing and not is_pinned(fullpath, pin_timeout):
+            shutil.rmtree(fullpath, ignore_errors=True)
+
+
+def remove_orphan_diffs():
+    '''
+    物料包或基线包已淘汰时清理对应的对比结果
+    '''
+    diff_dir = os.path.join(get_cache_dir(), DIFF_DIR)
+    if not os.path.isdir(diff_dir):
+        return
+    for key in list(os.listdir(diff_dir)):
+        key_path = os.path.join(diff_dir, key)
+        if not has_entry_key(key):
+            shutil.rmtree(key_path, ignore_errors=True)
+            continue
+        for name in list(os.listdir(key_path)):
+            baseline_key, ext = os.path.splitext(name)
+            if ext == '.json' and not has_entry_key(baseline_key):
+                try:
+                    os.remove(os.path.join(key_path, name))
+                except OSError:
+                    pass
+
+
+def remove_dangling_links():
+    base_dir = get_cache_dir()
+    if not os.path.isdir(base_dir):
+        return
+    for name in list(os.listdir(base_dir)):
+        fullpath = os.path.join(base_dir, name)
+        if os.path.islink(fullpath) and not os.path.exists(fullpath):
+            LOG.info('remove dangling link: %s', fullpath)
+            try:
+                os.remove(fullpath)
+            except OSError as e:
+                LOG.info('remove link: %s error: %s', fullpath, str(e))
+
+
+def remove_stale_staging(timeout):
+    '''
+    清理异常中断遗留的staging目录
+    '''
+    staging_dir = os.path.join(get_cache_dir(), STAGING_DIR)
+    if not os.path.isdir(staging_dir):
+        return
+    for name in list(os.listdir(staging_dir)):
+        fullpath = os.path.join(staging_dir, name)
+        try:
+            if time.time() - os.stat(fullpath).st_mtime > timeout:
+                LOG.info('remove stale staging dir: %s', fullpath)
+                shutil.rmtree(fullpath, ignore_errors=True)
+        except OSError:
+            pass
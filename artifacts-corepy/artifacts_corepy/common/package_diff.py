@@ -0,0 +1,195 @@
+# coding=utf-8
+"""
+artifacts_corepy.common.package_diff
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+本模块提供物料包与基线包文件差异判断
+
+优先比较已知的元数据：文件大小，文件清单md5，zip类中央目录记录的CRC32及大小，
+tar类建立索引时顺序计算的md5(旧版本索引为文件头记录的大小及修改时间)；
+仅元数据无法判断时才读取文件内容计算md5；目录树(Merkle)哈希一致的子树整体视为相同
+
+物料包与基线包上传后内容不变，全量对比结果按(物料包校验值, 基线包校验值)持久化在缓存目录中，
+对比、目录树、详情等接口共用同一份结果
+
+"""
+import collections
+import json
+import logging
+import os
+import os.path
+import posixpath
+import uuid
+
+from artifacts_corepy.common import package_cache
+
+LOG = logging.getLogger(__name__)
+
+DIFF_CACHE_SIZE = 32
+SAME = 'same'
+CHANGED = 'changed'
+NEW = 'new'
+DELETED = 'deleted'
+
+DiffSnapshot = collections.namedtuple('DiffSnapshot', 'package_files, baseline_files, results')
+
+_results = collections.OrderedDict()
+
+
+def is_same_by_metadata(package_files, baseline_files, member, b_member):
+    '''
+    通过元数据判断成员文件是否相同，无法判断时返回None
+    '''
+    if member.is_dir != b_member.is_dir:
+        return False
+    # 大小不同则内容必然不同
+    if member.size != b_member.size:
+        return False
+    if member.md5 and b_member.md5:
+        return member.md5 == b_member.md5
+    if member.crc is not None and b_member.crc is not None:
+        return member.crc == b_member.crc and member.size == b_member.size
+    if package_files.kind == 'tar' and baseline_files.kind == 'tar':
+        if member.size == b_member.size and member.mtime == b_member.mtime:
+            return True
+    return None
+
+
+def is_same(package_files, baseline_files, member, b_member):
+    '''
+    判断成员文件是否相同，元数据无法判断时计算md5
+    '''
+    same = is_same_by_metadata(package_files, baseline_files, member, b_member)
+    if same is None:
+        same = package_files.md5(member.path) == baseline_files.md5(b_member.path)
+    return same
+
+
+def _mark_subtree(archive_files, path, status, results):
+    for m in archive_files.walk(path):
+        results[m.path] = (m.is_dir, status)
+
+
+def compare(package_files, baseline_files):
+    '''
+    全量对比物料包与基线包，返回{path: (is_dir, status)}，仅包含任一方存在的路径
+    '''
+    results = {}
+    pending = []
+    pending_dirs = []
+    stack = ['']
+    while stack:
+        path = stack.pop()
+        children = dict([(m.path, m) for m in package_files.listdir(path)])
+        b_children = dict([(m.path, m) for m in baseline_files.listdir(path)])
+        for p in set(children) | set(b_children):
+            m, b_m = children.get(p, None), b_children.get(p, None)
+            if b_m is None:
+                results[p] = (m.is_dir, NEW)
+                _mark_subtree(package_files, p, NEW, results)
+            elif m is None:
+                results[p] = (b_m.is_dir, DELETED)
+                _mark_subtree(baseline_files, p, DELETED, results)
+            elif m.is_dir != b_m.is_dir:
+                results[p] = (m.is_dir, CHANGED)
+                _mark_subtree(baseline_files, p, DELETED, results)
+                _mark_subtree(package_files, p, NEW, results)
+            elif m.is_dir:
+                kind, tree_hash = package_files.tree_hash(p)
+                b_kind, b_tree_hash = baseline_files.tree_hash(p)
+                if kind == b_kind and tree_hash is not None and tree_hash == b_tree_hash:
+                    results[p] = (True, SAME)
+                    _mark_subtree(package_files, p, SAME, results)
+                else:
+                    # 子孙对比完成后再确定目录状态
+                    results[p] = (True, None)
+                    pending_dirs.append(p)
+                    stack.append(p)
+            else:
+                same = is_same_by_metadata(package_files, baseline_files, m, b_m)
+                if same is None:
+                    pending.append(p)
+                    results[p] = (False, None)
+                else:
+                    results[p] = (False, SAME if same else CHANGED)
+    # 需要读取内容的文件在摘要线程池中并发计算md5
+    package_files.prefetch_md5(pending)
+    baseline_files.prefetch_md5(pending)
+    for p in pending:
+        results[p] = (False, SAME if package_files.md5(p) == baseline_files.md5(p) else CHANGED)
+    # 自底向上确定目录状态
+    changed_dirs = set()
+    for p, (is_dir, status) in results.items():
+        if status != SAME:
+            parent = posixpath.dirname(p)
+            while parent and parent not in changed_dirs:
+                changed_dirs.add(parent)
+                parent = posixpath.dirname(parent)
+    for p in pending_dirs:
+        results[p] = (True, CHANGED if p in changed_dirs else SAME)
+    return results
+
+
+def _load(diff_path):
+    try:
+        mtime = os.stat(diff_path).st_mtime
+    except OSError:
+        return None
+    cached = _results.get(diff_path, None)
+    if cached is not None and cached[0] == mtime:
+        _results.move_to_end(diff_path)
+        return cached[1]
+    try:
+        with open(diff_path) as f:
+            results = dict([(p, tuple(v)) for p, v in json.load(f)['files'].items()])
+    except (OSError, ValueError, KeyError) as e:
+        LOG.warning('load diff result: %s error: %s', diff_path, str(e))
+        return None
+    _remember(diff_path, mtime, results)
+    return results
+
+
+def _save(diff_path, results):
+    os.makedirs(os.path.dirname(diff_path), exist_ok=True)
+    # 写入临时文件后替换，读取方不会读到不完整的结果
+    tmp_path = '%s.%s.tmp' % (diff_path, uuid.uuid4().hex)
+    with open(tmp_path, 'w') as f:
+        json.dump({'files': results}, f)
+    os.replace(tmp_path, diff_path)
+    _remember(diff_path, os.stat(diff_path).st_mtime, results)
+
+
+def _remember(diff_path, mtime, results):
+    _results[diff_path] = (mtime, results)
+    _results.move_to_end(diff_path)
+    while len(_results) > DIFF_CACHE_SIZE:
+        _results.popitem(last=False)
+
+
+def get_diff_results(package_files, baseline_files):
+    '''
+    获取物料包与基线包的全量对比结果，优先使用已持久化的结果
+    '''
+    key, baseline_key = package_files.content_key, baseline_files.content_key
+    if not key or not baseline_key:
+        return compare(package_files, baseline_files)
+    diff_path = package_cache.get_diff_path(key, baseline_key)
+    results = _load(diff_path)
+    if results is None:
+        LOG.info('compare package: %s with baseline: %s', key, baseline_key)
+        results = compare(package_files, baseline_files)
+        try:
+            _save(diff_path, results)
+        except (OSError, UnicodeError) as e:
+            LOG.warning('save diff result: %s error: %s', diff_path, str(e))
+    return results
+
+
+def create_snapshot(package_files, baseline_files=None):
+    '''
+    物料包对比快照：一次获取对比结果，供多处文件分析共用；无基线包时结果为空
+    '''
+    results = {}
+    if baseline_files is not None:
+        results = get_diff_results(package_files, baseline_files)
+    return DiffSnapshot(package_files, baseline_files, results)
@@ -0,0 +1,204 @@
+# coding=utf-8
+"""
+artifacts_corepy.common.package_manifest
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+本模块提供物料包文件清单能力
+
+物料包解压后一次性生成文件清单(路径，大小，修改时间，md5)，持久化为缓存元数据目录下的sqlite文件，
+文件对比/目录浏览直接读取清单，无需重复遍历目录及计算md5
+
+目录的md5为Merkle哈希(由子项名称、类型及哈希计算)，目录哈希一致即整个子树内容一致
+
+"""
+import collections
+import hashlib
+import logging
+import os
+import os.path
+import posixpath
+import sqlite3
+import stat
+import uuid
+
+from artifacts_corepy.common import hashing
+from artifacts_corepy.common import package_cache
+
+LOG = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.db'
+MANIFEST_CACHE_SIZE = 32
+
+ManifestEntry = collections.namedtuple('ManifestEntry', 'path, is_dir, size, mtime, md5')
+
+_manifests = collections.OrderedDict()
+
+
+def merkle_hash(children):
+    '''
+    children为[(name, is_dir, hash)]，任一子项哈希未知时返回None
+    '''
+    hasher = hashlib.md5()
+    for name, is_dir, child_hash in sorted(children):
+        if child_hash is None:
+            return None
+        line = '%s\0%s\0%s\n' % ('d' if is_dir else 'f', name, child_hash)
+        hasher.update(line.encode('utf-8', 'surrogateescape'))
+    return hasher.hexdigest()
+
+
+def normalize_path(path):
+    '''
+    转换为相对于物料包根目录的路径，根目录为''，不允许越过根目录
+    '''
+    return posixpath.normpath('/' + (path or '')).lstrip('/')
+
+
+def _decode_path(path):
+    # 旧版本清单以文本保存路径
+    if isinstance(path, str):
+        return path
+    return bytes(path).decode('utf-8', 'surrogateescape')
+
+
+class PackageManifest(object):
+    def __init__(self, entries):
+        self._entries = {'': ManifestEntry('', True, 0, 0, None)}
+        self._children = collections.defaultdict(list)
+        for entry in entries:
+            self._entries[entry.path] = entry
+        for path in sorted(self._entries):
+            if path:
+                self._children[posixpath.dirname(path)].append(path)
+        # 自底向上补全目录Merkle哈希，根目录最后计算
+        dirs = [p for p, e in self._entries.items() if e.is_dir and e.md5 is None]
+        dirs.sort(key=lambda p: (p == '', -p.count('/')))
+        for path in dirs:
+            children = [(posixpath.basename(c), self._entries[c].is_dir, self._entries[c].md5)
+                        for c in self._children.get(path, [])]
+            self._entries[path] = self._entries[path]._replace(md5=merkle_hash(children))
+
+    def __len__(self):
+        return len(self._entries) - 1
+
+    @property
+    def total_size(self):
+        return sum([e.size for e in self._entries.values() if not e.is_dir])
+
+    def get(self, path):
+        return self._entries.get(normalize_path(path), None)
+
+    def exists(self, path):
+        return self.get(path) is not None
+
+    def isdir(self, path):
+        entry = self.get(path)
+        return entry is not None and entry.is_dir
+
+    def listdir(self, path):
+        return [self._entries[p] for p in self._children.get(normalize_path(path), [])]
+
+    def walk(self, path):
+        '''
+        返回目录下所有子孙条目(不包含目录本身)
+        '''
+        results = []
+        stack = [normalize_path(path)]
+        while stack:
+            for child in self._children.get(stack.pop(), []):
+                results.append(self._entries[child])
+                if self._entries[child].is_dir:
+                    stack.append(child)
+        results.sort(key=lambda x: x.path)
+        return results
+
+    @classmethod
+    def build(cls, root_path):
+        entries = []
+        filepaths = []
+        for _root, _dirs, _files in os.walk(root_path):
+            rel_root = os.path.relpath(_root, root_path)
+            rel_root = '' if rel_root == '.' else rel_root.replace(os.sep, '/')
+            for name in _dirs + _files:
+                fullpath = os.path.join(_root, name)
+                try:
+                    path_stat = os.stat(fullpath)
+                except OSError:
+                    # 无效的符号链接视为不存在
+                    continue
+                is_dir = stat.S_ISDIR(path_stat.st_mode)
+                entries.append(
+                    ManifestEntry(posixpath.join(rel_root, name), is_dir, 0 if is_dir else path_stat.st_size,
+                                  path_stat.st_mtime, None))
+                filepaths.append(None if is_dir else fullpath)
+        # 文件md5在线程池中并发计算
+        hashes = dict(zip([p for p in filepaths if p], hashing.run_many(hashing.md5_file, [p for p in filepaths if p])))
+        return cls([e._replace(md5=hashes.get(p, None)) for e, p in zip(entries, filepaths)])
+
+    @classmethod
+    def load(cls, db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            rows = conn.execute('SELECT path, is_dir, size, mtime, md5 FROM files').fetchall()
+        finally:
+            conn.close()
+        return cls([ManifestEntry(_decode_path(r[0]), bool(r[1]), r[2], r[3], r[4]) for r in rows])
+
+    def save(self, db_path):
+        # 写入临时文件后替换，读取方不会读到不完整的清单
+        tmp_path = '%s.%s.tmp' % (db_path, uuid.uuid4().hex)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            # 路径以字节保存，兼容非utf-8文件名
+            conn.execute('CREATE TABLE files (path BLOB PRIMARY KEY, is_dir INTEGER, size INTEGER, '
+                         'mtime REAL, md5 TEXT)')
+            conn.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?)',
+                             [(e.path.encode('utf-8', 'surrogateescape'), int(e.is_dir), e.size, e.mtime, e.md5)
+                              for e in self._entries.values() if e.path])
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, db_path)
+
+
+def _get_manifest_file(cached_dir):
+    return os.path.join(package_cache.get_meta_path(cached_dir), MANIFEST_FILE)
+
+
+def _remember(db_path, mtime, manifest):
+    _manifests[db_path] = (mtime, manifest)
+    _manifests.move_to_end(db_path)
+    while len(_manifests) > MANIFEST_CACHE_SIZE:
+        _manifests.popitem(last=False)
+
+
+def create_manifest(cached_dir):
+    '''
+    遍历解压目录生成文件清单并持久化
+    '''
+    LOG.info('build manifest for: %s', cached_dir)
+    manifest = PackageManifest.build(cached_dir)
+    db_path = _get_manifest_file(cached_dir)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    manifest.save(db_path)
+    _remember(db_path, os.stat(db_path).st_mtime, manifest)
+    LOG.info('build manifest complete, %s files', len(manifest))
+    return manifest
+
+
+def get_manifest(cached_dir):
+    '''
+    获取缓存目录的文件清单，缺失(旧版本缓存)时自动生成
+    '''
+    db_path = _get_manifest_file(cached_dir)
+    try:
+        mtime = os.stat(db_path).st_mtime
+    except OSError:
+        return create_manifest(cached_dir)
+    cached = _manifests.get(db_path, None)
+    if cached is not None and cached[0] == mtime:
+        _manifests.move_to_end(db_path)
+        return cached[1]
+    manifest = PackageManifest.load(db_path)
+    _remember(db_path, mtime, manifest)
+    return manifest
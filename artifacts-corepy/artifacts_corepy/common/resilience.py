@@ -0,0 +1,244 @@
+# coding=utf-8
+"""
+artifacts_corepy.common.resilience
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+本模块提供上游服务(CMDB，Nexus，S3，平台)调用的超时、重试及熔断
+
+超时、重试次数、熔断阈值按上游配置(resilience.<upstream>.xxx，未配置时使用resilience.default.xxx)，
+大文件传输使用单独的读取超时(transfer_read_timeout)；
+仅幂等调用在连接错误、超时及502/503/504时按指数退避(随机抖动)重试；
+熔断状态按(上游, 主机)记录在进程内，连续失败达到阈值后快速失败，冷却后放行一次试探请求
+
+"""
+import collections
+import contextlib
+import logging
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+from talos.core import config
+from talos.core import utils
+
+LOG = logging.getLogger(__name__)
+CONF = config.CONF
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+RETRY_STATUS = (502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+DEFAULTS = {
+    'retries': 2,
+    'backoff_base': 0.2,
+    'backoff_max': 2.0,
+    'failure_threshold': 5,
+    'reset_timeout': 30,
+}
+
+
+class CircuitOpenError(requests.ConnectionError):
+    def __init__(self, name):
+        super(CircuitOpenError, self).__init__('upstream %s is unavailable (circuit open)' % name)
+        self.name = name
+
+
+def get_config(upstream, name, default=None):
+    value = utils.get_config(CONF, 'resilience.%s.%s' % (upstream, name), None)
+    if value is None:
+        value = utils.get_config(CONF, 'resilience.default.%s' % name, None)
+    if value is None:
+        value = DEFAULTS.get(name, default) if default is None else default
+    return value
+
+
+def get_timeout(upstream, default):
+    '''
+    上游的(连接超时, 读取超时)，未配置时使用default，<=0表示不限制
+    '''
+    connect_timeout = float(get_config(upstream, 'connect_timeout', default[0] or 0) or 0)
+    read_timeout = float(get_config(upstream, 'read_timeout', default[1] or 0) or 0)
+    return (connect_timeout if connect_timeout > 0 else None, read_timeout if read_timeout > 0 else None)
+
+
+def get_transfer_timeout(upstream, default):
+    '''
+    物料包等大文件传输的(连接超时, 读取超时)，读取超时使用transfer_read_timeout，未配置时同get_timeout
+    '''
+    connect_timeout, read_timeout = get_timeout(upstream, default)
+    transfer_read_timeout = float(get_config(upstream, 'transfer_read_timeout', 0) or 0)
+    if transfer_read_timeout > 0:
+        read_timeout = transfer_read_timeout
+    return (connect_timeout, read_timeout)
+
+
+def get_backoff(upstream, attempt):
+    base = float(get_config(upstream, 'backoff_base'))
+    max_backoff = float(get_config(upstream, 'backoff_max'))
+    # full jitter：避免多个worker同时重试
+    return random.uniform(0, min(max_backoff, base * (2**(attempt - 1))))
+
+
+class CircuitBreaker(object):
+    def __init__(self, upstream, target):
+        self.upstream = upstream
+        self.name = '%s:%s' % (upstream, target)
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if self.state != state:
+            LOG.warning('circuit breaker %s: %s -> %s', self.name, self.state, state)
+            self.state = state
+            self.stats['state_changes'] += 1
+
+    def acquire(self):
+        '''
+        申请调用，熔断时抛出CircuitOpenError
+        '''
+        with self._lock:
+            if self.state == OPEN:
+                if time.time() - self.opened_at >= float(get_config(self.upstream, 'reset_timeout')):
+                    self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                # 半开状态仅放行一个试探请求
+                if self.trial_running:
+                    self.stats['rejected'] += 1
+                    raise CircuitOpenError(self.name)
+                self.trial_running = True
+            elif self.state == OPEN:
+                self.stats['rejected'] += 1
+                raise CircuitOpenError(self.name)
+            self.stats['calls'] += 1
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.trial_running = False
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.stats['failures'] += 1
+            self.trial_running = False
+            if self.state == HALF_OPEN or self.failures >= int(get_config(self.upstream, 'failure_threshold')):
+                self.opened_at = time.time()
+                self._set_state(OPEN)
+
+    def record_retry(self):
+        with self._lock:
+            self.stats['retries'] += 1
+
+    def release(self):
+        '''
+        调用结束但无法判断上游是否可用(如参数错误)
+        '''
+        with self._lock:
+            self.trial_running = False
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'opened_at': self.opened_at,
+                'calls': self.stats['calls'],
+                'failures': self.stats['failures'],
+                'retries': self.stats['retries'],
+                'rejected': self.stats['rejected'],
+                'state_changes': self.stats['state_changes'],
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(upstream, target):
+    with _breakers_lock:
+        breaker = _breakers.get((upstream, target), None)
+        if breaker is None:
+            breaker = CircuitBreaker(upstream, target)
+            _breakers[(upstream, target)] = breaker
+        return breaker
+
+
+def get_breaker_for_url(upstream, url):
+    return get_breaker(upstream, urllib.parse.urlsplit(url).netloc)
+
+
+def get_stats():
+    '''
+    当前进程内各上游熔断器的状态及计数
+    '''
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return sorted([b.snapshot() for b in breakers], key=lambda x: x['name'])
+
+
+@contextlib.contextmanager
+def guard(breaker, failure_types):
+    '''
+    由熔断器保护一次调用，failure_types类型的异常计为上游失败
+    '''
+    breaker.acquire()
+    try:
+        yield
+    except failure_types:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    else:
+        breaker.record_success()
+
+
+def request(upstream, send, url, method, idempotent=None):
+    '''
+    执行HTTP调用，send()发起一次请求并返回requests.Response；幂等调用在连接错误、超时及502/503/504时重试
+    '''
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+    retries = int(get_config(upstream, 'retries')) if idempotent else 0
+    breaker = get_breaker_for_url(upstream, url)
+    attempt = 0
+    while True:
+        resp = None
+        error = None
+        breaker.acquire()
+        try:
+            resp = send()
+        except (requests.ConnectionError, requests.Timeout) as e:
+            breaker.record_failure()
+            error = e
+        except BaseException:
+            breaker.release()
+            raise
+        else:
+            if resp.status_code in RETRY_STATUS:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+                return resp
+        if attempt >= retries:
+            if error is not None:
+                raise error
+            return resp
+        if resp is not None:
+            resp.close()
+        attempt += 1
+        breaker.record_retry()
+        delay = get_backoff(upstream, attempt)
+        LOG.warning('%s %s failed: %s, retry %s/%s after %.2fs', method, url,
+                    str(error) if error is not None else resp.status_code, attempt, retries, delay)
+        time.sleep(delay)
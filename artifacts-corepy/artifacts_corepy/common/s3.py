@@ -10,6 +10,7 @@ import certifi
 
 import minio
 from artifacts_corepy.common import exceptions
+from artifacts_corepy.common import resilience
 from talos.core.i18n import _
 
 LOG = logging.getLogger(__name__)
@@ -34,16 +35,21 @@ class S3Downloader(object):
     def download_file(self, filepath, access_key, secret_key):
         secure = True if self.schema == 'https' else False
         ca_certs = os.environ.get('SSL_CERT_FILE') or certifi.where()
-        http_client = urllib3.PoolManager(timeout=3,
+        # 物料包下载耗时较长，使用传输超时而不是元数据调用的超时
+        connect_timeout, read_timeout = resilience.get_transfer_timeout('s3', (3, 600))
+        http_client = urllib3.PoolManager(timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout),
                                           maxsize=10,
                                           cert_reqs='CERT_REQUIRED',
                                           ca_certs=ca_certs,
-                                          retries=urllib3.Retry(total=1,
-                                                                backoff_factor=0.2,
+                                          retries=urllib3.Retry(total=int(resilience.get_config('s3', 'retries')),
+                                                                backoff_factor=float(
+                                                                    resilience.get_config('s3', 'backoff_base')),
                                                                 status_forcelist=[500, 502, 503, 504]))
         client = minio.Minio(self.host, access_key, secret_key, secure=secure, http_client=http_client)
         try:
-            return client.fget_object(self.bucket, self.object_key, filepath)
+            # 仅连接/超时等网络错误计为上游失败，对象不存在等业务错误不触发熔断
+            with resilience.guard(resilience.get_breaker('s3', self.host), urllib3.exceptions.HTTPError):
+                return client.fget_object(self.bucket, self.object_key, filepath)
         except Exception as e:
             raise exceptions.PluginError(message=_('failed to download file[%(filepath)s] from s3: %(reason)s') % {
                 'filepath': self.object_key,
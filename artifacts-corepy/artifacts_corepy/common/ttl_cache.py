@@ -0,0 +1,231 @@
+# coding=utf-8
+"""
+artifacts_corepy.common.ttl_cache
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+本模块提供CMDB元数据(CI类型，属性，引用，枚举，状态转换等)、统计数据及Nexus资产列表的过期缓存
+
+两级缓存：进程内LRU + 可选的磁盘缓存(同一主机的gunicorn worker共享)，
+按命名空间配置过期时间；清除缓存(整个命名空间或单个key)时写入清除标记，其他worker据此丢弃内存中的旧数据；
+命名空间配置了stale_ttl时，过期后的一段时间内先返回旧数据，同时在后台刷新
+
+"""
+import collections
+import copy
+import hashlib
+import json
+import logging
+import os
+import os.path
+import shutil
+import threading
+import time
+import uuid
+
+from talos.core import config
+from talos.core import utils
+from talos.core.i18n import _
+
+from artifacts_corepy.common import exceptions
+from artifacts_corepy.common import package_cache
+from artifacts_corepy.common import utils as artifact_utils
+
+LOG = logging.getLogger(__name__)
+CONF = config.CONF
+
+NAMESPACES = ('citypes', 'citype_refs', 'citype_attrs', 'enumcodes', 'ci_operations', 'unit_design_artifact_path',
+              'package_statistics', 'nexus_listing')
+PURGED_SUFFIX = '.purged'
+DEFAULT_TTL = 600
+DEFAULT_MAX_ENTRIES = 1024
+
+
+def get_ttl(namespace):
+    return int(utils.get_config(CONF, 'metadata_cache.ttl.%s' % namespace, DEFAULT_TTL) or 0)
+
+
+def get_stale_ttl(namespace):
+    return int(utils.get_config(CONF, 'metadata_cache.stale_ttl.%s' % namespace, 0) or 0)
+
+
+def get_disk_path():
+    if not utils.get_config(CONF, 'metadata_cache.disk_enabled', True):
+        return None
+    return os.path.join(package_cache.get_cache_dir(), package_cache.CMDB_CACHE_DIR)
+
+
+class TTLCache(object):
+    def __init__(self):
+        self._entries = collections.OrderedDict()
+        self._refreshing = set()
+        # 本进程内的清除时间，未启用磁盘缓存时也能使后台刷新中的旧数据失效
+        self._purged = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_file(disk_path, namespace, key, suffix='.json'):
+        return os.path.join(disk_path, namespace, hashlib.sha1(key.encode()).hexdigest() + suffix)
+
+    @staticmethod
+    def _get_mtime(filepath):
+        try:
+            return os.stat(filepath).st_mtime
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _touch(filepath):
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'w'):
+            pass
+        now = time.time()
+        os.utime(filepath, (now, now))
+
+    def _get_purged_time(self, disk_path, namespace, key):
+        purged_time = max(self._purged.get(namespace, 0), self._purged.get((namespace, key), 0))
+        if disk_path is None:
+            return purged_time
+        return max(purged_time,
+                   self._get_mtime(os.path.join(disk_path, namespace + PURGED_SUFFIX)),
+                   self._get_mtime(self._get_file(disk_path, namespace, key, PURGED_SUFFIX)))
+
+    @staticmethod
+    def _is_usable(item, purged_time, stale_ttl):
+        return item[0] >= purged_time and item[1] + stale_ttl >= time.time()
+
+    def _get_memory(self, namespace, key, purged_time, stale_ttl=0):
+        with self._lock:
+            item = self._entries.get((namespace, key), None)
+            if item is None:
+                return None
+            if not self._is_usable(item, purged_time, stale_ttl):
+                self._entries.pop((namespace, key), None)
+                return None
+            self._entries.move_to_end((namespace, key))
+            return item
+
+    def _set_memory(self, namespace, key, item):
+        max_entries = int(utils.get_config(CONF, 'metadata_cache.max_entries', DEFAULT_MAX_ENTRIES) or 0)
+        with self._lock:
+            self._entries[(namespace, key)] = item
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_disk(self, disk_path, namespace, key, purged_time, stale_ttl=0):
+        try:
+            with open(self._get_file(disk_path, namespace, key)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('key', None) != key:
+            return None
+        item = (data['created_at'], data['expires_at'], data['value'])
+        if not self._is_usable(item, purged_time, stale_ttl):
+            return None
+        return item
+
+    def _set_disk(self, disk_path, namespace, key, item):
+        filepath = self._get_file(disk_path, namespace, key)
+        try:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            # 写入临时文件后替换，其他worker不会读到不完整的数据
+            tmp_path = '%s.%s.tmp' % (filepath, uuid.uuid4().hex)
+            with open(tmp_path, 'w') as f:
+                json.dump({'key': key, 'created_at': item[0], 'expires_at': item[1], 'value': item[2]}, f)
+            os.replace(tmp_path, filepath)
+        except (OSError, TypeError, ValueError) as e:
+            LOG.warning('write metadata cache: %s error: %s', filepath, str(e))
+
+    def _load(self, namespace, key, loader, ttl, disk_path):
+        # 以加载开始时间作为创建时间，加载期间发生的清除使结果失效
+        now = time.time()
+        item = (now, now + ttl, loader())
+        self._set_memory(namespace, key, item)
+        if disk_path is not None:
+            self._set_disk(disk_path, namespace, key, item)
+        return item
+
+    def _refresh(self, namespace, key, loader, ttl, disk_path):
+        try:
+            self._load(namespace, key, loader, ttl, disk_path)
+        except Exception as e:
+            LOG.warning('refresh cache: %s error: %s', namespace, str(e))
+        finally:
+            with self._lock:
+                self._refreshing.discard((namespace, key))
+
+    def _refresh_in_background(self, namespace, key, loader, ttl, disk_path):
+        with self._lock:
+            # 同一key仅有一个后台刷新
+            if (namespace, key) in self._refreshing:
+                return
+            self._refreshing.add((namespace, key))
+        artifact_utils.BackgroundTask(self._refresh, namespace, key, loader, ttl, disk_path)
+
+    def get_or_load(self, namespace, key, loader, ttl=None, stale_ttl=None):
+        '''
+        获取缓存数据，未命中时调用loader加载；返回数据的副本，调用方可任意修改
+
+        过期不超过stale_ttl(默认按命名空间配置)的数据直接返回，同时在后台调用loader刷新
+        '''
+        ttl = get_ttl(namespace) if ttl is None else ttl
+        if ttl <= 0:
+            return loader()
+        stale_ttl = get_stale_ttl(namespace) if stale_ttl is None else stale_ttl
+        key = json.dumps(key, sort_keys=True)
+        disk_path = get_disk_path()
+        purged_time = self._get_purged_time(disk_path, namespace, key)
+        item = self._get_memory(namespace, key, purged_time, stale_ttl)
+        if item is None and disk_path is not None:
+            item = self._get_disk(disk_path, namespace, key, purged_time, stale_ttl)
+            if item is not None:
+                self._set_memory(namespace, key, item)
+        if item is None:
+            item = self._load(namespace, key, loader, ttl, disk_path)
+        elif item[1] < time.time():
+            self._refresh_in_background(namespace, key, loader, ttl, disk_path)
+        return copy.deepcopy(item[2])
+
+    def invalidate(self, namespace, key):
+        '''
+        清除单个key的缓存
+        '''
+        key = json.dumps(key, sort_keys=True)
+        with self._lock:
+            self._entries.pop((namespace, key), None)
+            self._purged[(namespace, key)] = time.time()
+        disk_path = get_disk_path()
+        if disk_path is not None:
+            try:
+                self._touch(self._get_file(disk_path, namespace, key, PURGED_SUFFIX))
+                os.remove(self._get_file(disk_path, namespace, key))
+            except OSError:
+                pass
+
+    def purge(self, namespace=None):
+        '''
+        清除指定命名空间(默认全部)的缓存，返回清除的命名空间列表
+        '''
+        if namespace is not None and namespace not in NAMESPACES:
+            raise exceptions.ValidationError(message=_('invalid cache namespace: %(namespace)s, expected: %(expected)s') %
+                                             {'namespace': namespace, 'expected': ','.join(NAMESPACES)})
+        namespaces = set(NAMESPACES) if namespace is None else set([namespace])
+        with self._lock:
+            for key in [k for k in self._entries if k[0] in namespaces]:
+                self._entries.pop(key, None)
+            now = time.time()
+            for name in namespaces:
+                self._purged[name] = now
+        disk_path = get_disk_path()
+        if disk_path is not None:
+            os.makedirs(disk_path, exist_ok=True)
+            for name in namespaces:
+                # 清除标记的修改时间晚于缓存数据的创建时间即视为失效
+                self._touch(os.path.join(disk_path, name + PURGED_SUFFIX))
+                shutil.rmtree(os.path.join(disk_path, name), ignore_errors=True)
+        LOG.info('purge metadata cache: %s', ','.join(sorted(namespaces)))
+        return sorted(namespaces)
+
+
+CACHE = TTLCache()
@@ -8,16 +8,21 @@ artifacts_corepy.common.config_variable
 """
 import base64
 import binascii
+import concurrent.futures
 import contextlib
 import functools
+import http.cookiejar
 import io
 import logging
+import os
 import os.path
 import re
 import shutil
 import tempfile
+import threading
 import time
 import requests
+import requests.adapters
 
 from talos.core import utils
 from talos.core import config
@@ -26,6 +31,7 @@ from talos.utils import scoped_globals
 from talos.core.i18n import _
 
 from artifacts_corepy.common import exceptions
+from artifacts_corepy.common import resilience
 
 try:
     HAS_FCNTL = True
@@ -33,6 +39,12 @@ try:
 except:
     HAS_FCNTL = False
 
+try:
+    HAS_GEVENT = True
+    from gevent import monkey
+except:
+    HAS_GEVENT = False
+
 LOG = logging.getLogger(__name__)
 CONF = config.CONF
 
@@ -68,6 +80,35 @@ def unpack_file(filename, unpack_dest):
     shutil.unpack_archive(filename, unpack_dest)
 
 
+def is_gevent_patched():
+    return HAS_GEVENT and monkey.is_module_patched('threading')
+
+
+FLOCK_BACKOFF_MIN = 0.005
+FLOCK_BACKOFF_MAX = 0.2
+
+
+def _flock_wait(fp, timeout):
+    '''
+    轮询等待文件锁直到超时：非阻塞尝试 + 指数退避休眠(gevent worker中为greenlet休眠，不占用hub线程池)，
+    按单调时钟计算截止时间；不使用阻塞的flock，超时后无法取消线程池中阻塞的系统调用；
+    进程内的等待者已由single-flight合并(不轮询)，仅各进程的一个调用方在此轮询
+    '''
+    deadline = time.monotonic() + timeout
+    backoff = FLOCK_BACKOFF_MIN
+    while True:
+        try:
+            fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except (BlockingIOError, PermissionError):
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(backoff, remaining))
+        backoff = min(backoff * 2, FLOCK_BACKOFF_MAX)
+
+
 @contextlib.contextmanager
 def lock(name, block=True, timeout=5):
     timeout = 1.0 * timeout
@@ -86,17 +127,12 @@ def lock(name, block=True, timeout=5):
                     pass
                 yield acquired
             else:
-                # block will try until timeout
-                time_pass = 0
-                while time_pass < timeout:
-                    try:
-                        fcntl.flock(fp, flag)
-                        acquired = True
-                        break
-                    except:
-                        gap = 0.1
-                        time.sleep(gap)
-                        time_pass += gap
+                # poll(LOCK_NB + backoff) until acquired or timeout
+                try:
+                    fcntl.flock(fp, flag)
+                    acquired = True
+                except:
+                    acquired = _flock_wait(fp, timeout)
                 yield acquired
         finally:
             if acquired:
@@ -106,6 +142,87 @@ def lock(name, block=True, timeout=5):
         yield False
 
 
+def map_concurrently(func, items, max_workers=8):
+    '''
+    并发执行IO密集型任务(gevent worker中使用greenlet，否则使用线程)，按输入顺序返回结果，任一任务异常时抛出
+    '''
+    items = list(items)
+    if len(items) <= 1:
+        return [func(i) for i in items]
+    max_workers = max(1, min(max_workers, len(items)))
+    if is_gevent_patched():
+        from gevent.pool import Pool
+        return list(Pool(max_workers).imap(func, items))
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        return list(executor.map(func, items))
+
+
+class BackgroundTask(object):
+    '''
+    后台执行IO任务(gevent worker中threading已被patch，实际为greenlet)，result()等待并返回结果或抛出异常
+    '''
+
+    def __init__(self, func, *args, **kwargs):
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, args=(func, args, kwargs), daemon=True)
+        self._thread.start()
+
+    def _run(self, func, args, kwargs):
+        try:
+            self._result = func(*args, **kwargs)
+        except Exception as e:
+            self._error = e
+
+    def result(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class _Flight(object):
+    def __init__(self):
+        # gevent worker中threading.Event已被patch为gevent Event，等待方不占用worker
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    '''
+    相同key的并发调用合并为一次执行，其余调用方阻塞等待并获得相同结果或异常
+    '''
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, timeout=None):
+        with self._lock:
+            flight = self._flights.get(key, None)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise OSError(_('timeout waiting for %(key)s') % {'key': key})
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = func()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+
 class CaseInsensitiveDict(dict):
     @classmethod
     def _k(cls, key):
@@ -155,6 +272,10 @@ def json_or_error(func):
         try:
             try:
                 return func(url, **kwargs)
+            except resilience.CircuitOpenError as e:
+                LOG.error('http error: %s %s, reason: %s', func.__name__.upper(), url, str(e))
+                raise exceptions.UpstreamUnavailableError(
+                    message=_('upstream service: %(name)s is unavailable, please retry later') % {'name': e.name})
             except requests.ConnectionError as e:
                 LOG.error('http error: %s %s, reason: %s', func.__name__.upper(), url, str(e))
                 raise base_ex.CallBackError(message={
@@ -207,6 +328,54 @@ def json_or_error(func):
     return _json_or_error
 
 
+_http_session = None
+_http_session_pid = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    '''
+    进程内共享的HTTP会话，复用keep-alive连接池；gunicorn fork出的worker首次使用时各自创建
+    '''
+    global _http_session, _http_session_pid
+    with _http_session_lock:
+        if _http_session is None or _http_session_pid != os.getpid():
+            pool_connections = int(utils.get_config(CONF, 'http_client.pool_connections', 16) or 16)
+            pool_maxsize = int(utils.get_config(CONF, 'http_client.pool_maxsize', 64) or 64)
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            # 会话在不同用户的请求间共享，不保存cookie
+            session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            _http_session = session
+            _http_session_pid = os.getpid()
+        return _http_session
+
+
+def get_http_timeout():
+    '''
+    默认(连接超时, 读取超时)，单位秒，<=0表示不限制
+    '''
+    connect_timeout = float(utils.get_config(CONF, 'http_client.connect_timeout', 10) or 0)
+    read_timeout = float(utils.get_config(CONF, 'http_client.read_timeout', 600) or 0)
+    return (connect_timeout if connect_timeout > 0 else None, read_timeout if read_timeout > 0 else None)
+
+
+def http_request(method, url, upstream=None, idempotent=None, **kwargs):
+    '''
+    upstream为上游名称(cmdb/nexus/platform等)，指定时按上游配置超时、重试及熔断；
+    idempotent指定调用是否可重试，默认仅GET/HEAD/OPTIONS可重试
+    '''
+    session = get_http_session()
+    if upstream is None:
+        kwargs.setdefault('timeout', get_http_timeout())
+        return session.request(method, url, **kwargs)
+    kwargs.setdefault('timeout', resilience.get_timeout(upstream, get_http_timeout()))
+    return resilience.request(upstream, lambda: session.request(method, url, **kwargs), url, method,
+                              idempotent=idempotent)
+
+
 class RestfulJson(object):
     @staticmethod
     def get_response_json(resp, default=None):
@@ -218,35 +387,49 @@ class RestfulJson(object):
     @staticmethod
     @json_or_error
     def post(url, **kwargs):
-        resp = requests.post(url, **kwargs)
+        resp = http_request('POST', url, **kwargs)
         resp.raise_for_status()
         return RestfulJson.get_response_json(resp)
 
+    @staticmethod
+    @json_or_error
+    def post_stream(url, **kwargs):
+        '''
+        返回未读取内容的响应对象，调用方负责关闭
+        '''
+        resp = http_request('POST', url, stream=True, **kwargs)
+        if not resp.ok:
+            # 读取错误信息并释放连接
+            resp.content
+            resp.raise_for_status()
+        resp.raw.decode_content = True
+        return resp
+
     @staticmethod
     @json_or_error
     def get(url, **kwargs):
-        resp = requests.get(url, **kwargs)
+        resp = http_request('GET', url, **kwargs)
         resp.raise_for_status()
         return RestfulJson.get_response_json(resp)
 
     @staticmethod
     @json_or_error
     def patch(url, **kwargs):
-        resp = requests.patch(url, **kwargs)
+        resp = http_request('PATCH', url, **kwargs)
         resp.raise_for_status()
         return RestfulJson.get_response_json(resp)
 
     @staticmethod
     @json_or_error
     def delete(url, **kwargs):
-        resp = requests.delete(url, **kwargs)
+        resp = http_request('DELETE', url, **kwargs)
         resp.raise_for_status()
         return RestfulJson.get_response_json(resp)
 
     @staticmethod
     @json_or_error
     def put(url, **kwargs):
-        resp = requests.put(url, **kwargs)
+        resp = http_request('PUT', url, **kwargs)
         resp.raise_for_status()
         return RestfulJson.get_response_json(resp)
 
@@ -270,6 +453,8 @@ def get_token():
 
 class ClientMixin:
     # mixin need self.token & self.server
+    upstream = 'platform'
+
     def build_headers(self):
         headers = None
         if self.token:
@@ -290,7 +475,7 @@ class ClientMixin:
     def get(self, url, param=None):
         LOG.info('GET %s', url)
         LOG.debug('Request: query - %s, data - None', str(param))
-        resp_json = RestfulJson.get(url, headers=self.build_headers(), params=param)
+        resp_json = RestfulJson.get(url, headers=self.build_headers(), params=param, upstream=self.upstream)
         LOG.debug('Response: %s', str(resp_json))
         self.check_response(resp_json)
         return resp_json
@@ -298,7 +483,8 @@ class ClientMixin:
     def post(self, url, data, param=None):
         LOG.info('POST %s', url)
         LOG.debug('Request: query - %s, data - %s', str(param), str(data))
-        resp_json = RestfulJson.post(url, headers=self.build_headers(), params=param, json=data)
+        resp_json = RestfulJson.post(url, headers=self.build_headers(), params=param, json=data,
+                                     upstream=self.upstream)
         LOG.debug('Response: %s', str(resp_json))
         self.check_response(resp_json)
         return resp_json
@@ -77,7 +77,7 @@ class WeCMDBClient(object):
     def get(self, url, param=None):
         LOG.info('GET %s', url)
         LOG.debug('Request: query - %s, data - None', str(param))
-        resp_json = utils.RestfulJson.get(url, headers=self.build_headers(), params=param)
+        resp_json = utils.RestfulJson.get(url, headers=self.build_headers(), params=param, upstream='cmdb')
         LOG.debug('Response: %s', str(resp_json))
         self.check_response(resp_json)
         return resp_json
@@ -85,7 +85,7 @@ class WeCMDBClient(object):
     def post(self, url, data, param=None):
         LOG.info('POST %s', url)
         LOG.debug('Request: query - %s, data - %s', str(param), str(data))
-        resp_json = utils.RestfulJson.post(url, headers=self.build_headers(), params=param, json=data)
+        resp_json = utils.RestfulJson.post(url, headers=self.build_headers(), params=param, json=data, upstream='cmdb')
         LOG.debug('Response: %s', str(resp_json))
         self.check_response(resp_json)
         return resp_json
@@ -5,19 +5,191 @@ artifacts_corepy.common.wecmdb
 
 本模块提供项目WeCMDB Client
 
+同一请求内按guid查询CI的结果缓存在请求对象上(identity map)，对应CI类型的增删改操作后失效；
+gevent worker中短时间窗口内并发的按guid查询合并为一次in查询；
+查询可通过resultColumns仅返回需要的字段，不支持该参数的CMDB版本自动回退为查询全部字段；
+大结果集可通过iterate分页遍历(安装ijson时逐条解析响应)，内存占用与单页大小相关
+
 """
+import collections
+import copy
+import json
 import logging
+import threading
+import time
 
 from artifacts_corepy.common import exceptions
 from talos.core import config
+from talos.core import utils as talos_utils
 from talos.core.i18n import _
+from talos.utils import scoped_globals
+from artifacts_corepy.common import ttl_cache
 from artifacts_corepy.common import utils
 
+try:
+    HAS_IJSON = True
+    import ijson
+except:
+    HAS_IJSON = False
+
 LOG = logging.getLogger(__name__)
 CONF = config.CONF
 
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_MAX_PAGES = 1000
+DEFAULT_PROJECTION_RETRY = 3600
+# 无法确认是否因resultColumns导致的错误，短时间内不再发送
+AMBIGUOUS_PROJECTION_RETRY = 60
 URL_PREFIX = '/wecmdb/api/v1'
 
+# 不支持resultColumns的CMDB server -> 重新尝试发送resultColumns的时间
+_projection_unsupported = {}
+
+
+def _get_request_cache():
+    request = talos_utils.get_attr(scoped_globals.GLOBALS, 'request')
+    if request is None:
+        return None
+    cache = getattr(request, 'cmdb_identity_map', None)
+    if cache is None:
+        cache = {}
+        request.cmdb_identity_map = cache
+    return cache
+
+
+def _is_guid_query(query):
+    for f in (query or {}).get('filters', None) or []:
+        if f.get('name', None) == 'guid' and f.get('operator', None) == 'eq':
+            return True
+    return False
+
+
+def _strip_columns(query):
+    query = dict(query)
+    query.pop('resultColumns', None)
+    return query
+
+
+def set_result_columns(query, columns):
+    '''
+    设置查询返回的字段(已指定时不覆盖)，guid始终返回
+    '''
+    if columns:
+        query.setdefault('resultColumns', list(dict.fromkeys(['guid'] + [c for c in columns if c])))
+    return query
+
+
+def _get_single_guid(query):
+    '''
+    仅按单个guid等值过滤的查询返回guid，否则返回None
+    '''
+    filters = (query or {}).get('filters', None) or []
+    if len(filters) == 1 and filters[0].get('name', None) == 'guid' and filters[0].get('operator', None) == 'eq':
+        if isinstance(filters[0].get('value', None), str):
+            return filters[0]['value']
+    return None
+
+
+def _build_in_query(query, guids):
+    new_query = dict(query)
+    new_query['filters'] = [{"name": "guid", "operator": "in", "value": list(guids)}]
+    return new_query
+
+
+def _split_by_guid(resp_json, guids):
+    '''
+    将in查询结果按guid拆分为各自的等值查询结果
+    '''
+    contents = (resp_json.get('data', None) or {}).get('contents', None) or []
+    results = {}
+    for guid in guids:
+        data = dict(resp_json.get('data', None) or {})
+        data['contents'] = [c for c in contents if c.get('guid', None) == guid]
+        results[guid] = dict(resp_json, data=data)
+    return results
+
+
+class _GuidBatch(object):
+    def __init__(self):
+        self.guids = []
+        self.event = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class GuidBatchLoader(object):
+    '''
+    合并并发的同一CI类型(及相同查询条件)guid查询：没有其他查询进行中时立即发起，
+    否则由首个请求方在时间窗口结束后发起一次in查询，结果按guid分发给各请求方
+    '''
+    def __init__(self):
+        self._batches = {}
+        self._inflight = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _finish(self, key, batch):
+        with self._lock:
+            if self._batches.get(key, None) is batch:
+                self._batches.pop(key, None)
+            self._inflight[key] -= 1
+            if self._inflight[key] <= 0:
+                del self._inflight[key]
+        batch.event.set()
+
+    def _dispatch(self, client, citype, query, batch):
+        if len(batch.guids) == 1:
+            return {batch.guids[0]: client.retrieve_direct(citype, query)}
+        LOG.debug('batch %s guid queries of %s', len(batch.guids), citype)
+        return _split_by_guid(client.retrieve_direct(citype, _build_in_query(query, batch.guids)), batch.guids)
+
+    def load(self, client, citype, query, guid, window, max_size, wait_timeout):
+        batch_query = dict(query)
+        batch_query.pop('filters', None)
+        key = (citype, client.server, client.token, json.dumps(batch_query, sort_keys=True))
+        with self._lock:
+            batch = self._batches.get(key, None)
+            leader = batch is None
+            if leader:
+                batch = _GuidBatch()
+                self._inflight[key] += 1
+                if self._inflight[key] > 1:
+                    # 已有同类查询进行中，等待窗口期合并后续查询
+                    self._batches[key] = batch
+                else:
+                    # 没有其他查询，立即发起，不等待窗口期
+                    window = 0
+            if guid not in batch.guids:
+                batch.guids.append(guid)
+            if len(batch.guids) >= max_size and self._batches.get(key, None) is batch:
+                # 批次已满，后续查询进入新批次
+                self._batches.pop(key, None)
+        if leader:
+            # 无论发起方如何结束(包括greenlet被kill)，都会通知等待方
+            try:
+                if window > 0:
+                    time.sleep(window)
+                with self._lock:
+                    if self._batches.get(key, None) is batch:
+                        self._batches.pop(key, None)
+                batch.results = self._dispatch(client, citype, query, batch)
+            except Exception as e:
+                batch.error = e
+            finally:
+                self._finish(key, batch)
+        elif not batch.event.wait(wait_timeout):
+            LOG.warning('wait batch guid query of %s timeout, query directly', citype)
+            return client.retrieve_direct(citype, query)
+        if batch.error is not None:
+            raise batch.error
+        if batch.results is None:
+            # 发起方被中断，未获得结果
+            return client.retrieve_direct(citype, query)
+        # 同一guid可能有多个请求方，各自返回副本，避免调用方修改结果相互影响
+        return copy.deepcopy(batch.results[guid])
+
+
+GUID_LOADER = GuidBatchLoader()
+
 
 class WeCMDBClient(object):
     """WeCMDB Client"""
@@ -91,17 +263,26 @@ class WeCMDBClient(object):
     def get(self, url, param=None, check_resp=True):
         LOG.info('GET %s', url)
         LOG.debug('Request: query - %s, data - None', str(param))
-        resp_json = utils.RestfulJson.get(url, headers=self.build_headers(), params=param)
+        resp_json = utils.RestfulJson.get(url, headers=self.build_headers(), params=param, upstream='cmdb')
         LOG.debug('Response: %s', str(resp_json))
         if check_resp:
             self.check_response(resp_json)
         return resp_json
 
-    def post(self, url, data, param=None):
+    def _post(self, url, data, param=None, idempotent=False):
         LOG.info('POST %s', url)
         LOG.debug('Request: query - %s, data - %s', str(param), str(data))
-        resp_json = utils.RestfulJson.post(url, headers=self.build_headers(), params=param, json=data)
+        resp_json = utils.RestfulJson.post(url,
+                                           headers=self.build_headers(),
+                                           params=param,
+                                           json=data,
+                                           upstream='cmdb',
+                                           idempotent=idempotent)
         LOG.debug('Response: %s', str(resp_json))
+        return resp_json
+
+    def post(self, url, data, param=None, idempotent=False):
+        resp_json = self._post(url, data, param=param, idempotent=idempotent)
         self.check_response(resp_json)
         return resp_json
 
@@ -149,8 +330,18 @@ class WeCMDBClient(object):
         url = self.server + self.build_citype_attrs_url(citype)
         return self.get(url)
 
+    def invalidate(self, citype):
+        cache = _get_request_cache()
+        if cache:
+            for key in [k for k in cache if k[0] == citype]:
+                cache.pop(key, None)
+        if citype == talos_utils.get_config(CONF, 'wecube.wecmdb.citypes.deploy_package', None):
+            # 物料包增删改后统计数据失效
+            ttl_cache.CACHE.purge('package_statistics')
+
     def state_operation(self, operation, citype, data):
         # need citype in Add operation
+        self.invalidate(citype)
         url = self.server + self.build_state_operation_url(operation, citype)
         return self.post(url, self.format(data))
 
@@ -165,24 +356,253 @@ class WeCMDBClient(object):
     def view_data(self, view_id, root_id, version):
         url = self.server + self.build_view_data_url()
         data = {"confirmTime": version, "rootCi": root_id, "viewId": view_id}
-        return self.post(url, data)
+        return self.post(url, data, idempotent=True)
 
     def create(self, citype, data):
+        self.invalidate(citype)
         url = self.server + self.build_create_url(citype)
         return self.post(url, data)
 
     def update(self, citype, data, keep_origin_value=None):
+        self.invalidate(citype)
         url = self.server + self.build_update_url(citype)
         return self.post(url, self.format(data, keep_origin_value=keep_origin_value))
 
-    def retrieve(self, citype, query):
+    def is_projection_enabled(self):
+        if _projection_unsupported.get(self.server, 0) > time.time():
+            return False
+        return bool(talos_utils.get_config(CONF, 'cmdb_client.result_columns_enabled', True))
+
+    def retrieve_direct(self, citype, query):
         url = self.server + self.build_retrieve_url(citype)
-        return self.post(url, query)
+        if 'resultColumns' not in query:
+            return self.post(url, query, idempotent=True)
+        if not self.is_projection_enabled():
+            return self.post(url, _strip_columns(query), idempotent=True)
+        try:
+            return self.post(url, query, idempotent=True)
+        except exceptions.UpstreamUnavailableError:
+            raise
+        except exceptions.PluginError as e:
+            # 去掉resultColumns后查询成功，说明CMDB可能不支持该参数，一段时间内不再发送；
+            # 仅错误信息明确指向resultColumns时按配置时间标记，否则(可能是偶发错误)只标记很短时间
+            resp_json = self.post(url, _strip_columns(query), idempotent=True)
+            if 'resultcolumns' in str(e).lower():
+                retry_after = int(talos_utils.get_config(CONF, 'cmdb_client.result_columns_retry_sec',
+                                                         DEFAULT_PROJECTION_RETRY) or 0)
+            else:
+                retry_after = AMBIGUOUS_PROJECTION_RETRY
+            LOG.warning('cmdb server: %s query with resultColumns failed(%s), fallback to all columns for %ss',
+                        self.server, str(e), retry_after)
+            _projection_unsupported[self.server] = time.time() + retry_after
+            return resp_json
+
+    def _retrieve_guid(self, citype, query):
+        guid = _get_single_guid(query)
+        window = float(talos_utils.get_config(CONF, 'cmdb_client.batch_window_ms', 0) or 0) / 1000.0
+        if guid is None or window <= 0 or not utils.is_gevent_patched():
+            return self.retrieve_direct(citype, query)
+        max_size = int(talos_utils.get_config(CONF, 'cmdb_client.batch_max_size', 100) or 100)
+        wait_timeout = float(talos_utils.get_config(CONF, 'cmdb_client.batch_wait_timeout', 60) or 60)
+        return GUID_LOADER.load(self, citype, query, guid, window, max_size, wait_timeout)
+
+    def retrieve(self, citype, query):
+        if not _is_guid_query(query):
+            return self.retrieve_direct(citype, query)
+        cache = _get_request_cache()
+        if cache is None:
+            return self._retrieve_guid(citype, query)
+        key = (citype, self.server, self.token, json.dumps(query, sort_keys=True))
+        if key not in cache:
+            cache[key] = self._retrieve_guid(citype, query)
+        else:
+            LOG.debug('using request cache for %s: %s', citype, key[3])
+        # 调用方可能修改返回数据，缓存中保留原始结果
+        return copy.deepcopy(cache[key])
+
+    def _post_stream(self, url, data, page_info=None):
+        '''
+        逐条解析查询结果(data.contents)，无需将整个响应读入内存；data.pageInfo中的标量字段写入page_info
+        '''
+        LOG.info('POST %s (stream)', url)
+        LOG.debug('Request: query - None, data - %s', str(data))
+        resp = utils.RestfulJson.post_stream(url, headers=self.build_headers(), json=data, upstream='cmdb',
+                                             idempotent=True)
+        try:
+            status = {'statusCode': None, 'statusMessage': 'invalid response'}
+            builder = None
+            for prefix, event, value in ijson.parse(resp.raw, use_float=True):
+                if builder is not None:
+                    builder.event(event, value)
+                    if prefix == 'data.contents.item' and event == 'end_map':
+                        yield builder.value
+                        builder = None
+                elif prefix == 'data.contents.item' and event == 'start_map':
+                    builder = ijson.ObjectBuilder()
+                    builder.event(event, value)
+                elif prefix in ('statusCode', 'statusMessage'):
+                    status[prefix] = value
+                elif page_info is not None and prefix.startswith('data.pageInfo.') and event in ('number', 'string'):
+                    page_info[prefix[len('data.pageInfo.'):]] = value
+            self.check_response(status)
+        finally:
+            resp.close()
+
+    def _iter_page(self, citype, query, page_info=None):
+        if not HAS_IJSON or not talos_utils.get_config(CONF, 'cmdb_client.stream_parse', True):
+            resp_json = self.retrieve_direct(citype, query)
+            if page_info is not None:
+                page_info.update((resp_json.get('data', None) or {}).get('pageInfo', None) or {})
+            for item in (resp_json.get('data', None) or {}).get('contents', None) or []:
+                yield item
+            return
+        stream_query = query
+        if 'resultColumns' in query and not self.is_projection_enabled():
+            stream_query = _strip_columns(query)
+        count = 0
+        try:
+            for item in self._post_stream(self.server + self.build_retrieve_url(citype), stream_query, page_info):
+                count += 1
+                yield item
+        except exceptions.UpstreamUnavailableError:
+            raise
+        except exceptions.PluginError:
+            if count or stream_query is not query:
+                raise
+            # 可能是CMDB不支持resultColumns，由retrieve_direct判断并回退
+            resp_json = self.retrieve_direct(citype, query)
+            if page_info is not None:
+                page_info.update((resp_json.get('data', None) or {}).get('pageInfo', None) or {})
+            for item in (resp_json.get('data', None) or {}).get('contents', None) or []:
+                yield item
+
+    def iterate(self, citype, query, page_size=None):
+        '''
+        分页遍历查询结果，逐条返回CI数据
+
+        未指定排序时按guid排序，保证分页结果稳定；遍历过程中不应删除同一结果集中的数据，否则会遗漏
+
+        以下任一情况结束遍历：返回数量不等于页大小，已达到pageInfo.totalRows，
+        本页首条数据与上一页重复(CMDB忽略了分页参数)；超过cmdb_client.max_pages页时抛出异常
+        '''
+        page_size = page_size or int(
+            talos_utils.get_config(CONF, 'cmdb_client.page_size', DEFAULT_PAGE_SIZE) or DEFAULT_PAGE_SIZE)
+        max_pages = int(talos_utils.get_config(CONF, 'cmdb_client.max_pages', DEFAULT_MAX_PAGES) or DEFAULT_MAX_PAGES)
+        query = copy.deepcopy(query)
+        query.setdefault('dialect', {"queryMode": "new"})
+        query.setdefault('filters', [])
+        query.setdefault('sorting', {"asc": True, "field": "guid"})
+        query['paging'] = True
+        start = 0
+        pages = 0
+        last_guids = None
+        while True:
+            if pages >= max_pages:
+                raise exceptions.PluginError(message=_('too many pages of %(citype)s, max pages: %(max_pages)s') %
+                                             {'citype': citype, 'max_pages': max_pages})
+            pages += 1
+            query['pageable'] = {'pageSize': page_size, 'startIndex': start}
+            page_info = {}
+            count = 0
+            first_guid = last_guid = None
+            for item in self._iter_page(citype, query, page_info):
+                guid = item.get('guid', None)
+                if count == 0:
+                    if guid is not None and last_guids is not None and guid in last_guids:
+                        LOG.warning('page %s of %s repeats the previous page, paging ignored by cmdb', pages, citype)
+                        return
+                    first_guid = guid
+                last_guid = guid
+                count += 1
+                yield item
+            last_guids = (first_guid, last_guid)
+            # 返回数量超过页大小说明未分页，已是全部结果
+            if count != page_size:
+                break
+            start += count
+            total = page_info.get('totalRows', None)
+            if isinstance(total, (int, float)) and start >= total:
+                break
+
+    def prefetch(self, citype, guids, query=None):
+        '''
+        批量查询guid并写入请求内缓存，之后相同条件的按guid查询直接命中
+        
+        query为按guid查询时使用的其他查询条件(默认{"dialect": {"queryMode": "new"}, "paging": False})
+        '''
+        cache = _get_request_cache()
+        guids = list(dict.fromkeys([g for g in guids if g and isinstance(g, str)]))
+        if cache is None or not guids:
+            return
+        query = dict(query or {"dialect": {"queryMode": "new"}, "paging": False})
+        max_size = int(talos_utils.get_config(CONF, 'cmdb_client.batch_max_size', 100) or 100)
+        for idx in range(0, len(guids), max_size):
+            chunk = guids[idx:idx + max_size]
+            try:
+                resp_json = self.retrieve_direct(citype, _build_in_query(query, chunk))
+            except exceptions.PluginError as e:
+                # 预取失败时回退为逐个查询
+                LOG.warning('prefetch %s error: %s', citype, str(e))
+                return
+            results = _split_by_guid(resp_json, chunk)
+            for guid, resp_json in results.items():
+                guid_query = dict(query, filters=[{"name": "guid", "operator": "eq", "value": guid}])
+                cache[(citype, self.server, self.token, json.dumps(guid_query, sort_keys=True))] = resp_json
+
+    def _write_chunk(self, url, chunk):
+        '''
+        写入一批数据，返回(结果数据, 错误列表)，不抛出业务异常
+        '''
+        try:
+            resp_json = self._post(url, chunk)
+        except exceptions.PluginError as e:
+            return None, [{'data': row, 'errorMessage': str(e)} for row in chunk]
+        if resp_json.get('statusCode', None) == 'OK':
+            return resp_json.get('data', None) or [], []
+        rows = resp_json.get('data', None)
+        if isinstance(rows, list) and rows and any('errorMessage' in r for r in rows if isinstance(r, dict)):
+            return None, [r for r in rows if isinstance(r, dict) and r.get('errorMessage', None)]
+        return None, [{'data': row, 'errorMessage': resp_json.get('statusMessage', '')} for row in chunk]
+
+    def bulk(self, operation, citype, data, keep_origin_value=None):
+        '''
+        分批并发创建/更新CI(operation: create/update)，返回与单次调用相同结构的结果(data按输入顺序)
+
+        批大小及并发数由cmdb_client.bulk_chunk_size/bulk_workers配置；
+        任一批次失败时汇总各行错误抛出BatchPartialError，已成功的批次不回滚
+        '''
+        if operation == 'create':
+            url = self.server + self.build_create_url(citype)
+        elif operation == 'update':
+            url = self.server + self.build_update_url(citype)
+            data = self.format(data, keep_origin_value=keep_origin_value)
+        else:
+            raise exceptions.ValidationError(attribute='operation', msg=_('expected: create, update'))
+        data = list(data)
+        # 请求内缓存仅在当前上下文可见，写入前统一失效
+        self.invalidate(citype)
+        chunk_size = int(talos_utils.get_config(CONF, 'cmdb_client.bulk_chunk_size', 200) or 200)
+        max_workers = int(talos_utils.get_config(CONF, 'cmdb_client.bulk_workers', 4) or 4)
+        chunks = [data[idx:idx + chunk_size] for idx in range(0, len(data), chunk_size)]
+        if len(chunks) > 1:
+            LOG.info('%s %s rows of %s in %s chunks', operation, len(data), citype, len(chunks))
+        results = []
+        errors = []
+        for rows, chunk_errors in utils.map_concurrently(lambda chunk: self._write_chunk(url, chunk), chunks,
+                                                         max_workers=max_workers):
+            results.extend(rows or [])
+            errors.extend(chunk_errors)
+        if errors:
+            LOG.error('%s %s of %s rows of %s failed', operation, len(errors), len(data), citype)
+            raise exceptions.BatchPartialError(action=operation, num=len(errors), exception_data={'data': errors})
+        return {'statusCode': 'OK', 'statusMessage': 'Success', 'data': results}
 
     def delete(self, citype, data):
+        self.invalidate(citype)
         url = self.server + self.build_delete_url(citype)
         return self.post(url, data)
 
     def confirm(self, citype, data):
+        self.invalidate(citype)
         url = self.server + self.build_confirm_url(citype)
         return self.post(url, data)
\ No newline at end of file
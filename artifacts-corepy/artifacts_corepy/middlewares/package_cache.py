@@ -0,0 +1,11 @@
+# coding=utf-8
+
+from __future__ import absolute_import
+
+from artifacts_corepy.common import package_cache
+
+
+class PackageCachePin(object):
+    """中间件，请求结束时释放请求期间锁定的物料包缓存"""
+    def process_response(self, req, resp, resource, req_succeeded):
+        package_cache.release_request_pins(req)
@@ -10,12 +10,11 @@ artifacts_corepy.server.scheduler
 from __future__ import absolute_import
 
 import os
-import shutil
-import time
 import datetime
 import logging
 from pytz import timezone
 from talos.core import config
+from talos.core import utils
 
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.jobstores.memory import MemoryJobStore
@@ -23,6 +22,7 @@ from apscheduler.executors.pool import ThreadPoolExecutor
 
 from artifacts_corepy.server.wsgi_server import application
 from artifacts_corepy.common import nexus
+from artifacts_corepy.common import package_cache
 from artifacts_corepy.common import wecmdbv2 as wecmdb
 from artifacts_corepy.common import wecube
 
@@ -34,23 +34,34 @@ executors = {'default': ThreadPoolExecutor(5)}
 job_defaults = {'coalesce': False, 'max_instances': 1}
 
 
+def _get_int_config(name, default, empty=None):
+    '''
+    读取整数配置，值为空字符串(如环境变量未设置)时返回empty(默认同default)
+    '''
+    value = utils.get_config(CONF, name, default)
+    if isinstance(value, str) and not value.strip():
+        return default if empty is None else empty
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        LOG.error("Invalid %s: %s", name, value)
+        return default
+
+
 def cleanup_cached_dir():
     try:
-        interval_min = 10
-        try:
-            interval_min = int(CONF.pakcage_cache_cleanup_interval_min)
-        except Exception as e:
-            LOG.error("Invalid package_cache_cleanup_interval_min: %s",
-                      CONF.pakcage_cache_cleanup_interval_min)
-        max_delta = interval_min * 60
-        base_dir = CONF.pakcage_cache_dir
-        for name in list(os.listdir(base_dir)):
-            fullpath = os.path.join(base_dir, name)
-            if os.path.isdir(fullpath):
-                path_stat = os.stat(fullpath)
-                if time.time() - path_stat.st_atime > max_delta:
-                    LOG.info('remove dir: %s, last access: %s', fullpath, path_stat.st_atime)
-                    shutil.rmtree(fullpath, ignore_errors=True)
+        # 环境变量未设置(空值)表示不限制容量
+        max_size_mb = _get_int_config('package_cache.max_size_mb', 10240, empty=0)
+        max_entries = _get_int_config('package_cache.max_entries', 0)
+        pin_timeout = _get_int_config('package_cache.pin_timeout_sec', 1800)
+        max_idle = 0
+        if max_size_mb <= 0 and max_entries <= 0:
+            # 未配置容量预算时，按闲置时间淘汰
+            max_idle = _get_int_config('pakcage_cache_cleanup_interval_min', 10) * 60
+        package_cache.evict(max_bytes=max_size_mb * 1024 * 1024,
+                            max_entries=max_entries,
+                            max_idle=max_idle,
+                            pin_timeout=pin_timeout)
     except Exception as e:
         LOG.exception(e)
 
@@ -109,21 +120,17 @@ def cleanup_deploy_package():
                 "queryMode": "new"
             },
             "filters": [],
-            "paging": False,
             "sorting": {
                 "asc": False,
                 "field": "update_time"
             }
         }
-        resp_json = cmdb_client.retrieve(CONF.wecube.wecmdb.citypes.unit_design, query)
-        if not resp_json.get('data', {}).get('contents', []):
-            return
-        unit_design_list = resp_json['data']['contents']
+        wecmdb.set_result_columns(query, ['guid', CONF.cleanup.keep_unit_field])
 
         nexus_client = nexus.NeuxsClient(CONF.nexus.server, CONF.nexus.username, CONF.nexus.password)
         artifact_repository = CONF.nexus.repository
 
-        for unit_design in unit_design_list:
+        for unit_design in cmdb_client.iterate(CONF.wecube.wecmdb.citypes.unit_design, query):
             query = {
                 "dialect": {
                     "queryMode": "new"
@@ -133,58 +140,59 @@ def cleanup_deploy_package():
                     "operator": "eq",
                     "value": unit_design["guid"]
                 }],
-                "paging": False,
                 "sorting": {
                     "asc": False,
                     "field": "update_time"
                 }
             }
-            resp_json = cmdb_client.retrieve(CONF.wecube.wecmdb.citypes.deploy_package, query)
-            if not resp_json.get('data', {}).get('contents', []):
-                continue
+            wecmdb.set_result_columns(query, ['guid', 'state', 'deploy_package_url', 'update_time'])
 
             keep_topn = unit_design.get(CONF.cleanup.keep_unit_field, CONF.cleanup.keep_topn)
             keep_topn = int(keep_topn)
-            deploy_package_list = resp_json['data']['contents']
+            # 分页遍历时删除数据会导致后续分页偏移，先收集待清理的物料包再删除
+            deploy_package_list = []
             cnt = 1
-            for deploy_package in deploy_package_list:
+            for deploy_package in cmdb_client.iterate(CONF.wecube.wecmdb.citypes.deploy_package, query):
                 if deploy_package['state'] == 'deleted_0':
                     continue
                 if cnt > keep_topn:
-                    try:
-                        data = [{'guid': deploy_package["guid"]}]
-                        resp_json = cmdb_client.delete(CONF.wecube.wecmdb.citypes.deploy_package, data)
-                        if resp_json.get('statusCode', 'OK') == 'OK' and resp_json['data'][0].get('state',
-                                                                                                '') == 'deleted_0':
-                            LOG.info('delete package[%s] from ci data', deploy_package["guid"])
-                            cmdb_client.confirm(CONF.wecube.wecmdb.citypes.deploy_package, data)
-                        if resp_json.get('statusCode', 'OK') == 'OK':
-                            deploy_package_url = deploy_package.get("deploy_package_url", "")
-                            if deploy_package_url.startswith(CONF.wecube.server):
-                                # delete nexus package
-                                prefix = CONF.wecube.server.rstrip('/') + '/artifacts/repository/' + artifact_repository
-                                suffix = deploy_package_url[len(prefix):]
-                                suffix_list = suffix.split("/")
-                                if len(suffix_list) >= 2:
-                                    filename = suffix_list[len(suffix_list) - 1]
-                                    component_name = filename
-                                    component_group = "/"
-                                    if len(suffix_list) > 2:
-                                        component_group = suffix[:len(suffix) - len("/" + filename)]
-                                        component_name = suffix[1:]
-                                    asset_info = nexus_client.get_asset(artifact_repository, component_group,
-                                                                        component_name)
-                                    if asset_info:
-                                        asset_id = asset_info["id"]
-                                        nexus_client.delete_assets(artifact_repository,
-                                                                '/service/rest/v1/assets/' + asset_id)
-                                        LOG.info('delete package[%s] from local nexus: %s', deploy_package["guid"], suffix)
-                                    else:
-                                        LOG.error('delete package[%s] from local nexus: %s failed, asset not found',
-                                                deploy_package["guid"], suffix)
-                    except Exception as e:
-                        LOG.exception(e)
+                    deploy_package_list.append(deploy_package)
                 cnt += 1
+            for deploy_package in deploy_package_list:
+                try:
+                    data = [{'guid': deploy_package["guid"]}]
+                    resp_json = cmdb_client.delete(CONF.wecube.wecmdb.citypes.deploy_package, data)
+                    if resp_json.get('statusCode', 'OK') == 'OK' and resp_json['data'][0].get('state',
+                                                                                            '') == 'deleted_0':
+                        LOG.info('delete package[%s] from ci data', deploy_package["guid"])
+                        cmdb_client.confirm(CONF.wecube.wecmdb.citypes.deploy_package, data)
+                    if resp_json.get('statusCode', 'OK') == 'OK':
+                        deploy_package_url = deploy_package.get("deploy_package_url", "")
+                        if deploy_package_url.startswith(CONF.wecube.server):
+                            # delete nexus package
+                            prefix = CONF.wecube.server.rstrip('/') + '/artifacts/repository/' + artifact_repository
+                            suffix = deploy_package_url[len(prefix):]
+                            suffix_list = suffix.split("/")
+                            if len(suffix_list) >= 2:
+                                filename = suffix_list[len(suffix_list) - 1]
+                                component_name = filename
+                                component_group = "/"
+                                if len(suffix_list) > 2:
+                                    component_group = suffix[:len(suffix) - len("/" + filename)]
+                                    component_name = suffix[1:]
+                                asset_info = nexus_client.get_asset(artifact_repository, component_group,
+                                                                    component_name)
+                                if asset_info:
+                                    asset_id = asset_info["id"]
+                                    nexus_client.delete_assets(artifact_repository,
+                                                               '/service/rest/v1/assets/' + asset_id,
+                                                               group=component_group)
+                                    LOG.info('delete package[%s] from local nexus: %s', deploy_package["guid"], suffix)
+                                else:
+                                    LOG.error('delete package[%s] from local nexus: %s failed, asset not found',
+                                            deploy_package["guid"], suffix)
+                except Exception as e:
+                    LOG.exception(e)
         return
     except Exception as e:
         LOG.exception(e)
@@ -14,6 +14,7 @@ import os
 import os.path
 
 from artifacts_corepy.middlewares import auth
+from artifacts_corepy.middlewares import package_cache
 from artifacts_corepy.middlewares import permission
 from talos.core import utils
 from talos.server import base
@@ -37,6 +38,7 @@ application = base.initialize_server('artifacts_corepy',
                                                     '/etc/artifacts_corepy/artifacts_corepy.conf'),
                                      conf_dir=os.environ.get('ARTIFACTS_COREPY_CONF_DIR',
                                                              '/etc/artifacts_corepy/artifacts_corepy.conf.d'),
-                                     middlewares=[auth.JWTAuth(), permission.Permission()])
+                                     middlewares=[auth.JWTAuth(), permission.Permission(),
+                                                  package_cache.PackageCachePin()])
 application.set_error_serializer(error_serializer)
 # application.req_options.auto_parse_qs_csv = True
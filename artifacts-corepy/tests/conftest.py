@@ -0,0 +1,55 @@
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import copy
+import os
+
+import pytest
+from talos.core import config
+
+BASE_OPTS = {
+    'pakcage_cache_dir': None,
+    'package_cache': {
+        'tar_seekable_copy': False,
+    },
+    'metadata_cache': {
+        'disk_enabled': True,
+        'max_entries': 1024,
+        'ttl': {},
+        'stale_ttl': {},
+    },
+    'resilience': {
+        'default': {
+            'retries': 2,
+            'backoff_base': 0,
+            'backoff_max': 0,
+            'failure_threshold': 3,
+            'reset_timeout': 30,
+        },
+    },
+    'cmdb_client': {
+        'batch_window_ms': 5,
+        'batch_max_size': 100,
+        'batch_wait_timeout': 5,
+        'result_columns_enabled': True,
+        'page_size': 3,
+        'max_pages': 10,
+        'stream_parse': False,
+        'bulk_chunk_size': 2,
+        'bulk_workers': 2,
+    },
+}
+
+
+@pytest.fixture(autouse=True)
+def conf(tmp_path):
+    '''
+    每个用例使用独立的配置及缓存目录，用例内可直接修改返回的配置
+    '''
+    opts = copy.deepcopy(BASE_OPTS)
+    opts['pakcage_cache_dir'] = str(tmp_path / 'cache')
+    os.makedirs(opts['pakcage_cache_dir'])
+    config.CONF(opts)
+    yield opts
+    config.CONF({})
@@ -0,0 +1,165 @@
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from artifacts_corepy.common import archive
+
+FILES = {
+    'bin/start.sh': b'#!/bin/sh\necho start\n',
+    'conf/app.properties': b'name=demo\nport=8080\n',
+    'lib/app.jar': os.urandom(200 * 1024),
+}
+
+
+def _make_entry(tmp_path, filename, files=None, links=None):
+    files = FILES if files is None else files
+    entry_path = str(tmp_path / filename.replace('.', '_'))
+    data_path = os.path.join(entry_path, archive.ARCHIVE_DATA_DIR)
+    os.makedirs(data_path)
+    filepath = os.path.join(data_path, filename)
+    if archive.get_archive_type(filename) == 'zip':
+        with zipfile.ZipFile(filepath, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for path, content in files.items():
+                zf.writestr(path, content)
+    else:
+        mode = 'w:'
+        for ext, compression in (('gz', 'gz'), ('tgz', 'gz'), ('bz2', 'bz2'), ('xz', 'xz')):
+            if filename.endswith('.' + ext):
+                mode = 'w:' + compression
+        with tarfile.open(filepath, mode) as tf:
+            for path, content in files.items():
+                info = tarfile.TarInfo(path)
+                info.size = len(content)
+                info.mtime = 1600000000
+                tf.addfile(info, io.BytesIO(content))
+            for path, (link_type, target) in (links or {}).items():
+                info = tarfile.TarInfo(path)
+                info.type = link_type
+                info.linkname = target
+                tf.addfile(info)
+    return entry_path
+
+
+def test_archive_type_and_seekable_format():
+    assert archive.get_archive_type('a.JAR') == 'zip'
+    assert archive.get_archive_type('a.tar.xz') == 'tar'
+    assert archive.get_archive_type('a.txt') is None
+    assert archive.is_seekable_format('a.war')
+    assert archive.is_seekable_format('a.tar')
+    assert archive.is_seekable_format('a.tgz') == archive.HAS_INDEXED_GZIP
+    assert not archive.is_seekable_format('a.tar.bz2')
+    assert not archive.is_seekable_format('a.txz')
+    assert not archive.is_seekable_format('a.txt')
+
+
+@pytest.mark.parametrize('filename', ['pkg.zip', 'pkg.tar', 'pkg.tar.gz', 'pkg.tar.bz2', 'pkg.tar.xz'])
+def test_read_members(tmp_path, filename):
+    package = archive.open_archive(_make_entry(tmp_path, filename), cache=False)
+    assert [m.path for m in package.listdir('')] == ['bin', 'conf', 'lib']
+    assert package.isdir('conf')
+    assert not package.exists('conf/missing')
+    for path, content in FILES.items():
+        member = package.get(path)
+        assert member.size == len(content)
+        with package.open(path) as f:
+            assert f.read() == content
+        assert package.md5(path) == hashlib.md5(content).hexdigest()
+    assert package.read_text('conf/app.properties', 4) == 'name'
+    with pytest.raises(IsADirectoryError):
+        with package.open('conf'):
+            pass
+
+
+def test_tar_index_persisted_with_md5(tmp_path, mocker):
+    entry_path = _make_entry(tmp_path, 'pkg.tar.gz')
+    archive.open_archive(entry_path, cache=False)
+    assert os.path.exists(os.path.join(entry_path, archive.ARCHIVE_INDEX_FILE))
+    build_index = mocker.patch.object(archive.TarArchive, 'build_index')
+    package = archive.open_archive(entry_path, cache=False)
+    build_index.assert_not_called()
+    # 索引扫描时已计算md5，无需读取成员
+    assert package.get('lib/app.jar').md5 == hashlib.md5(FILES['lib/app.jar']).hexdigest()
+
+
+def test_tar_links_resolved(tmp_path):
+    links = {
+        'conf/current': (tarfile.SYMTYPE, 'app.properties'),
+        'bin/hard': (tarfile.LNKTYPE, 'bin/start.sh'),
+        'bin/escape': (tarfile.SYMTYPE, '/etc/passwd'),
+    }
+    package = archive.open_archive(_make_entry(tmp_path, 'pkg.tar', links=links), cache=False)
+    assert package.read_text('conf/current') == FILES['conf/app.properties'].decode()
+    assert package.read_text('bin/hard') == FILES['bin/start.sh'].decode()
+    assert package.get('conf/current').md5 == hashlib.md5(FILES['conf/app.properties']).hexdigest()
+    assert not package.exists('bin/escape')
+
+
+def test_open_archive_cache(tmp_path):
+    entry_path = _make_entry(tmp_path, 'pkg.zip')
+    archive._archives.clear()
+    assert archive.open_archive(entry_path, cache=False) is not archive.open_archive(entry_path, cache=False)
+    assert not archive._archives
+    package = archive.open_archive(entry_path)
+    assert archive.open_archive(entry_path) is package
+    assert package.entry_path == entry_path
+
+
+@pytest.mark.skipif(not archive.HAS_INDEXED_GZIP, reason='indexed_gzip not installed')
+def test_tar_gz_members_share_one_checkpoint_stream(tmp_path, mocker):
+    entry_path = _make_entry(tmp_path, 'pkg.tgz')
+    package = archive.open_archive(entry_path, cache=False)
+    assert os.path.exists(os.path.join(entry_path, archive.GZIP_INDEX_FILE))
+    indexed_gzip_file = mocker.spy(archive.indexed_gzip, 'IndexedGzipFile')
+    paths = sorted(FILES) * 4
+
+    def read(path):
+        with package.open(path) as f:
+            return f.read()
+
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        assert list(executor.map(read, paths)) == [FILES[p] for p in paths]
+    assert indexed_gzip_file.call_count == 1
+
+
+def test_tar_prefetch_md5_single_pass_for_legacy_index(tmp_path, mocker):
+    entry_path = _make_entry(tmp_path, 'pkg.tar.bz2')
+    index_path = os.path.join(entry_path, archive.ARCHIVE_INDEX_FILE)
+    archive.open_archive(entry_path, cache=False)
+    # 旧版本索引没有md5
+    with open(index_path) as f:
+        index = json.load(f)
+    for item in index['members'].values():
+        del item[5:]
+    with open(index_path, 'w') as f:
+        json.dump(index, f)
+    package = archive.open_archive(entry_path, cache=False)
+    assert package.get('lib/app.jar').md5 is None
+    open_member = mocker.spy(package, 'open')
+    stream_md5 = mocker.spy(package, '_stream_md5')
+    package.prefetch_md5(sorted(FILES))
+    assert stream_md5.call_count == 1
+    open_member.assert_not_called()
+    for path, content in FILES.items():
+        assert package.md5(path) == hashlib.md5(content).hexdigest()
+
+
+def test_directory_archive(tmp_path):
+    root = str(tmp_path / 'pkg')
+    for path, content in FILES.items():
+        os.makedirs(os.path.join(root, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(root, path), 'wb') as f:
+            f.write(content)
+    package = archive.DirectoryArchive(root)
+    assert package.kind == 'dir'
+    assert package.get('bin/start.sh').md5 == hashlib.md5(FILES['bin/start.sh']).hexdigest()
+    assert package.read_text('conf/app.properties') == FILES['conf/app.properties'].decode()
@@ -0,0 +1,93 @@
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import datetime
+import json
+
+import pytest
+
+from artifacts_corepy.common import controller
+from artifacts_corepy.common import exceptions
+
+
+class FakeRequest(object):
+    method = 'GET'
+    params = {}
+
+
+class FakeResponse(object):
+    content_type = None
+    stream = None
+
+
+def _rows(count, fail_at=None):
+    for i in range(count):
+        if i == fail_at:
+            raise exceptions.PluginError(message='cmdb error')
+        yield {'guid': 'g%s' % i, 'updated': datetime.datetime(2023, 1, 1, 8, 30)}
+
+
+class FakeResource(object):
+    rows = None
+
+    def iterate(self, params):
+        return self.rows
+
+
+class DemoCollection(controller.StreamCollection):
+    allow_methods = ('GET', )
+    name = 'demo'
+    resource = FakeResource
+
+
+def _get(rows):
+    FakeResource.rows = rows
+    resp = FakeResponse()
+    DemoCollection().on_get(FakeRequest(), resp)
+    return json.loads(b''.join(resp.stream))
+
+
+@pytest.mark.parametrize('count', [0, 1, 5])
+def test_stream_all_rows(count):
+    body = _get(_rows(count))
+    assert body['status'] == 'OK'
+    assert body['code'] == 200
+    assert [r['guid'] for r in body['data']] == ['g%s' % i for i in range(count)]
+    if count:
+        assert body['data'][0]['updated'] == '2023-01-01 08:30:00'
+
+
+def test_stream_large_response_in_chunks():
+    resp = FakeResponse()
+    FakeResource.rows = ({'guid': 'g%s' % i, 'value': 'x' * 1024} for i in range(200))
+    DemoCollection().on_get(FakeRequest(), resp)
+    chunks = list(resp.stream)
+    assert len(chunks) > 1
+    assert len(json.loads(b''.join(chunks))['data']) == 200
+
+
+def test_error_in_first_page_raised_before_streaming():
+    # page_size为3，首页数据(含多取的一条)读取完毕前的错误以正常错误响应返回
+    with pytest.raises(exceptions.PluginError):
+        _get(_rows(10, fail_at=3))
+
+
+def test_error_after_streaming_ends_with_error_status():
+    body = _get(_rows(10, fail_at=6))
+    assert body['status'] == 'ERROR'
+    assert body['message'] == 'cmdb error'
+    assert body['code'] == exceptions.PluginError.error_code
+    assert [r['guid'] for r in body['data']] == ['g%s' % i for i in range(6)]
+
+
+def test_unexpected_error_after_streaming():
+    def rows():
+        for row in _rows(5):
+            yield row
+        raise RuntimeError('secret detail')
+
+    body = _get(rows())
+    assert body['status'] == 'ERROR'
+    assert body['code'] == 500
+    assert 'secret detail' not in body['message']
@@ -0,0 +1,123 @@
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import os
+import time
+
+from artifacts_corepy.common import package_cache
+
+
+def _fill(checksum, size, last_access=None):
+    staging_path = package_cache.create_staging_path()
+    with open(os.path.join(staging_path, 'data.bin'), 'wb') as f:
+        f.write(b'0' * size)
+    entry_path = package_cache.install(staging_path, package_cache.get_content_path(checksum))
+    package_cache.record_size(entry_path)
+    package_cache.mark_complete(entry_path)
+    package_cache.record_access(entry_path)
+    if last_access is not None:
+        access_file = os.path.join(package_cache.get_meta_path(entry_path), package_cache.ACCESS_FILE)
+        os.utime(access_file, (last_access, last_access))
+    return entry_path
+
+
+def test_normalize_checksum():
+    assert package_cache.normalize_checksum(' %s ' % ('A' * 32)) == 'a' * 32
+    assert package_cache.normalize_checksum('N/A') is None
+    assert package_cache.normalize_checksum(None) is None
+
+
+def test_entry_visible_only_after_marked_complete():
+    staging_path = package_cache.create_staging_path()
+    entry_path = package_cache.install(staging_path, package_cache.get_content_path('a' * 32))
+    assert os.path.isdir(entry_path)
+    assert not os.path.exists(staging_path)
+    assert not package_cache.is_complete(entry_path)
+    package_cache.mark_complete(entry_path)
+    assert package_cache.is_complete(entry_path)
+
+
+def test_install_replaces_incomplete_entry():
+    entry_path = package_cache.get_content_path('a' * 32)
+    os.makedirs(entry_path)
+    with open(os.path.join(entry_path, 'partial'), 'w'):
+        pass
+    staging_path = package_cache.create_staging_path()
+    package_cache.install(staging_path, entry_path)
+    assert os.listdir(entry_path) == []
+
+
+def test_evict_lru_within_size_budget():
+    now = time.time()
+    oldest = _fill('a' * 32, 100, now - 300)
+    older = _fill('b' * 32, 100, now - 200)
+    newest = _fill('c' * 32, 100, now - 100)
+    total_bytes, total_entries = package_cache.evict(max_bytes=250)
+    assert (total_bytes, total_entries) == (200, 2)
+    assert not os.path.exists(oldest)
+    assert not os.path.exists(package_cache.get_meta_path(oldest))
+    assert package_cache.is_complete(older)
+    assert package_cache.is_complete(newest)
+
+
+def test_evict_unlimited_budget_keeps_entries():
+    entry_path = _fill('a' * 32, 100)
+    package_cache.evict()
+    assert package_cache.is_complete(entry_path)
+
+
+def test_evict_skips_pinned_entry():
+    now = time.time()
+    pinned = _fill('a' * 32, 100, now - 300)
+    other = _fill('b' * 32, 100, now - 200)
+    pin_path = package_cache.pin(pinned)
+    package_cache.evict(max_entries=1)
+    assert package_cache.is_complete(pinned)
+    assert not os.path.exists(other)
+    package_cache.unpin(pin_path)
+    package_cache.evict(max_entries=0, max_idle=1)
+    assert not os.path.exists(pinned)
+
+
+def test_evict_keeps_entry_pinned_by_concurrent_reader(mocker):
+    '''
+    读取方在淘汰方检查锁定之后、移除完成标记之前通过了完成标记检查，随后锁定条目：
+    淘汰方复查到锁定，恢复完成标记并保留条目
+    '''
+    entry_path = _fill('a' * 32, 100)
+    unmark_complete = package_cache.unmark_complete
+    pins = []
+
+    def racing_unmark(path):
+        completed = unmark_complete(path)
+        pins.append(package_cache.pin(path))
+        return completed
+
+    mocker.patch.object(package_cache, 'unmark_complete', side_effect=racing_unmark)
+    package_cache.evict(max_bytes=1)
+    assert pins
+    assert package_cache.is_complete(entry_path)
+    assert os.path.exists(os.path.join(entry_path, 'data.bin'))
+
+
+def test_evict_removes_stale_pins_and_staging():
+    entry_path = _fill('a' * 32, 100)
+    pin_path = package_cache.pin(entry_path)
+    os.utime(pin_path, (time.time() - 3600, time.time() - 3600))
+    fresh_staging = package_cache.create_staging_path()
+    stale_staging = package_cache.create_staging_path()
+    os.utime(stale_staging, (time.time() - 3600, time.time() - 3600))
+    package_cache.evict(max_bytes=1, pin_timeout=60)
+    assert not os.path.exists(entry_path)
+    assert os.path.exists(fresh_staging)
+    assert not os.path.exists(stale_staging)
+
+
+def test_link_package_and_dangling_cleanup():
+    entry_path = _fill('a' * 32, 100)
+    link_path = package_cache.link_package('guid-1', entry_path)
+    assert os.path.realpath(link_path) == os.path.realpath(entry_path)
+    assert package_cache.get_entry_key(link_path) == 'a' * 32
+    package_cache.evict(max_bytes=1)
+    assert not os.path.lexists(link_path)
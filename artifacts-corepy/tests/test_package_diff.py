@@ -0,0 +1,148 @@
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import io
+import os
+import tarfile
+import zipfile
+
+from artifacts_corepy.common import archive
+from artifacts_corepy.common import package_cache
+from artifacts_corepy.common import package_diff
+
+BASELINE = {
+    'conf/app.properties': b'port=8080\n',
+    'conf/log.xml': b'<log/>',
+    'lib/app.jar': b'jar-v1',
+    'lib/ext/util.jar': b'util',
+    'old.txt': b'old',
+}
+PACKAGE = {
+    'conf/app.properties': b'port=8080\n',
+    'conf/log.xml': b'<log/>',
+    'lib/app.jar': b'jar-v2',
+    'lib/ext/util.jar': b'util',
+    'new.txt': b'new',
+}
+
+
+def _make_dir(checksum, files):
+    entry_path = package_cache.get_content_path(checksum)
+    for path, content in files.items():
+        fullpath = os.path.join(entry_path, path)
+        os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+        with open(fullpath, 'wb') as f:
+            f.write(content)
+    return archive.DirectoryArchive(entry_path)
+
+
+def _make_archive(tmp_path, filename, files, mtime=1600000000):
+    entry_path = str(tmp_path / filename.replace('.', '_'))
+    data_path = os.path.join(entry_path, archive.ARCHIVE_DATA_DIR)
+    os.makedirs(data_path)
+    filepath = os.path.join(data_path, filename)
+    if filename.endswith('.zip'):
+        with zipfile.ZipFile(filepath, 'w') as zf:
+            for path, content in files.items():
+                zf.writestr(zipfile.ZipInfo(path, (2020, 1, 1, 0, 0, 0)), content)
+    else:
+        with tarfile.open(filepath, 'w:gz') as tf:
+            for path, content in files.items():
+                info = tarfile.TarInfo(path)
+                info.size = len(content)
+                info.mtime = mtime
+                tf.addfile(info, io.BytesIO(content))
+    return archive.open_archive(entry_path, cache=False)
+
+
+def _status(results):
+    return dict([(p, v[1]) for p, v in results.items()])
+
+
+def test_compare_directories():
+    results = package_diff.compare(_make_dir('a' * 32, PACKAGE), _make_dir('b' * 32, BASELINE))
+    assert _status(results) == {
+        'conf': 'same',
+        'conf/app.properties': 'same',
+        'conf/log.xml': 'same',
+        'lib': 'changed',
+        'lib/app.jar': 'changed',
+        'lib/ext': 'same',
+        'lib/ext/util.jar': 'same',
+        'old.txt': 'deleted',
+        'new.txt': 'new',
+    }
+    assert results['lib'] == (True, 'changed')
+    assert results['new.txt'] == (False, 'new')
+
+
+def test_compare_skips_subtrees_with_same_merkle_hash(mocker):
+    is_same_by_metadata = mocker.spy(package_diff, 'is_same_by_metadata')
+    package_diff.compare(_make_dir('a' * 32, PACKAGE), _make_dir('b' * 32, BASELINE))
+    compared = set([c[0][2].path for c in is_same_by_metadata.call_args_list])
+    assert compared == set(['lib/app.jar'])
+
+
+def test_compare_file_replaced_by_dir():
+    results = package_diff.compare(_make_dir('a' * 32, {'conf/app/x.properties': b'x'}),
+                                   _make_dir('b' * 32, {'conf/app': b'x'}))
+    assert _status(results) == {'conf': 'changed', 'conf/app': 'changed', 'conf/app/x.properties': 'new'}
+
+
+def test_compare_tar_with_unpacked_baseline(tmp_path, mocker):
+    package_files = _make_archive(tmp_path, 'pkg.tar.gz', PACKAGE)
+    baseline_files = _make_dir('b' * 32, BASELINE)
+    # 目录哈希基于md5可跨类型比较，且无需读取tar成员
+    assert package_files.tree_hash('conf') == baseline_files.tree_hash('conf')
+    open_member = mocker.spy(package_files, 'open')
+    results = package_diff.compare(package_files, baseline_files)
+    open_member.assert_not_called()
+    assert _status(results)['conf'] == 'same'
+    assert _status(results)['lib/app.jar'] == 'changed'
+    assert _status(results)['lib/ext'] == 'same'
+
+
+def test_compare_tar_same_size_and_mtime_uses_md5(tmp_path):
+    results = package_diff.compare(_make_archive(tmp_path, 'pkg.tar.gz', PACKAGE),
+                                   _make_archive(tmp_path, 'base.tar.gz', BASELINE))
+    # jar-v1/jar-v2大小及修改时间相同，内容不同
+    assert _status(results)['lib/app.jar'] == 'changed'
+    assert _status(results)['lib'] == 'changed'
+    assert _status(results)['conf'] == 'same'
+
+
+def test_compare_zip_by_crc(tmp_path, mocker):
+    package_files = _make_archive(tmp_path, 'pkg.zip', PACKAGE)
+    baseline_files = _make_archive(tmp_path, 'base.zip', BASELINE)
+    compute_md5 = mocker.spy(package_files, '_compute_md5')
+    results = package_diff.compare(package_files, baseline_files)
+    compute_md5.assert_not_called()
+    assert _status(results) == _status(package_diff.compare(_make_dir('a' * 32, PACKAGE),
+                                                            _make_dir('b' * 32, BASELINE)))
+
+
+def test_diff_results_persisted_per_content_pair(mocker):
+    package_files = _make_dir('a' * 32, PACKAGE)
+    baseline_files = _make_dir('b' * 32, BASELINE)
+    results = package_diff.get_diff_results(package_files, baseline_files)
+    assert os.path.exists(package_cache.get_diff_path('a' * 32, 'b' * 32))
+    package_diff._results.clear()
+    compare = mocker.patch.object(package_diff, 'compare')
+    assert package_diff.get_diff_results(package_files, baseline_files) == results
+    compare.assert_not_called()
+
+
+def test_diff_results_removed_with_baseline():
+    package_files = _make_dir('a' * 32, PACKAGE)
+    baseline_files = _make_dir('b' * 32, BASELINE)
+    package_diff.get_diff_results(package_files, baseline_files)
+    package_cache.remove_entry(baseline_files.entry_path)
+    package_cache.evict()
+    assert not os.path.exists(package_cache.get_diff_path('a' * 32, 'b' * 32))
+
+
+def test_snapshot_without_baseline():
+    snapshot = package_diff.create_snapshot(_make_dir('a' * 32, PACKAGE))
+    assert snapshot.baseline_files is None
+    assert snapshot.results == {}
@@ -0,0 +1,66 @@
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import hashlib
+import os
+
+from artifacts_corepy.common import package_manifest
+
+
+def _write(root, path, content):
+    fullpath = os.path.join(root, path)
+    os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+    with open(fullpath, 'wb') as f:
+        f.write(content)
+
+
+def _make_package(root, files):
+    for path, content in files.items():
+        _write(root, path, content)
+    return root
+
+
+def test_manifest_records_files_and_md5(tmp_path):
+    root = _make_package(str(tmp_path / 'pkg'), {'bin/start.sh': b'start', 'conf/app.properties': b'a=1'})
+    manifest = package_manifest.create_manifest(root)
+    assert len(manifest) == 4
+    entry = manifest.get('conf/app.properties')
+    assert not entry.is_dir
+    assert entry.size == 3
+    assert entry.md5 == hashlib.md5(b'a=1').hexdigest()
+    assert manifest.isdir('bin')
+    assert [e.path for e in manifest.listdir('')] == ['bin', 'conf']
+    assert [e.path for e in manifest.walk('')] == ['bin', 'bin/start.sh', 'conf', 'conf/app.properties']
+
+
+def test_manifest_persisted_and_reloaded(tmp_path):
+    root = _make_package(str(tmp_path / 'pkg'), {'a/b.txt': b'b'})
+    manifest = package_manifest.create_manifest(root)
+    package_manifest._manifests.clear()
+    loaded = package_manifest.get_manifest(root)
+    assert loaded is not manifest
+    assert [(e.path, e.md5) for e in loaded.walk('')] == [(e.path, e.md5) for e in manifest.walk('')]
+
+
+def test_manifest_normalizes_paths(tmp_path):
+    root = _make_package(str(tmp_path / 'pkg'), {'a/b.txt': b'b'})
+    manifest = package_manifest.create_manifest(root)
+    assert manifest.get('/a/./b.txt').path == 'a/b.txt'
+    # 不允许越过根目录
+    assert manifest.get('../a/b.txt').path == 'a/b.txt'
+
+
+def test_dir_merkle_hash_follows_content(tmp_path):
+    files = {'x/1.txt': b'1', 'x/2.txt': b'2', 'y/3.txt': b'3'}
+    first = package_manifest.create_manifest(_make_package(str(tmp_path / 'p1'), files))
+    second = package_manifest.create_manifest(_make_package(str(tmp_path / 'p2'), dict(files, **{'y/3.txt': b'4'})))
+    assert first.get('x').md5 == second.get('x').md5
+    assert first.get('y').md5 != second.get('y').md5
+    assert first.get('').md5 != second.get('').md5
+
+
+def test_merkle_hash_unknown_child():
+    assert package_manifest.merkle_hash([('a', False, 'abc'), ('b', False, None)]) is None
+    assert package_manifest.merkle_hash([('b', False, '2'), ('a', True, '1')]) == \
+        package_manifest.merkle_hash([('a', True, '1'), ('b', False, '2')])
@@ -0,0 +1,155 @@
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import time
+
+import pytest
+import requests
+
+from artifacts_corepy.common import resilience
+
+
+@pytest.fixture(autouse=True)
+def breakers(monkeypatch):
+    breakers = {}
+    monkeypatch.setattr(resilience, '_breakers', breakers)
+    monkeypatch.setattr(resilience.time, 'sleep', lambda seconds: None)
+    return breakers
+
+
+@pytest.fixture
+def clock(mocker):
+    now = [time.time()]
+    mocker.patch.object(resilience.time, 'time', side_effect=lambda: now[0])
+    return now
+
+
+class FakeResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class Sender(object):
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return FakeResponse(result)
+
+
+def _fail(breaker, times):
+    for _ in range(times):
+        breaker.acquire()
+        breaker.record_failure()
+
+
+def test_breaker_open_half_open_closed(clock):
+    breaker = resilience.CircuitBreaker('cmdb', 'cmdb:80')
+    _fail(breaker, 2)
+    assert breaker.state == resilience.CLOSED
+    _fail(breaker, 1)
+    assert breaker.state == resilience.OPEN
+    with pytest.raises(resilience.CircuitOpenError):
+        breaker.acquire()
+    clock[0] += 31
+    # 冷却后仅放行一个试探请求
+    breaker.acquire()
+    assert breaker.state == resilience.HALF_OPEN
+    with pytest.raises(resilience.CircuitOpenError):
+        breaker.acquire()
+    breaker.record_success()
+    assert breaker.state == resilience.CLOSED
+    assert breaker.failures == 0
+    breaker.acquire()
+    snapshot = breaker.snapshot()
+    assert snapshot['state_changes'] == 3
+    assert snapshot['rejected'] == 2
+
+
+def test_breaker_half_open_failure_reopens(clock):
+    breaker = resilience.CircuitBreaker('cmdb', 'cmdb:80')
+    _fail(breaker, 3)
+    clock[0] += 31
+    breaker.acquire()
+    breaker.record_failure()
+    assert breaker.state == resilience.OPEN
+    with pytest.raises(resilience.CircuitOpenError):
+        breaker.acquire()
+
+
+def test_breaker_release_frees_trial(clock):
+    breaker = resilience.CircuitBreaker('cmdb', 'cmdb:80')
+    _fail(breaker, 3)
+    clock[0] += 31
+    breaker.acquire()
+    breaker.release()
+    assert breaker.state == resilience.HALF_OPEN
+    breaker.acquire()
+
+
+def test_request_retries_idempotent_calls():
+    send = Sender(requests.ConnectionError('reset'), 503, 200)
+    resp = resilience.request('cmdb', send, 'http://cmdb/api', 'GET')
+    assert resp.status_code == 200
+    assert send.calls == 3
+    breaker = resilience.get_breaker('cmdb', 'cmdb')
+    assert breaker.state == resilience.CLOSED
+    assert breaker.snapshot()['retries'] == 2
+
+
+def test_request_does_not_retry_non_idempotent_calls():
+    send = Sender(requests.ConnectionError('reset'), 200)
+    with pytest.raises(requests.ConnectionError):
+        resilience.request('cmdb', send, 'http://cmdb/api', 'POST')
+    assert send.calls == 1
+    send = Sender(503, 200)
+    assert resilience.request('cmdb', send, 'http://cmdb/api', 'POST').status_code == 503
+    # 显式声明幂等的POST(如查询)可重试
+    send = Sender(503, 200)
+    assert resilience.request('cmdb', send, 'http://cmdb2/api', 'POST', idempotent=True).status_code == 200
+
+
+def test_request_returns_last_response_after_retries():
+    send = Sender(502, 503, 504)
+    resp = resilience.request('cmdb', send, 'http://cmdb/api', 'GET')
+    assert resp.status_code == 504
+    assert not resp.closed
+    assert send.calls == 3
+    assert resilience.get_breaker('cmdb', 'cmdb').state == resilience.OPEN
+
+
+def test_request_fails_fast_when_open():
+    _fail(resilience.get_breaker('cmdb', 'cmdb'), 3)
+    send = Sender(200)
+    with pytest.raises(resilience.CircuitOpenError):
+        resilience.request('cmdb', send, 'http://cmdb/api', 'GET')
+    assert send.calls == 0
+    # 其他主机不受影响
+    assert resilience.request('cmdb', Sender(200), 'http://cmdb2/api', 'GET').status_code == 200
+
+
+def test_request_client_error_not_counted():
+    send = Sender(ValueError('bad'))
+    with pytest.raises(ValueError):
+        resilience.request('cmdb', send, 'http://cmdb/api', 'GET')
+    assert resilience.get_breaker('cmdb', 'cmdb').snapshot()['failures'] == 0
+
+
+def test_timeouts(conf):
+    conf['resilience']['nexus'] = {'read_timeout': 10, 'transfer_read_timeout': 600}
+    conf['resilience']['default']['connect_timeout'] = 3
+    assert resilience.get_timeout('nexus', (5, 30)) == (3.0, 10.0)
+    assert resilience.get_transfer_timeout('nexus', (5, 30)) == (3.0, 600.0)
+    assert resilience.get_transfer_timeout('cmdb', (5, 30)) == (3.0, 30.0)
+    conf['resilience']['cmdb'] = {'read_timeout': 0}
+    assert resilience.get_timeout('cmdb', (5, 30)) == (3.0, None)
@@ -0,0 +1,132 @@
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import os
+import time
+
+import pytest
+
+from artifacts_corepy.apps.package import apiv2
+from artifacts_corepy.common import exceptions
+from artifacts_corepy.common import ttl_cache
+
+
+@pytest.fixture
+def clock(mocker):
+    now = [time.time()]
+    mocker.patch.object(ttl_cache.time, 'time', side_effect=lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = ttl_cache.TTLCache()
+    monkeypatch.setattr(ttl_cache, 'CACHE', cache)
+    return cache
+
+
+class Loader(object):
+    def __init__(self, *values):
+        self.values = list(values)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        value = self.values.pop(0)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+
+def test_load_once_within_ttl(cache, clock):
+    loader = Loader({'v': 1}, {'v': 2})
+    value = cache.get_or_load('citypes', 'all', loader, ttl=60)
+    value['v'] = 100
+    assert cache.get_or_load('citypes', 'all', loader, ttl=60) == {'v': 1}
+    assert loader.calls == 1
+    clock[0] += 61
+    assert cache.get_or_load('citypes', 'all', loader, ttl=60) == {'v': 2}
+    assert loader.calls == 2
+
+
+def test_ttl_zero_disables_cache(cache, conf):
+    conf['metadata_cache']['ttl']['citypes'] = 0
+    loader = Loader(1, 2)
+    assert cache.get_or_load('citypes', 'all', loader) == 1
+    assert cache.get_or_load('citypes', 'all', loader) == 2
+
+
+def test_disk_cache_shared_between_workers(cache, clock):
+    cache.get_or_load('citypes', 'all', Loader('v1'), ttl=60)
+    other = ttl_cache.TTLCache()
+    assert other.get_or_load('citypes', 'all', Loader(RuntimeError('not loaded')), ttl=60) == 'v1'
+
+
+def test_disk_cache_disabled(cache, conf, clock):
+    conf['metadata_cache']['disk_enabled'] = False
+    cache.get_or_load('citypes', 'all', Loader('v1'), ttl=60)
+    assert ttl_cache.TTLCache().get_or_load('citypes', 'all', Loader('v2'), ttl=60) == 'v2'
+
+
+def test_invalidate_visible_to_other_workers(cache, clock):
+    other = ttl_cache.TTLCache()
+    cache.get_or_load('citypes', 'all', Loader('v1'), ttl=60)
+    assert other.get_or_load('citypes', 'all', Loader('v1'), ttl=60) == 'v1'
+    clock[0] += 1
+    cache.invalidate('citypes', 'all')
+    clock[0] += 1
+    assert other.get_or_load('citypes', 'all', Loader('v2'), ttl=60) == 'v2'
+    assert cache.get_or_load('citypes', 'all', Loader('v3'), ttl=60) == 'v2'
+
+
+def test_purge_namespace(cache, clock):
+    cache.get_or_load('citypes', 'all', Loader('v1'), ttl=60)
+    cache.get_or_load('enumcodes', 'all', Loader('e1'), ttl=60)
+    clock[0] += 1
+    assert cache.purge('citypes') == ['citypes']
+    clock[0] += 1
+    assert cache.get_or_load('citypes', 'all', Loader('v2'), ttl=60) == 'v2'
+    assert cache.get_or_load('enumcodes', 'all', Loader('e2'), ttl=60) == 'e1'
+    with pytest.raises(exceptions.ValidationError):
+        cache.purge('unknown')
+
+
+def test_stale_value_returned_while_refreshing(cache, clock):
+    loader = Loader('v1', 'v2')
+    cache.get_or_load('nexus_listing', 'repo', loader, ttl=10, stale_ttl=60)
+    clock[0] += 11
+    assert cache.get_or_load('nexus_listing', 'repo', loader, ttl=10, stale_ttl=60) == 'v1'
+    for _ in range(500):
+        if loader.calls == 2 and not cache._refreshing:
+            break
+        time.sleep(0.01)
+    assert cache.get_or_load('nexus_listing', 'repo', loader, ttl=10, stale_ttl=60) == 'v2'
+    clock[0] += 100
+    with pytest.raises(IndexError):
+        # 超过stale_ttl后同步加载
+        cache.get_or_load('nexus_listing', 'repo', loader, ttl=10, stale_ttl=60)
+
+
+def test_unit_design_artifact_path_cached_per_user(cache, mocker):
+    get_artifact_path = mocker.patch.object(apiv2.UnitDesignNexusPackages, '_get_artifact_path', autospec=True,
+                                            side_effect=lambda self, guid: {'artifact_path': '/' + self.token})
+    for token in ('user-a', 'user-b', 'user-a'):
+        resource = apiv2.UnitDesignNexusPackages(server='http://gateway', token=token)
+        assert resource.get('ud-1') == {'artifact_path': '/' + token}
+    assert get_artifact_path.call_count == 2
+
+
+def test_package_statistics_cached_per_user(cache, mocker):
+    get_statistics = mocker.patch.object(apiv2.UnitDesignPackages, '_get_package_statistics', autospec=True,
+                                         side_effect=lambda self, data, guid: {'user': self.token.upper()})
+    for token in ('user-a', 'user-b', 'user-a'):
+        resource = apiv2.UnitDesignPackages(server='http://gateway', token=token)
+        assert resource.get_package_statistics({}, 'ud-1') == {'user': token.upper()}
+    assert get_statistics.call_count == 2
+    # 磁盘缓存中仅保存token摘要
+    disk_path = ttl_cache.get_disk_path()
+    for root, dirs, files in os.walk(disk_path):
+        for name in files:
+            with open(os.path.join(root, name)) as f:
+                assert 'user-a' not in f.read()
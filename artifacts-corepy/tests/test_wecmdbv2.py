@@ -0,0 +1,227 @@
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import threading
+
+import pytest
+
+from artifacts_corepy.common import exceptions
+from artifacts_corepy.common import wecmdbv2
+
+
+def _guid_query(guid):
+    return {"dialect": {"queryMode": "new"}, "filters": [{"name": "guid", "operator": "eq", "value": guid}],
+            "paging": False}
+
+
+class FakeCMDB(object):
+    '''
+    记录查询并按guid过滤返回结果，首次查询阻塞至gate被设置(模拟进行中的查询)
+    '''
+    def __init__(self, rows, block_first=False):
+        self.server = 'http://cmdb'
+        self.token = 'token'
+        self.rows = rows
+        self.queries = []
+        self.gate = threading.Event()
+        if not block_first:
+            self.gate.set()
+        self.error = None
+
+    def retrieve_direct(self, citype, query):
+        self.queries.append(query)
+        if len(self.queries) == 1:
+            assert self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        guids = query['filters'][0]['value']
+        guids = guids if isinstance(guids, list) else [guids]
+        return {'statusCode': 'OK', 'data': {'contents': [dict(r) for r in self.rows if r['guid'] in guids]}}
+
+
+def _load_async(loader, client, guid, results, window=0.2):
+    def _run():
+        try:
+            results[guid] = loader.load(client, 'deploy_package', _guid_query(guid), guid, window, 100, 5)
+        except Exception as e:
+            results[guid] = e
+
+    thread = threading.Thread(target=_run)
+    thread.start()
+    return thread
+
+
+def _wait_inflight(loader, count):
+    for _ in range(500):
+        with loader._lock:
+            if sum(loader._inflight.values()) >= count:
+                return
+        threading.Event().wait(0.01)
+    raise AssertionError('batch not started')
+
+
+def test_guid_loader_batches_queries_while_one_in_flight():
+    loader = wecmdbv2.GuidBatchLoader()
+    client = FakeCMDB([{'guid': 'g%s' % i, 'name': 'p%s' % i} for i in range(3)], block_first=True)
+    results = {}
+    threads = [_load_async(loader, client, 'g0', results)]
+    _wait_inflight(loader, 1)
+    threads.append(_load_async(loader, client, 'g1', results))
+    _wait_inflight(loader, 2)
+    threads.append(_load_async(loader, client, 'g2', results))
+    client.gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert [q['filters'][0]['operator'] for q in client.queries] == ['eq', 'in']
+    assert sorted(client.queries[1]['filters'][0]['value']) == ['g1', 'g2']
+    for i in range(3):
+        assert results['g%s' % i]['data']['contents'] == [{'guid': 'g%s' % i, 'name': 'p%s' % i}]
+    assert not loader._batches
+    assert not loader._inflight
+
+
+def test_guid_loader_waiters_get_independent_results():
+    loader = wecmdbv2.GuidBatchLoader()
+    client = FakeCMDB([{'guid': 'g1', 'name': 'p1'}], block_first=True)
+    results = {}
+    first = _load_async(loader, client, 'g0', results)
+    _wait_inflight(loader, 1)
+    values = []
+    barrier = threading.Barrier(2)
+
+    def _run():
+        barrier.wait()
+        values.append(loader.load(client, 'deploy_package', _guid_query('g1'), 'g1', 0.2, 100, 5))
+
+    threads = [threading.Thread(target=_run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    _wait_inflight(loader, 2)
+    client.gate.set()
+    for thread in threads + [first]:
+        thread.join(5)
+    assert len(client.queries) == 2
+    values[0]['data']['contents'][0]['name'] = 'modified'
+    assert values[1]['data']['contents'][0]['name'] == 'p1'
+
+
+def test_guid_loader_error_propagates_to_waiters():
+    loader = wecmdbv2.GuidBatchLoader()
+    client = FakeCMDB([], block_first=True)
+    client.error = exceptions.PluginError(message='cmdb error')
+    results = {}
+    threads = [_load_async(loader, client, 'g0', results)]
+    _wait_inflight(loader, 1)
+    threads.append(_load_async(loader, client, 'g1', results))
+    _wait_inflight(loader, 2)
+    threads.append(_load_async(loader, client, 'g2', results))
+    client.gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(client.queries) == 2
+    for guid in ('g0', 'g1', 'g2'):
+        assert isinstance(results[guid], exceptions.PluginError)
+    assert not loader._inflight
+
+
+def test_guid_loader_idle_query_not_delayed(mocker):
+    loader = wecmdbv2.GuidBatchLoader()
+    client = FakeCMDB([{'guid': 'g0'}])
+    sleep = mocker.patch.object(wecmdbv2.time, 'sleep')
+    resp_json = loader.load(client, 'deploy_package', _guid_query('g0'), 'g0', 10, 100, 5)
+    assert resp_json['data']['contents'] == [{'guid': 'g0'}]
+    sleep.assert_not_called()
+
+
+class PagedCMDB(object):
+    '''
+    按pageable返回分页数据；ignore_paging时总是返回第一页
+    '''
+    def __init__(self, total, ignore_paging=False, with_page_info=False):
+        self.rows = [{'guid': 'g%03d' % i} for i in range(total)]
+        self.ignore_paging = ignore_paging
+        self.with_page_info = with_page_info
+        self.queries = []
+
+    def __call__(self, citype, query):
+        self.queries.append(query)
+        start = 0 if self.ignore_paging else query['pageable']['startIndex']
+        data = {'contents': self.rows[start:start + query['pageable']['pageSize']]}
+        if self.with_page_info:
+            data['pageInfo'] = {'startIndex': start, 'pageSize': query['pageable']['pageSize'],
+                                'totalRows': len(self.rows)}
+        return {'statusCode': 'OK', 'data': data}
+
+
+@pytest.fixture
+def client():
+    return wecmdbv2.WeCMDBClient('http://cmdb/', 'token')
+
+
+@pytest.mark.parametrize('total', [0, 2, 3, 7])
+def test_iterate_all_pages(client, mocker, total):
+    cmdb = mocker.patch.object(client, 'retrieve_direct', side_effect=PagedCMDB(total))
+    assert [r['guid'] for r in client.iterate('deploy_package', {})] == ['g%03d' % i for i in range(total)]
+    # page_size为3，最后一页不满时结束
+    assert cmdb.call_count == total // 3 + 1
+    query = cmdb.call_args[0][1]
+    assert query['sorting'] == {"asc": True, "field": "guid"}
+    assert query['paging'] is True
+
+
+def test_iterate_stops_at_total_rows(client, mocker):
+    cmdb = mocker.patch.object(client, 'retrieve_direct', side_effect=PagedCMDB(6, with_page_info=True))
+    assert len(list(client.iterate('deploy_package', {}))) == 6
+    # 已达到totalRows，无需再请求空页
+    assert cmdb.call_count == 2
+
+
+def test_iterate_stops_when_page_repeats(client, mocker):
+    cmdb = mocker.patch.object(client, 'retrieve_direct', side_effect=PagedCMDB(10, ignore_paging=True))
+    assert [r['guid'] for r in client.iterate('deploy_package', {})] == ['g000', 'g001', 'g002']
+    assert cmdb.call_count == 2
+
+
+def test_iterate_max_pages(client, mocker, conf):
+    conf['cmdb_client']['max_pages'] = 2
+    mocker.patch.object(client, 'retrieve_direct', side_effect=PagedCMDB(10))
+    items = client.iterate('deploy_package', {})
+    with pytest.raises(exceptions.PluginError):
+        for _ in items:
+            pass
+
+
+def test_bulk_create_in_ordered_chunks(client, mocker):
+    def post(url, chunk):
+        return {'statusCode': 'OK', 'data': [dict(r, guid='guid-%s' % r['name']) for r in chunk]}
+
+    post = mocker.patch.object(client, '_post', side_effect=post)
+    data = [{'name': str(i)} for i in range(5)]
+    resp_json = client.bulk('create', 'diff_config', data)
+    # bulk_chunk_size为2
+    assert post.call_count == 3
+    assert [r['guid'] for r in resp_json['data']] == ['guid-%s' % i for i in range(5)]
+    assert post.call_args[0][0] == 'http://cmdb' + client.build_create_url('diff_config')
+
+
+def test_bulk_partial_failure_collects_row_errors(client, mocker):
+    def post(url, chunk):
+        if chunk[0]['name'] == '2':
+            return {'statusCode': 'ERROR', 'statusMessage': 'invalid',
+                    'data': [dict(r, errorMessage='duplicate key') for r in chunk]}
+        if chunk[0]['name'] == '4':
+            raise exceptions.PluginError(message='timeout')
+        return {'statusCode': 'OK', 'data': chunk}
+
+    mocker.patch.object(client, '_post', side_effect=post)
+    with pytest.raises(exceptions.BatchPartialError) as exc_info:
+        client.bulk('create', 'diff_config', [{'name': str(i)} for i in range(5)])
+    errors = exc_info.value.exception_data['data']
+    assert sorted([(e.get('name', None) or e['data']['name'], e['errorMessage']) for e in errors]) == \
+        [('2', 'duplicate key'), ('3', 'duplicate key'), ('4', 'timeout')]
+
+
+def test_bulk_invalid_operation(client):
+    with pytest.raises(exceptions.ValidationError):
+        client.bulk('delete', 'diff_config', [])